@@ -0,0 +1,274 @@
+import logging
+import time
+from functools import partial
+import dbus
+from dbus.exceptions import DBusException
+
+# Victron packages
+from ve_utils import wrap_dbus_value, unwrap_dbus_value
+
+logger = logging.getLogger(__name__)
+
+# Index of the fields in a supported settings entry
+PATH = 0
+VALUE = 1
+MINIMUM = 2
+MAXIMUM = 3
+SILENT = 4
+CALLBACK = 5 # Only in addSettingsAsync
+
+class BulkSettingsUnsupported(Exception):
+	pass
+
+def add_settings_async(settings, definitions, reply_handler):
+	""" Registers the settings in definitions like
+	    BulkSettingsDevice.addSettingsAsync does, with any settings device.
+	    Others register them one by one, and reply right away. """
+	try:
+		add = settings.addSettingsAsync
+	except AttributeError:
+		items = [settings.addSetting(*options[:SILENT], silent=options[SILENT],
+			callback=options[CALLBACK])
+			for options in definitions]
+		reply_handler(items)
+		return items
+	return add(definitions, reply_handler)
+
+class SettingItem(object):
+	""" The value of a single setting, kept up to date from the change
+	    signals of localsettings. Has the get_value and set_value methods of
+	    the VeDbusItemImport that SettingsDevice.addSetting returns. """
+	def __init__(self, settings, path, value, callback=None):
+		self.settings = settings
+		self.path = path
+		self.callback = callback
+		self._value = value
+
+	def get_value(self):
+		return self._value
+
+	def set_value(self, value):
+		self._value = value
+		self.settings._set_value(self.path, value)
+		return 0
+
+class DefaultSettings(object):
+	""" Settings that keep their defaults, and are never registered with
+	    localsettings. For a benchmark run next to the real service, which
+	    must leave the stored settings alone. """
+	def __init__(self, supportedSettings, eventCallback):
+		self._settings = {setting: SettingItem(self, options[PATH], options[VALUE])
+			for setting, options in supportedSettings.items()}
+
+	def addSettingsAsync(self, definitions, reply_handler=None):
+		items = [SettingItem(self, options[PATH], options[VALUE], options[CALLBACK])
+			for options in definitions]
+		if reply_handler is not None:
+			reply_handler(items)
+		return items
+
+	def addSetting(self, path, value, _min, _max, silent=False, callback=None):
+		return SettingItem(self, path, value, callback)
+
+	def _set_value(self, path, value):
+		pass
+
+	def __getitem__(self, setting):
+		return self._settings[setting].get_value()
+
+	def __setitem__(self, setting, newvalue):
+		self._settings[setting].set_value(newvalue)
+
+class BulkSettingsDevice(object):
+	""" Drop-in replacement for SettingsDevice that does not make several
+	    blocking calls per setting. All settings are registered with a single
+	    AddSettings call, which also replies with their values.
+	    Settings added later are registered without blocking. A single
+	    signal match picks up changes of all of them. Settings that
+	    localsettings refuses are logged, and get the default value.
+
+	    Raises BulkSettingsUnsupported if localsettings does not implement
+	    AddSettings. """
+	def __init__(self, bus, supportedSettings, eventCallback,
+			name='com.victronenergy.settings', timeout=0):
+		self._bus = bus
+		self._dbus_name = name
+		self._eventCallback = eventCallback
+		self._settings = {} # setting -> SettingItem
+		self._values = {} # setting -> last value reported by localsettings
+		self._items = {} # path -> SettingItem
+		self._names = {} # path -> setting
+
+		count = 0
+		while not bus.name_has_owner(name):
+			if count == timeout:
+				raise Exception("The settings service %s does not exist!" % name)
+			count += 1
+			logger.info('waiting for settings')
+			time.sleep(1)
+
+		# Subscribe before reading the values, so no change is missed
+		self._match = bus.add_signal_receiver(self._on_properties_changed,
+			dbus_interface='com.victronenergy.BusItem', signal_name='PropertiesChanged',
+			bus_name=name, path_keyword='path')
+		try:
+			self.addSettings(supportedSettings)
+		except BulkSettingsUnsupported:
+			self._match.remove()
+			raise
+
+	def _request(self, definitions):
+		""" Returns the AddSettings argument for definitions, a list of
+		    supported settings entries. """
+		request = []
+		for options in definitions:
+			d = {
+				'path': options[PATH],
+				'default': options[VALUE],
+				'min': options[MINIMUM],
+				'max': options[MAXIMUM]}
+			if len(options) > SILENT and options[SILENT]:
+				d['silent'] = True
+			request.append(dbus.Dictionary({k: wrap_dbus_value(v) for k, v in d.items()},
+				signature='sv'))
+		return [dbus.Array(request, signature='a{sv}')]
+
+	def _results(self, results):
+		""" Returns the paths that failed in the reply to AddSettings, and
+		    the values of the others that are in the reply. """
+		failed = set()
+		values = {}
+		for result in results:
+			path = str(result.get('path'))
+			error = result.get('error', 0)
+			if error != 0:
+				logger.error('Cannot add setting %s, error %s', path, error)
+				failed.add(path)
+			elif 'value' in result:
+				values[path] = unwrap_dbus_value(result['value'])
+		return failed, values
+
+	def _add_settings(self, definitions):
+		""" Registers the settings in definitions, a list of supported
+		    settings entries, and returns the paths that failed and the
+		    values of the others that are in the reply. """
+		try:
+			results = self._bus.call_blocking(self._dbus_name, '/',
+				'com.victronenergy.Settings', 'AddSettings', 'aa{sv}',
+				self._request(definitions))
+		except DBusException as e:
+			if e.get_dbus_name() == 'org.freedesktop.DBus.Error.UnknownMethod':
+				raise BulkSettingsUnsupported()
+			raise
+		return self._results(results)
+
+	def addSettings(self, settings):
+		failed, values = self._add_settings(settings.values())
+
+		# Older versions of localsettings leave the value out
+		for options in settings.values():
+			path = options[PATH]
+			if path not in failed and path not in values:
+				values[path] = unwrap_dbus_value(self._bus.call_blocking(self._dbus_name,
+					path, 'com.victronenergy.BusItem', 'GetValue', '', []))
+
+		for setting, options in settings.items():
+			path = options[PATH]
+			value = values.get(path)
+			if value is None:
+				logger.error('No value for setting %s, using the default', path)
+				value = options[VALUE]
+			item = SettingItem(self, path, value)
+			self._settings[setting] = self._items[path] = item
+			self._names[path] = setting
+			self._values[setting] = value
+
+	def addSettingsAsync(self, definitions, reply_handler=None):
+		""" Registers the settings in definitions, a list of (path, default,
+		    min, max, silent, callback) tuples, with a single asynchronous
+		    AddSettings call. Returns their items right away,
+		    holding the defaults. Once localsettings has replied the items
+		    hold the stored values, and reply_handler is called with the
+		    items. Settings that localsettings refuses keep the default. """
+		items = []
+		for options in definitions:
+			item = SettingItem(self, options[PATH], options[VALUE], options[CALLBACK])
+			self._items[item.path] = item
+			items.append(item)
+
+		def added(results):
+			failed, values = self._results(results)
+			# Older versions of localsettings leave the value out
+			missing = [i for i in items if i.path not in failed and i.path not in values]
+			for item in items:
+				if item.path in values and self._items.get(item.path) is item:
+					item._value = values[item.path]
+			if not missing:
+				if reply_handler is not None:
+					reply_handler(items)
+				return
+
+			def read(item, value=None):
+				missing.remove(item)
+				if value is not None and self._items.get(item.path) is item:
+					item._value = unwrap_dbus_value(value)
+				if not missing and reply_handler is not None:
+					reply_handler(items)
+
+			def read_failed(item, e):
+				logger.error('Cannot read setting %s: %s', item.path, e)
+				read(item)
+
+			for item in list(missing):
+				self._bus.call_async(self._dbus_name, item.path,
+					'com.victronenergy.BusItem', 'GetValue', '', [],
+					partial(read, item), partial(read_failed, item))
+
+		def add_failed(e):
+			logger.error('Cannot add settings %s: %s',
+				', '.join(i.path for i in items), e)
+			if reply_handler is not None:
+				reply_handler(items)
+
+		self._bus.call_async(self._dbus_name, '/', 'com.victronenergy.Settings',
+			'AddSettings', 'aa{sv}', self._request(definitions), added, add_failed)
+		return items
+
+	def addSetting(self, path, value, _min, _max, silent=False, callback=None):
+		""" Registers a single setting without waiting for localsettings.
+		    The item holds the default until the stored value is in, which
+		    is then passed to callback like any other change. """
+		def added(items):
+			item = items[0]
+			if item.callback is not None and item.get_value() != value:
+				item.callback(self._dbus_name, path, {'Value': item.get_value()})
+		return self.addSettingsAsync([(path, value, _min, _max, silent, callback)], added)[0]
+
+	def _set_value(self, path, value):
+		def error_handler(e):
+			logger.error('Cannot set %s to %s: %s', path, value, e)
+
+		self._bus.call_async(self._dbus_name, path, 'com.victronenergy.BusItem',
+			'SetValue', 'v', [wrap_dbus_value(value)], lambda *args: None, error_handler)
+
+	def _on_properties_changed(self, changes, path=None):
+		item = self._items.get(path)
+		if item is None or 'Value' not in changes:
+			return
+		value = unwrap_dbus_value(changes['Value'])
+		item._value = value
+		if item.callback is not None:
+			item.callback(self._dbus_name, path, changes)
+
+		setting = self._names.get(path)
+		if setting is not None:
+			oldvalue = self._values.get(setting)
+			self._values[setting] = value
+			if self._eventCallback is not None:
+				self._eventCallback(setting, oldvalue, value)
+
+	def __getitem__(self, setting):
+		return self._settings[setting].get_value()
+
+	def __setitem__(self, setting, newvalue):
+		self._settings[setting].set_value(newvalue)
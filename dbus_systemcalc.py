@@ -1,35 +1,230 @@
 #!/usr/bin/python3 -u
 # -*- coding: utf-8 -*-
 
+import sys
+import time
+
+# With --benchmark-startup, time the import of every module. The times
+# include the modules imported by that module.
+_import_times = {}
+if __name__ == "__main__" and '--benchmark-startup' in sys.argv:
+	import builtins
+	def _timed_import(name, *args, _import=builtins.__import__, **kwargs):
+		if name in sys.modules:
+			return _import(name, *args, **kwargs)
+		start = time.monotonic()
+		try:
+			return _import(name, *args, **kwargs)
+		finally:
+			_import_times.setdefault(name, time.monotonic() - start)
+	builtins.__import__ = _timed_import
+
 from dbus.mainloop.glib import DBusGMainLoop
 import dbus
+import dbus.service
 import argparse
-import sys
 import os
 import json
-import time
 import re
+import tempfile
+from functools import partial
 from gi.repository import GLib
 
 # Victron packages
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'ext', 'velib_python'))
 from vedbus import VeDbusService
-from ve_utils import get_vrm_portal_id, exit_on_error
-from dbusmonitor import DbusMonitor
+from ve_utils import get_vrm_portal_id, unwrap_dbus_value
+from dbusmonitor import DbusMonitor, MonitoredValue
 from settingsdevice import SettingsDevice
+from bulksettings import BulkSettingsDevice, BulkSettingsUnsupported, DefaultSettings
 from logger import setup_logging
 import delegates
-from sc_utils import safeadd as _safeadd, safemax as _safemax
+from sc_utils import safeadd as _safeadd, safemax as _safemax, ChangeLog, ObservedService, ServiceId, ServiceAggregate, loop_monitor, exit_on_error, crash_handlers, Quiescence, TickBudget
+from writecollector import WriteCollector, BlockingCallLogger
+from profiler import Profiler
+from flightrecorder import FlightRecorder
+from warmstart import WarmStart, WARMSTART_INTERVAL, WARMSTART_GRACE, WARMSTART_SKIP
 
 softwareVersion = '2.207'
 
+# Number of distinct changed paths remembered for GetChangesSince
+CHANGELOG_SIZE = 1024
+
+# Startup is timed per stage and published as /Debug/Startup/<stage>, in
+# milliseconds. Registered and FirstPublish are the time from the start to
+# claiming the service name, and to publishing the first computed values.
+STARTUP_STAGES = ('Settings', 'Monitor', 'Service', 'Registered', 'Devices',
+	'FirstUpdate', 'FirstPublish')
+
+# /Debug/MainLoopLag is refreshed at least every this many ticks, and right
+# away when a timer fires late.
+LOOP_LAG_PUBLISH_TICKS = 60
+
+# After this many ticks without a meaningful change of the inputs, timers
+# for work that can wait are stretched. These are only the slow timers of
+# BatteryData, SourceTimers and RelayState. The one second main tick and the
+# DVCC loop keep their interval: the control loops must see a change within
+# a second, and a tick without changes already skips the recalculation.
+IDLE_AFTER = 60
+
+# What counts as a meaningful change, by the last part of the path. Power in
+# W and current in A. Any change of state, and of what a BMS asks for, ends
+# idle mode right away. So does any change of an alarm.
+IDLE_DEADBANDS = {
+	'P': 50, 'Power': 50, 'I': 2, 'Current': 2,
+	'State': 0, 'Mode': 0, 'ActiveInput': 0, 'Connected': 0, 'ErrorCode': 0,
+	'MaxChargeVoltage': 0, 'MaxChargeCurrent': 0, 'MaxDischargeCurrent': 0,
+	'BatteryLowVoltage': 0, 'AllowToCharge': 0, 'AllowToDischarge': 0}
+
+# Work that can wait is deferred when a tick takes longer than this, in
+# milliseconds.
+TICK_BUDGET = 200
+
+# The paths of a feature that is switched off stay monitored for this many
+# ticks, so that it can wind down.
+FEATURE_DETACH_TICKS = 60
+
+# Paths that decide whether a service counts as connected, and paths whose
+# validity (None or not) plays a role in selecting the battery service.
+TOPOLOGY_PATHS = ('/Connected', '/ProductName', '/Mgmt/Connection')
+TOPOLOGY_VALIDITY_PATHS = ('/Info/MaxChargeVoltage', '/Soc', '/ExtraBatteryCurrent')
+
+def _compile_gettext(gettext):
+	""" Turns the gettext field of an output item into a function that
+	    formats a value. """
+	if gettext is None:
+		return str
+	if callable(gettext):
+		return gettext
+	return gettext.__mod__
+
+class PhasePaths(object):
+	""" The paths used for one phase in the AC calculations, formatted
+	    once instead of on every update. """
+	def __init__(self, phase):
+		self.phase = phase
+		self.power = '/Ac/%s/Power' % phase
+		self.current = '/Ac/%s/Current' % phase
+		self.active_in_p = '/Ac/ActiveIn/%s/P' % phase
+		self.active_in_i = '/Ac/ActiveIn/%s/I' % phase
+		self.active_in_power = '/Ac/ActiveIn/%s/Power' % phase
+		self.active_in_current = '/Ac/ActiveIn/%s/Current' % phase
+		self.inverter_in_p = ['/Ac/In/%d/%s/P' % (n, phase) for n in (1, 2)]
+		self.inverter_in_i = ['/Ac/In/%d/%s/I' % (n, phase) for n in (1, 2)]
+		self.out_p = '/Ac/Out/%s/P' % phase
+		self.out_i = '/Ac/Out/%s/I' % phase
+		self.out_s = '/Ac/Out/%s/S' % phase
+		self.out_v = '/Ac/Out/%s/V' % phase
+		self.pv_power = {t: '/Ac/PvOn%s/%s/Power' % (t, phase) for t in ('Grid', 'Genset', 'Output')}
+		self.pv_current = {t: '/Ac/PvOn%s/%s/Current' % (t, phase) for t in ('Grid', 'Genset', 'Output')}
+		self.source_power = {t: '/Ac/%s/%s/Power' % (t, phase) for t in ('Grid', 'Genset')}
+		self.source_current = {t: '/Ac/%s/%s/Current' % (t, phase) for t in ('Grid', 'Genset')}
+		self.consumption_power = '/Ac/Consumption/%s/Power' % phase
+		self.consumption_current = '/Ac/Consumption/%s/Current' % phase
+		self.consumption_on_input_power = '/Ac/ConsumptionOnInput/%s/Power' % phase
+		self.consumption_on_input_current = '/Ac/ConsumptionOnInput/%s/Current' % phase
+		self.consumption_on_output_power = '/Ac/ConsumptionOnOutput/%s/Power' % phase
+		self.consumption_on_output_current = '/Ac/ConsumptionOnOutput/%s/Current' % phase
+
+PHASE_PATHS = tuple(PhasePaths(phase) for phase in ('L1', 'L2', 'L3'))
+
+# Functions used to keep running totals of DC sources and loads, see
+# ServiceAggregate. The totals come out like the loop over the services
+# used to give them.
+def _measure_solarcharger(monitor, service):
+	v = monitor.get_value(service, '/Dc/0/Voltage')
+	if v is None:
+		return None
+	i = monitor.get_value(service, '/Dc/0/Current')
+	if i is None:
+		return None
+	l = monitor.get_value(service, '/Load/I', 0)
+	terms = {
+		'charge_power': v * i,
+		# Note that /Dc/Pv/ChargeCurrent is not in the _summeditems{},
+		# making for it to not be published on D-Bus. Which fine. The only
+		# one needing it is the vebussocwriter-delegate.
+		'/Dc/Pv/ChargeCurrent': i,
+		'/Dc/Pv/Power': v * _safeadd(i, l),
+		'/Dc/Pv/Current': _safeadd(i, l)}
+	if l is not None:
+		terms['loadoutput_power'] = l * v
+	return terms, (service, v)
+
+def _finish_solarchargers(sums, first, last):
+	voltage_service, voltage = first or (None, None)
+	return {
+		'values': {p: sums[p] for p in ('/Dc/Pv/ChargeCurrent', '/Dc/Pv/Power',
+			'/Dc/Pv/Current') if p in sums},
+		'voltage': voltage, 'voltage_service': voltage_service,
+		'charge_power': sums.get('charge_power', 0),
+		'loadoutput_power': sums.get('loadoutput_power')}
+
+def _dcsource_measure(path):
+	def measure(monitor, service):
+		# Assume the battery connected to output 0 is the main battery
+		v = monitor.get_value(service, '/Dc/0/Voltage')
+		if v is None:
+			return None
+		i = monitor.get_value(service, '/Dc/0/Current')
+		return ({} if i is None else {path: v * i}), (service, v)
+	return measure
+
+def _finish_dcsources(sums, first, last):
+	voltage_service, voltage = last or (None, None)
+	return {'values': sums, 'voltage': voltage, 'voltage_service': voltage_service}
+
+def _measure_alternator(monitor, service):
+	p = monitor.get_value(service, '/Dc/0/Power')
+	return None if p is None else ({'/Dc/Alternator/Power': p}, None)
+
+def _finish_alternators(sums, first, last):
+	return {'values': sums}
+
+def _measure_dcsystem(monitor, service):
+	terms = {}
+	for key, path in (('power', '/Dc/0/Power'), ('current', '/Dc/0/Current')):
+		v = monitor.get_value(service, path)
+		if v is not None:
+			terms[key] = v
+	return terms, None
+
+def _finish_dcsystems(sums, first, last):
+	return {'power': sums.get('power', 0), 'current': sums.get('current', 0)}
+
+def _add_input(tree, inputs, options):
+	""" Adds inputs, a list of (service, paths) as returned by get_input,
+	    to a dbus tree. """
+	for service, paths in inputs:
+		s = tree.setdefault(service, {})
+		for path in paths:
+			s[path] = options
+
 class SystemCalc:
 	STATE_IDLE = 0
 	STATE_CHARGING = 1
 	STATE_DISCHARGING = 2
 	BATSERVICE_DEFAULT = 'default'
 	BATSERVICE_NOBATTERY = 'nobattery'
-	def __init__(self):
+
+	# Monitor the paths of a feature only while it is switched on. This
+	# needs a monitor with add_paths and remove_paths.
+	gate_features = True
+
+	def __init__(self, warmstart=None, idle_after=None, tick_budget=None):
+		self._startup_begin = self._stage_begin = time.monotonic()
+		self._startup_times = {}
+
+		# Stretch timers after idle_after ticks without a meaningful change,
+		# None never does.
+		self._idle_after = idle_after
+		self._quiet_ticks = 0
+		self._quiescence = Quiescence(IDLE_DEADBANDS)
+
+		# Bookkeeping is deferred when a tick takes longer than tick_budget
+		# seconds, None never defers.
+		self._tick_budget = TickBudget(tick_budget)
+
 		# Why this dummy? Because DbusMonitor expects these values to be there, even though we don't
 		# need them. So just add some dummy data. This can go away when DbusMonitor is more generic.
 		dummy = {'code': None, 'whenToLog': 'configChange', 'accessLevel': None}
@@ -205,7 +400,7 @@ class SystemCalc:
 			delegates.ServiceMapper(),
 			delegates.RelayState(),
 			delegates.BuzzerControl(),
-			delegates.LgCircuitBreakerDetect(),
+			delegates.LgCircuitBreakerDetect(self),
 			delegates.BatterySoc(self),
 			delegates.Dvcc(self),
 			delegates.BatterySense(self),
@@ -214,26 +409,43 @@ class SystemCalc:
 			delegates.BatteryLife(),
 			delegates.ScheduledCharging(),
 			delegates.SourceTimers(),
-			delegates.BatteryData(),
+			delegates.BatteryData(self),
 			delegates.Gps(),
 			delegates.AcInputs(),
 			delegates.GensetStartStop(),
 			delegates.SocSync(self),
 			delegates.PvInverters(),
 			delegates.BatteryService(self),
-			delegates.CanBatterySense(),
+			delegates.CanBatterySense(self),
 			delegates.InverterCharger(),
 			delegates.DynamicEss(),
 			delegates.LoadShedding()]
 
+		# Route device and value events only to the delegates that handle
+		# that class of service.
+		self._service_ids = {}
+		self._device_routes = self._make_routes(
+			'device_added', 'device_removed', 'devices_changed')
+		self._value_routes = self._make_routes('value_changed')
+
+		# Paths used by features that can be switched off are only
+		# monitored while the setting that switches them is not 0.
+		self._feature_inputs = {}
+		self._feature_detach = {}
 		for m in self._modules:
-			for service, paths in m.get_input():
-				s = dbus_tree.setdefault(service, {})
-				for path in paths:
-					s[path] = dummy
-
-		self._dbusmonitor = self._create_dbus_monitor(dbus_tree, valueChangedCallback=self._dbus_value_changed,
-			deviceAddedCallback=self._device_added, deviceRemovedCallback=self._device_removed)
+			_add_input(dbus_tree, m.get_input(), dummy)
+			setting, inputs = m.get_feature_input()
+			if setting is not None:
+				self._feature_inputs.setdefault(setting, []).extend(inputs)
+				# Know the services up front, so paths can be added to them
+				# without scanning the bus.
+				for service, paths in inputs:
+					dbus_tree.setdefault(service, {})
+		self._base_tree = {service: dict(paths) for service, paths in dbus_tree.items()}
+		self._input_options = dummy
+
+		# The last ticks, for a post-mortem when we exit on an error
+		self.recorder = FlightRecorder()
 
 		# Connect to localsettings
 		supported_settings = {
@@ -259,11 +471,75 @@ class SystemCalc:
 				supported_settings[setting[0]] = list(setting[1:])
 
 		self._settings = self._create_settings(supported_settings, self._handlechangedsetting)
+		self._stage_done('Settings')
+		self._setting_paths = {name: setting[0] for name, setting in supported_settings.items()}
+		self.recorder.settings = {path: self._settings[name]
+			for name, path in self._setting_paths.items()}
+		_add_input(dbus_tree, (i for setting, inputs in self._feature_inputs.items()
+			if self._settings[setting] or not self.gate_features for i in inputs), dummy)
+		self._dbus_tree = dbus_tree
 
-		self._dbusservice = self._create_dbus_service()
+		self._dbusmonitor = self._create_dbus_monitor(dbus_tree, valueChangedCallback=self._dbus_value_changed,
+			deviceAddedCallback=self._device_added, deviceRemovedCallback=self._device_removed)
+		self._stage_done('Monitor')
+
+		# Writes to other services are collected during a tick and sent
+		# grouped by service.
+		self.writer = self._create_write_collector()
+		self.writer.recorder = self.recorder
+		self._blocking_calls = BlockingCallLogger()
+		self.profiler = Profiler(tempfile.gettempdir())
+		self._profile_timer = None
+
+		self._phase_power_paths = {}
+		self._ac_contributions = None
+
+		# Running totals of DC sources and loads, kept up to date from
+		# _dbus_value_changed.
+		self._dc_aggregates = {
+			'solarcharger': ServiceAggregate(self._dbusmonitor,
+				('/Dc/0/Voltage', '/Dc/0/Current', '/Load/I'),
+				_measure_solarcharger, _finish_solarchargers),
+			'fuelcell': ServiceAggregate(self._dbusmonitor,
+				('/Dc/0/Voltage', '/Dc/0/Current'),
+				_dcsource_measure('/Dc/FuelCell/Power'), _finish_dcsources),
+			'alternator': ServiceAggregate(self._dbusmonitor,
+				('/Dc/0/Power',), _measure_alternator, _finish_alternators),
+			'charger': ServiceAggregate(self._dbusmonitor,
+				('/Dc/0/Voltage', '/Dc/0/Current'),
+				_dcsource_measure('/Dc/Charger/Power'), _finish_dcsources),
+			'dcsystem': ServiceAggregate(self._dbusmonitor,
+				('/Dc/0/Power', '/Dc/0/Current'),
+				_measure_dcsystem, _finish_dcsystems),
+		}
 
+		# Start the sequence numbers at the current time, so that a client
+		# that saw a previous instance of this service is always told to
+		# resync.
+		self._changelog = ChangeLog(CHANGELOG_SIZE, int(time.time() * 1000))
+
+		# Bumped whenever something changes that affects battery service
+		# selection. Results derived from the topology are cached against it.
+		self._topology_version = 0
+		self._valid_topology_paths = set()
+		self._autoselect_cache = None
+		self._readable_names = {}
+		self._available_services_version = None
+		self._available_services = None
+
+		# Every path we publish goes into the change log, no matter who sets it
+		self._dbusservice = ObservedService(self._create_dbus_service(),
+			self._output_changed)
+
+		self._delegate_times = {}
 		for m in self._modules:
+			start = time.monotonic()
 			m.set_sources(self._dbusmonitor, self._settings, self._dbusservice)
+			self._delegate_times[type(m).__name__] = time.monotonic() - start
+
+		# Text formatters for our paths, and the last text produced for each
+		self._formatters = {}
+		self._texts = {}
 
 		# At this moment, VRM portal ID is the MAC address of the CCGX. Anyhow, it should be string uniquely
 		# identifying the CCGX.
@@ -280,6 +556,17 @@ class SystemCalc:
 			'/ActiveBatteryService', value=None, gettextcallback=self._gettext)
 		self._dbusservice.add_path(
 			'/Dc/Battery/BatteryService', value=None)
+		self._dbusservice.add_path('/Debug/Writes', value=None)
+		self._dbusservice.add_path('/Debug/MainLoopLag', value=None)
+		self._dbusservice.add_path('/Debug/TickDeferrals', value=0)
+		self._dbusservice.add_path('/Debug/Profile/Run', value=0, writeable=True,
+			onchangecallback=lambda p, v: exit_on_error(self._on_profile_run_changed, v))
+		self._dbusservice.add_path('/Debug/Profile/Output', value=None)
+		self._loop_lag_ticks = 0
+		self._dbusservice.add_path('/Debug/LogBlockingCalls', value=0, writeable=True,
+			onchangecallback=lambda p, v: exit_on_error(self._on_log_blocking_calls_changed, v))
+		for stage in STARTUP_STAGES:
+			self._dbusservice.add_path('/Debug/Startup/' + stage, value=None)
 		self._summeditems = {
 			'/Ac/Grid/L1/Power': {'gettext': '%.0F W'},
 			'/Ac/Grid/L2/Power': {'gettext': '%.0F W'},
@@ -353,9 +640,24 @@ class SystemCalc:
 		for m in self._modules:
 			self._summeditems.update(m.get_output())
 
-		for path in self._summeditems.keys():
+		for path, item in self._summeditems.items():
+			self._formatters[path] = _compile_gettext(item.get('gettext'))
 			self._dbusservice.add_path(path, value=None, gettextcallback=self._gettext)
 
+		# Restore what was published before a restart, so GUI and VRM see
+		# no gap. Delegates read the restored values as invalid, so they
+		# never act on them. Live data replaces them, what has none after
+		# WARMSTART_GRACE ticks is invalidated. /WarmStart/Paths lists the
+		# paths that still show a restored value.
+		self._warmstart = warmstart
+		self._warm_ticks = 0
+		self._warm_stale = 0
+		self._dbusservice.add_path('/WarmStart/Stale', value=0)
+		self._dbusservice.add_path('/WarmStart/Paths', value=None)
+		snapshot = None if warmstart is None else warmstart.load()
+		if snapshot is not None:
+			self._restore_warm_start(snapshot)
+
 		self._batteryservice = None
 		self._determinebatteryservice()
 
@@ -364,32 +666,143 @@ class SystemCalc:
 				self._settings['batteryservice'])
 
 		self._changed = True
+		self._devices_added = []
+		self._devices_removed = []
+		self._device_changes_scheduled = False
+		self._stage_done('Service')
+
+		# Claim the service name as soon as all paths exist. Services that
+		# depend on us can start while we pick up the devices already on
+		# the bus and compute the first values, one stage per main loop
+		# iteration.
+		self._dbusservice.register()
+		self._startup_times['Registered'] = self._since_startup()
+		self._startup_stages = [self._startup_devices, self._startup_first_update]
+		GLib.idle_add(exit_on_error, self._continue_startup)
+		# Not adaptive: DVCC, ESS and the other control loops work on the
+		# values published here.
+		loop_monitor.timeout_add(1000, exit_on_error, self._handletimertick)
+
+	def _since_startup(self):
+		return round((time.monotonic() - self._startup_begin) * 1000)
+
+	def _stage_done(self, stage):
+		now = time.monotonic()
+		self._startup_times[stage] = round((now - self._stage_begin) * 1000)
+		self._stage_begin = now
+
+	def _continue_startup(self):
+		if self._startup_stages:
+			self._startup_stages.pop(0)()
+		return bool(self._startup_stages)
+
+	def _finish_startup(self):
+		while self._startup_stages:
+			self._startup_stages.pop(0)()
+
+	def _startup_devices(self):
+		self._stage_begin = time.monotonic()
+		# Services that appeared since the monitor was created are already
+		# known.
 		for service, instance in self._dbusmonitor.get_service_list().items():
-			self._device_added(service, instance, do_service_change=False)
+			if service not in self._service_ids:
+				self._device_added(service, instance, do_service_change=False)
+		self._process_device_changes()
+		self._stage_done('Devices')
 
-		self._handleservicechange()
+	def _startup_first_update(self):
+		self._stage_begin = time.monotonic()
 		self._updatevalues()
-
-		self._dbusservice.register()
-		GLib.timeout_add(1000, exit_on_error, self._handletimertick)
+		self._changed = False
+		self._stage_done('FirstUpdate')
+		self._startup_times['FirstPublish'] = self._since_startup()
+		for stage, ms in self._startup_times.items():
+			self._dbusservice['/Debug/Startup/' + stage] = ms
+		logger.info('Startup took %d ms, registered after %d ms',
+			self._startup_times['FirstPublish'], self._startup_times['Registered'])
 
 	def _create_dbus_monitor(self, *args, **kwargs):
 		raise Exception("This function should be overridden")
 
+	def _make_routes(self, *hooks):
+		""" Returns a dictionary of service class to the delegates that
+		    implement at least one of hooks, and handle that class. Delegates
+		    that handle all classes are found under None, which is also the
+		    route for any class that no delegate names explicitly. """
+		modules = [m for m in self._modules if any(
+			getattr(type(m), h) is not getattr(delegates.SystemCalcDelegate, h)
+			for h in hooks)]
+		classes = set(c for m in modules for c in (m.service_classes or ()))
+		routes = {c: [m for m in modules if m.service_classes is None or
+			c in m.service_classes] for c in classes}
+		routes[None] = [m for m in modules if m.service_classes is None]
+		return routes
+
+	def _get_service_id(self, service, instance=None):
+		try:
+			return self._service_ids[service]
+		except KeyError:
+			return ServiceId.parse(service, instance)
+
+	def _route(self, routes, service):
+		sc = self._get_service_id(service).service_class
+		return routes.get(sc, routes[None])
+
 	def _create_settings(self, *args, **kwargs):
 		raise Exception("This function should be overridden")
 
+	def _create_write_collector(self):
+		return WriteCollector(self._dbusmonitor)
+
 	def _create_dbus_service(self):
 		raise Exception("This function should be overridden")
 
 	def _handlechangedsetting(self, setting, oldvalue, newvalue):
-		self._determinebatteryservice()
+		self.recorder.record('setting', self._setting_paths.get(setting, setting), newvalue)
+		self._activity()
+		if self.gate_features and setting in self._feature_inputs and \
+				bool(oldvalue) != bool(newvalue):
+			if newvalue:
+				self._feature_detach.pop(setting, None)
+				self._update_subscriptions()
+			else:
+				self._feature_detach[setting] = FEATURE_DETACH_TICKS
+		if setting in ('batteryservice', 'hasdcsystem'):
+			self._determinebatteryservice()
 		self._changed = True
 
 		# Give our delegates a chance to react on a settings change
 		for m in self._modules:
 			m.settings_changed(setting, oldvalue, newvalue)
 
+	def _update_subscriptions(self):
+		""" Brings the paths the monitor watches in line with the features
+		    that are switched on, or still winding down. """
+		tree = {service: dict(paths) for service, paths in self._base_tree.items()}
+		_add_input(tree, (i for setting, inputs in self._feature_inputs.items()
+			if self._settings[setting] or setting in self._feature_detach
+			for i in inputs), self._input_options)
+
+		added = {}
+		removed = {}
+		for service in set(tree) | set(self._dbus_tree):
+			new = tree.get(service, {})
+			old = self._dbus_tree.get(service, {})
+			paths = {p: o for p, o in new.items() if p not in old}
+			if paths:
+				added[service] = paths
+			paths = {p: o for p, o in old.items() if p not in new}
+			if paths:
+				removed[service] = paths
+
+		if added:
+			logger.info('Monitoring %d more paths', sum(len(p) for p in added.values()))
+			self._dbusmonitor.add_paths(added)
+		if removed:
+			logger.info('No longer monitoring %d paths', sum(len(p) for p in removed.values()))
+			self._dbusmonitor.remove_paths(removed)
+		self._dbus_tree = tree
+
 	def _find_device_instance(self, serviceclass, instance):
 		""" Gets a mapping of services vs DeviceInstance using
 		    get_service_list.  Then searches for the specified DeviceInstance
@@ -411,21 +824,21 @@ class SystemCalc:
 				auto_battery_measurement = \
 					self._get_instance_service_name(auto_battery_service, services[auto_battery_service])
 				auto_battery_measurement = auto_battery_measurement.replace('.', '_').replace('/', '_') + '/Dc/0'
-		self._dbusservice['/AutoSelectedBatteryMeasurement'] = auto_battery_measurement
+		self._publish('/AutoSelectedBatteryMeasurement', auto_battery_measurement)
 
 		if self._settings['batteryservice'] == self.BATSERVICE_DEFAULT:
 			auto_selected = True
 			newbatteryservice = auto_battery_service
-			self._dbusservice['/AutoSelectedBatteryService'] = (
+			self._publish('/AutoSelectedBatteryService', (
 				'No battery monitor found' if newbatteryservice is None else
-				self._get_readable_service_name(newbatteryservice))
+				self._get_readable_service_name(newbatteryservice)))
 
 		elif self._settings['batteryservice'] == self.BATSERVICE_NOBATTERY:
-			self._dbusservice['/AutoSelectedBatteryService'] = None
+			self._publish('/AutoSelectedBatteryService', None)
 			newbatteryservice = None
 
 		else:
-			self._dbusservice['/AutoSelectedBatteryService'] = None
+			self._publish('/AutoSelectedBatteryService', None)
 
 			s = self._settings['batteryservice'].split('/')
 			if len(s) != 2:
@@ -445,16 +858,25 @@ class SystemCalc:
 				battery_service = None
 			else:
 				battery_service = self._get_instance_service_name(newbatteryservice, instance)
-			self._dbusservice['/ActiveBatteryService'] = battery_service
+			self._publish('/ActiveBatteryService', battery_service)
 			logger.info("Battery service, setting == %s, changed from %s to %s (%s)" %
 				(self._settings['batteryservice'], self._batteryservice, newbatteryservice, instance))
 
 			# Battery service has changed. Notify delegates.
-			self._dbusservice['/Dc/Battery/BatteryService'] = self._batteryservice = newbatteryservice
+			self._batteryservice = newbatteryservice
+			self._publish('/Dc/Battery/BatteryService', newbatteryservice)
 			for m in self._modules:
 				m.battery_service_changed(auto_selected, self._batteryservice, newbatteryservice)
 
 	def _autoselect_battery_service(self):
+		# The selection only changes when the topology does, or when the
+		# hasdcsystem setting changes.
+		key = (self._topology_version, self._settings['hasdcsystem'])
+		if self._autoselect_cache is None or self._autoselect_cache[0] != key:
+			self._autoselect_cache = (key, self._compute_autoselect_battery_service())
+		return self._autoselect_cache[1]
+
+	def _compute_autoselect_battery_service(self):
 		# Default setting business logic:
 		# first try to use a battery service (BMV or Lynx Shunt VE.Can). If there
 		# is more than one battery service, just use a random one. If no battery service is
@@ -511,14 +933,143 @@ class SystemCalc:
 	def batteryservice(self):
 		return self._batteryservice
 
+	def _on_log_blocking_calls_changed(self, value):
+		try:
+			enable = int(value) == 1
+		except (TypeError, ValueError):
+			return False
+		if enable:
+			self._blocking_calls.enable()
+		else:
+			self._blocking_calls.disable()
+		return True
+
+	def _on_profile_run_changed(self, value):
+		""" Writing N to /Debug/Profile/Run profiles the next N seconds,
+		    writing 0 stops a running profile early. """
+		try:
+			seconds = int(value)
+		except (TypeError, ValueError):
+			return False
+		if seconds < 0:
+			return False
+		if self._profile_timer is not None:
+			GLib.source_remove(self._profile_timer)
+			self._profile_timer = None
+		if seconds == 0:
+			self._stop_profile()
+			return True
+		if not self.profiler.running and not self.profiler.start():
+			return False
+		self._profile_timer = GLib.timeout_add(seconds * 1000, exit_on_error, self._stop_profile)
+		return True
+
+	def _stop_profile(self):
+		self._profile_timer = None
+		output = self.profiler.stop()
+		if output is not None:
+			self._dbusservice['/Debug/Profile/Output'] = output
+		self._dbusservice['/Debug/Profile/Run'] = 0
+		return False
+
+	def _restore_warm_start(self, snapshot):
+		self._dbusservice.restore({path: value for path, value in snapshot['outputs'].items()
+			if not path.startswith(WARMSTART_SKIP)})
+		self._publish_warm_paths()
+		for m in self._modules:
+			state = snapshot['delegates'].get(type(m).__name__)
+			if state is None:
+				continue
+			try:
+				m.set_state(state)
+			except (KeyError, TypeError, ValueError, AttributeError):
+				logger.warning('Cannot restore the state of %s', type(m).__name__)
+		logger.info('Warm start, restored %d outputs', len(self._dbusservice.restored))
+
+	def _publish_warm_paths(self):
+		""" Publishes which paths still show a restored value. """
+		restored = self._dbusservice.restored
+		self._warm_stale = len(restored)
+		self._dbusservice['/WarmStart/Stale'] = len(restored)
+		self._dbusservice['/WarmStart/Paths'] = json.dumps(sorted(restored)) \
+			if restored else None
+
+	def _save_warm_start(self):
+		delegate_states = {}
+		for m in self._modules:
+			state = m.get_state()
+			if state is not None:
+				delegate_states[type(m).__name__] = state
+		service = self._dbusservice
+		self._warmstart.save(
+			{path: service.published(path) for path in list(service._dbusobjects)
+				if not path.startswith(WARMSTART_SKIP)},
+			delegate_states)
+
+	def dump_flight_recorder(self, filename):
+		self.recorder.dump(filename)
+		logger.error('Last %d ticks written to %s', len(self.recorder.ticks), filename)
+
 	# Called on a one second timer
 	def _handletimertick(self):
+		self._tick_budget.begin()
+
+		# Make sure startup is complete and no hotplug events are left
+		# unprocessed before calculating.
+		self._finish_startup()
+		self._process_device_changes()
+
 		if self._changed:
 			self._updatevalues()
 		self._changed = False
 
+		# Statistics of the writes to other services, as JSON
+		if self.writer.changed:
+			self.writer.changed = False
+			self._tick_budget.run('writes', self._publish_json, '/Debug/Writes', self.writer.stats)
+
+		# How late timers on the main loop fire, and what held them up
+		self._loop_lag_ticks += 1
+		if loop_monitor.changed or self._loop_lag_ticks >= LOOP_LAG_PUBLISH_TICKS:
+			loop_monitor.changed = False
+			self._loop_lag_ticks = 0
+			self._tick_budget.run('looplag', self._publish_json, '/Debug/MainLoopLag', loop_monitor.stats)
+
+		if self._warmstart is not None:
+			self._warm_ticks += 1
+			if self._dbusservice.restored and self._warm_ticks >= WARMSTART_GRACE:
+				# Whatever has no live data by now, really has none
+				self._dbusservice.expire_restored()
+			if len(self._dbusservice.restored) != self._warm_stale:
+				self._publish_warm_paths()
+			if self._warm_ticks % WARMSTART_INTERVAL == 0:
+				self._tick_budget.run('warmstart', self._save_warm_start)
+
+		if self._idle_after is not None and not loop_monitor.idle:
+			self._quiet_ticks += 1
+			if self._quiet_ticks >= self._idle_after:
+				logger.debug('Inputs are quiet, stretching timers')
+				loop_monitor.set_idle(True)
+
+		# Features that were switched off have had time to wind down
+		if self._feature_detach:
+			for setting in list(self._feature_detach):
+				self._feature_detach[setting] -= 1
+				if self._feature_detach[setting] <= 0:
+					del self._feature_detach[setting]
+					self._update_subscriptions()
+
+		if self._tick_budget.changed:
+			self._tick_budget.changed = False
+			self._dbusservice['/Debug/TickDeferrals'] = self._tick_budget.deferrals
+		self._tick_budget.end()
+
+		self.recorder.tick()
 		return True  # keep timer running
 
+	def _publish_json(self, path, stats):
+		self._dbusservice[path] = json.dumps(stats())
+
 	def _updatevalues(self):
 		# ==== PREPARATIONS ====
 		newvalues = {}
@@ -552,102 +1103,27 @@ class SystemCalc:
 		self._compute_number_of_phases('/Ac/PvOnGenset', newvalues)
 
 		# ==== SOLARCHARGERS ====
-		solarchargers = self._dbusmonitor.get_service_list('com.victronenergy.solarcharger')
-		solarcharger_batteryvoltage = None
-		solarcharger_batteryvoltage_service = None
-		solarchargers_charge_power = 0
-		solarchargers_loadoutput_power = None
-
-		for solarcharger in solarchargers:
-			v = self._dbusmonitor.get_value(solarcharger, '/Dc/0/Voltage')
-			if v is None:
-				continue
-			i = self._dbusmonitor.get_value(solarcharger, '/Dc/0/Current')
-			if i is None:
-				continue
-			l = self._dbusmonitor.get_value(solarcharger, '/Load/I', 0)
-
-			if l is not None:
-				if solarchargers_loadoutput_power is None:
-					solarchargers_loadoutput_power = l * v
-				else:
-					solarchargers_loadoutput_power += l * v
-
-			solarchargers_charge_power += v * i
-
-			# Note that this path is not in the _summeditems{}, making for it to not be
-			# published on D-Bus. Which fine. The only one needing it is the vebussocwriter-
-			# delegate.
-			if '/Dc/Pv/ChargeCurrent' not in newvalues:
-				newvalues['/Dc/Pv/ChargeCurrent'] = i
-			else:
-				newvalues['/Dc/Pv/ChargeCurrent'] += i
-
-			if '/Dc/Pv/Power' not in newvalues:
-				newvalues['/Dc/Pv/Power'] = v * _safeadd(i, l)
-				newvalues['/Dc/Pv/Current'] = _safeadd(i, l)
-				solarcharger_batteryvoltage = v
-				solarcharger_batteryvoltage_service = solarcharger
-			else:
-				newvalues['/Dc/Pv/Power'] += v * _safeadd(i, l)
-				newvalues['/Dc/Pv/Current'] += _safeadd(i, l)
+		totals = self._dc_aggregates['solarcharger'].totals
+		newvalues.update(totals['values'])
+		solarcharger_batteryvoltage = totals['voltage']
+		solarcharger_batteryvoltage_service = totals['voltage_service']
+		solarchargers_charge_power = totals['charge_power']
+		solarchargers_loadoutput_power = totals['loadoutput_power']
 
 		# ==== FUELCELLS ====
-		fuelcells = self._dbusmonitor.get_service_list('com.victronenergy.fuelcell')
-		fuelcell_batteryvoltage = None
-		fuelcell_batteryvoltage_service = None
-		for fuelcell in fuelcells:
-			# Assume the battery connected to output 0 is the main battery
-			v = self._dbusmonitor.get_value(fuelcell, '/Dc/0/Voltage')
-			if v is None:
-				continue
-
-			fuelcell_batteryvoltage = v
-			fuelcell_batteryvoltage_service = fuelcell
-
-			i = self._dbusmonitor.get_value(fuelcell, '/Dc/0/Current')
-			if i is None:
-				continue
-
-			if '/Dc/FuelCell/Power' not in newvalues:
-				newvalues['/Dc/FuelCell/Power'] = v * i
-			else:
-				newvalues['/Dc/FuelCell/Power'] += v * i
+		totals = self._dc_aggregates['fuelcell'].totals
+		newvalues.update(totals['values'])
+		fuelcell_batteryvoltage = totals['voltage']
+		fuelcell_batteryvoltage_service = totals['voltage_service']
 
 		# ==== ALTERNATOR ====
-		alternators = self._dbusmonitor.get_service_list('com.victronenergy.alternator')
-		for alternator in alternators:
-			# Assume the battery connected to output 0 is the main battery
-			p = self._dbusmonitor.get_value(alternator, '/Dc/0/Power')
-			if p is None:
-				continue
-
-			if '/Dc/Alternator/Power' not in newvalues:
-				newvalues['/Dc/Alternator/Power'] = p
-			else:
-				newvalues['/Dc/Alternator/Power'] += p
+		newvalues.update(self._dc_aggregates['alternator'].totals['values'])
 
 		# ==== CHARGERS ====
-		chargers = self._dbusmonitor.get_service_list('com.victronenergy.charger')
-		charger_batteryvoltage = None
-		charger_batteryvoltage_service = None
-		for charger in chargers:
-			# Assume the battery connected to output 0 is the main battery
-			v = self._dbusmonitor.get_value(charger, '/Dc/0/Voltage')
-			if v is None:
-				continue
-
-			charger_batteryvoltage = v
-			charger_batteryvoltage_service = charger
-
-			i = self._dbusmonitor.get_value(charger, '/Dc/0/Current')
-			if i is None:
-				continue
-
-			if '/Dc/Charger/Power' not in newvalues:
-				newvalues['/Dc/Charger/Power'] = v * i
-			else:
-				newvalues['/Dc/Charger/Power'] += v * i
+		totals = self._dc_aggregates['charger'].totals
+		newvalues.update(totals['values'])
+		charger_batteryvoltage = totals['voltage']
+		charger_batteryvoltage_service = totals['voltage_service']
 
 		# ==== Other Inverters and Inverter/Chargers ====
 		_other_inverters = sorted((di, s) for s, di in self._dbusmonitor.get_service_list('com.victronenergy.multi').items()) + \
@@ -752,8 +1228,7 @@ class SystemCalc:
 			# is not available. We can however calculate it from other values,
 			# if we have at least a battery voltage.
 			if '/Dc/Battery/Voltage' in newvalues:
-				dcsystempower = _safeadd(0, *(self._dbusmonitor.get_value(s,
-					'/Dc/0/Power', 0) for s in dcsystems))
+				dcsystempower = self._dc_aggregates['dcsystem'].totals['power']
 				if dcsystems or self._settings['hasdcsystem'] == 0:
 					# Either DC loads are monitored, or there are no
 					# unmonitored DC loads or chargers: derive battery watts
@@ -768,14 +1243,10 @@ class SystemCalc:
 		# Look for dcsytem devices, add them together. Otherwise, if enabled,
 		# calculate it
 		if dcsystems:
+			totals = self._dc_aggregates['dcsystem'].totals
 			newvalues['/Dc/System/MeasurementType'] = 1 # measured
-			newvalues['/Dc/System/Power'] = 0
-			newvalues['/Dc/System/Current'] = 0
-			for meter in dcsystems:
-				newvalues['/Dc/System/Power'] = _safeadd(newvalues['/Dc/System/Power'],
-					self._dbusmonitor.get_value(meter, '/Dc/0/Power'))
-				newvalues['/Dc/System/Current'] = _safeadd(newvalues['/Dc/System/Current'],
-					self._dbusmonitor.get_value(meter, '/Dc/0/Current'))
+			newvalues['/Dc/System/Power'] = totals['power']
+			newvalues['/Dc/System/Current'] = totals['current']
 		elif self._settings['hasdcsystem'] == 1 and batteryservicetype == 'battery':
 			# Calculate power being generated/consumed by not measured devices in the network.
 			# For MPPTs, take all the power, including power going out of the load output.
@@ -861,6 +1332,11 @@ class SystemCalc:
 			elif grid_meter is None and genset_meter is not None:
 				ac_in_guess = 2
 
+		# The contributing (service, path) pairs only change with the
+		# topology, look them up once.
+		inverter_inputs, inverter_outputs = self._get_ac_contributions(
+			non_vebus_inverters, active_input)
+
 		consumption = { "L1" : None, "L2" : None, "L3" : None }
 		currentconsumption = { "L1" : None, "L2" : None, "L3" : None }
 		for device_type, em, _types in (('Grid', grid_meter, (1, 3)), ('Genset', genset_meter, (2,))):
@@ -870,14 +1346,15 @@ class SystemCalc:
 			# com.victronenergy.vebus.???/Ac/ActiveIn/ActiveInput: decides which whether we look at AcIn1
 			# or AcIn2 as possible grid connection.
 			uses_active_input = ac_in_source in _types
-			for phase in consumption:
+			for paths in PHASE_PATHS:
+				phase = paths.phase
 				p = None
 				mc = None
-				pvpower = newvalues.get('/Ac/PvOn%s/%s/Power' % (device_type, phase))
-				pvcurrent = newvalues.get('/Ac/PvOn%s/%s/Current' % (device_type, phase))
+				pvpower = newvalues.get(paths.pv_power[device_type])
+				pvcurrent = newvalues.get(paths.pv_current[device_type])
 				if em is not None:
-					p = self._dbusmonitor.get_value(em.service, '/Ac/%s/Power' % phase)
-					mc = self._dbusmonitor.get_value(em.service, '/Ac/%s/Current' % phase)
+					p = self._dbusmonitor.get_value(em.service, paths.power)
+					mc = self._dbusmonitor.get_value(em.service, paths.current)
 					# Compute consumption between energy meter and multi (meter power - multi AC in) and
 					# add an optional PV inverter on input to the mix.
 					c = None
@@ -885,15 +1362,15 @@ class SystemCalc:
 					if uses_active_input:
 						if multi_path is not None:
 							try:
-								c = _safeadd(c, -self._dbusmonitor.get_value(multi_path, '/Ac/ActiveIn/%s/P' % phase))
-								cc = _safeadd(cc, -self._dbusmonitor.get_value(multi_path, '/Ac/ActiveIn/%s/I' % phase))
+								c = _safeadd(c, -self._dbusmonitor.get_value(multi_path, paths.active_in_p))
+								cc = _safeadd(cc, -self._dbusmonitor.get_value(multi_path, paths.active_in_i))
 							except TypeError:
 								pass
 						elif non_vebus_inverter is not None and active_input in (0, 1):
-							for i in non_vebus_inverters:
+							for i, ppath, ipath in inverter_inputs[phase]:
 								try:
-									c = _safeadd(c, -self._dbusmonitor.get_value(i, '/Ac/In/%d/%s/P' % (active_input+1, phase)))
-									cc = _safeadd(cc, -self._dbusmonitor.get_value(i, '/Ac/In/%d/%s/I' % (active_input+1, phase)))
+									c = _safeadd(c, -self._dbusmonitor.get_value(i, ppath))
+									cc = _safeadd(cc, -self._dbusmonitor.get_value(i, ipath))
 								except TypeError:
 									pass
 
@@ -907,16 +1384,14 @@ class SystemCalc:
 				else:
 					if uses_active_input:
 						if multi_path is not None  and (
-								p := self._dbusmonitor.get_value(multi_path, '/Ac/ActiveIn/%s/P' % phase)) is not None:
+								p := self._dbusmonitor.get_value(multi_path, paths.active_in_p)) is not None:
 							consumption[phase] = _safeadd(0, consumption[phase])
 							currentconsumption[phase] = _safeadd(0, currentconsumption[phase])
-							mc = self._dbusmonitor.get_value(multi_path, '/Ac/ActiveIn/%s/I' % phase)
+							mc = self._dbusmonitor.get_value(multi_path, paths.active_in_i)
 						elif non_vebus_inverter is not None and active_input in (0, 1):
-							for i in non_vebus_inverters:
-								p = _safeadd(p,
-									self._dbusmonitor.get_value(i, '/Ac/In/%d/%s/P' % (active_input + 1, phase)))
-								mc = _safeadd(mc,
-									self._dbusmonitor.get_value(i, '/Ac/In/%d/%s/I' % (active_input + 1, phase)))
+							for i, ppath, ipath in inverter_inputs[phase]:
+								p = _safeadd(p, self._dbusmonitor.get_value(i, ppath))
+								mc = _safeadd(mc, self._dbusmonitor.get_value(i, ipath))
 							if p is not None:
 								consumption[phase] = _safeadd(0, consumption[phase])
 								currentconsumption[phase] = _safeadd(0, currentconsumption[phase])
@@ -929,11 +1404,11 @@ class SystemCalc:
 					except TypeError:
 						pass
 
-				newvalues['/Ac/%s/%s/Power' % (device_type, phase)] = p
-				newvalues['/Ac/%s/%s/Current' % (device_type, phase)] = mc
+				newvalues[paths.source_power[device_type]] = p
+				newvalues[paths.source_current[device_type]] = mc
 				if ac_in_guess in _types:
-					newvalues['/Ac/ActiveIn/%s/Power' % (phase,)] = p
-					newvalues['/Ac/ActiveIn/%s/Current' % (phase,)] = mc
+					newvalues[paths.active_in_power] = p
+					newvalues[paths.active_in_current] = mc
 
 			self._compute_number_of_phases('/Ac/%s' % device_type, newvalues)
 			self._compute_number_of_phases('/Ac/ActiveIn', newvalues)
@@ -964,23 +1439,24 @@ class SystemCalc:
 			self._settings['useacout'] == 1 or \
 			(multi_path is not None and self._dbusmonitor.get_value(multi_path, '/Hub4/AssistantId') not in (4, 5)) or \
 			self._dbusmonitor.get_value('com.victronenergy.settings', '/Settings/CGwacs/RunWithoutGridMeter') == 1
-		for phase in consumption:
+		for paths in PHASE_PATHS:
+			phase = paths.phase
 			c = None
 			a = None
 			if use_ac_out:
-				c = newvalues.get('/Ac/PvOnOutput/%s/Power' % phase)
-				a = newvalues.get('/Ac/PvOnOutput/%s/Current' % phase)
+				c = newvalues.get(paths.pv_power['Output'])
+				a = newvalues.get(paths.pv_current['Output'])
 				if multi_path is None:
-					for inv in non_vebus_inverters:
-						ac_out = self._dbusmonitor.get_value(inv, '/Ac/Out/%s/P' % phase)
-						i = self._dbusmonitor.get_value(inv, '/Ac/Out/%s/I' % phase)
+					for inv, ppath, ipath, spath, upath in inverter_outputs[phase]:
+						ac_out = self._dbusmonitor.get_value(inv, ppath)
+						i = self._dbusmonitor.get_value(inv, ipath)
 
 						# Some models don't show power, try apparent power,
 						# else calculate it
 						if ac_out is None:
-							ac_out = self._dbusmonitor.get_value(inv, '/Ac/Out/%s/S' % phase)
+							ac_out = self._dbusmonitor.get_value(inv, spath)
 							if ac_out is None:
-								u = self._dbusmonitor.get_value(inv, '/Ac/Out/%s/V' % phase)
+								u = self._dbusmonitor.get_value(inv, upath)
 								if None not in (i, u):
 									ac_out = i * u
 						c = _safeadd(c, ac_out)
@@ -990,25 +1466,25 @@ class SystemCalc:
 					ac_out = (
 						self._dbusmonitor.get_value('com.victronenergy.vebus.ttyS4', '/Devices/0/Ac/Out/P') if phase == "L1" else
 						self._dbusmonitor.get_value('com.victronenergy.vebus.ttyS4', '/Devices/3/Ac/Out/P') if phase == "L2" else
-						self._dbusmonitor.get_value(multi_path, '/Ac/Out/%s/P' % phase)
+						self._dbusmonitor.get_value(multi_path, paths.out_p)
 					)
 					ac_out = ac_out if ac_out not in (None, 0.0) else None  # Handle 0.0 as None
 					c = _safeadd(c, ac_out)
 					i_out = (
 						float(ac_out) / 230 if phase in ["L1", "L2"] and ac_out not in (None, 0.0) else
-						self._dbusmonitor.get_value(multi_path, '/Ac/Out/%s/I' % phase)
+						self._dbusmonitor.get_value(multi_path, paths.out_i)
 					)
 					i_out = i_out if i_out not in (None, 0.0) else None  # Handle 0.0 as None
 					a = _safeadd(a, i_out)
 				c = _safemax(0, c)
 				a = _safemax(0, a)
-			newvalues['/Ac/ConsumptionOnOutput/%s/Power' % phase] = c
-			newvalues['/Ac/ConsumptionOnOutput/%s/Current' % phase] = a
-			newvalues['/Ac/Consumption/%s/Power' % phase] = _safeadd(consumption[phase], c)
-			newvalues['/Ac/Consumption/%s/Current' % phase] = _safeadd(currentconsumption[phase], a)
+			newvalues[paths.consumption_on_output_power] = c
+			newvalues[paths.consumption_on_output_current] = a
+			newvalues[paths.consumption_power] = _safeadd(consumption[phase], c)
+			newvalues[paths.consumption_current] = _safeadd(currentconsumption[phase], a)
 			if has_ac_in_system:
-				newvalues['/Ac/ConsumptionOnInput/%s/Power' % phase] = consumption[phase]
-				newvalues['/Ac/ConsumptionOnInput/%s/Current' % phase] = currentconsumption[phase]
+				newvalues[paths.consumption_on_input_power] = consumption[phase]
+				newvalues[paths.consumption_on_input_current] = currentconsumption[phase]
 
 		self._compute_number_of_phases('/Ac/Consumption', newvalues)
 		self._compute_number_of_phases('/Ac/ConsumptionOnOutput', newvalues)
@@ -1017,75 +1493,12 @@ class SystemCalc:
 		for m in self._modules:
 			m.update_values(newvalues)
 
+		# Send the writes the delegates made, grouped by service
+		self.writer.flush()
+
 		# ==== UPDATE MINIMUM AND MAXIMUM LEVELS ====
-		if (self._settings['gaugeautomax']):
-			# min/max values are stored and updated in localsettings
-			# values are stored under /Settings/Gui/Briefview
-			# /Settings/Gui/Gauges/AutoMax:
-			#	1-> Automatic: Gauge limits are updated automatically and stored in localsettings
-			# 	0-> Manual: Gauge limits are entered manually by the user
-			# The gui pulls the gauge limits from localsettings and provides
-			# a means for the user to set them if Automax is off.
-
-			# AC output
-			# This maximum is maintained for 3 situations:
-			# 1: AC input 1 is connected
-			# 2: AC input 2 is connected
-			# 3: No AC input is connected
-			# All 3 scenarios may lead to different maximum values since the capabilities of the system changes.
-			# So 3 different maxima are stored and relayed to /Ac/Consumption/Current/Max based on the active scenario.
-			activeIn = 'acin1' if (self._dbusservice['/Ac/In/0/Connected'] == 1) else \
-						'acin2' if (self._dbusservice['/Ac/In/1/Connected'] == 1) else \
-						'noacin'
-
-			# Quattro has 2 AC inputs which cannot be active simultaneously.
-			# activeIn needs to 1 when 'Ac/In/1/Connected' is 1 and can be 0 otherwise.
-			activeInNr = int(activeIn[-1]) -1 if activeIn != 'noacin' else None
-
-			# AC input
-			# Minimum values occur when feeding back to the grid.
-			# For the minimum value, make sure it is 0 at its maximum.
-			# Update correct '/Ac/In/..' based on the current active input.
-			# When no inputs are active, paths '/Ac/In/[0/1]/Current/[Min/Max] will all be invalidated.
-			if(activeInNr != None):
-				self._settings['acin%smin' % activeInNr] = min(0,
-																	self._settings['acin%smin' % activeInNr] or float("inf"),
-																	newvalues.get('/Ac/ActiveIn/L1/Current') or float("inf"),
-																	newvalues.get('/Ac/ActiveIn/L2/Current') or float("inf"),
-																	newvalues.get('/Ac/ActiveIn/L3/Current') or float("inf"))
-
-				self._settings['acin%smax' % activeInNr] = max(self._settings['acin%smax' % activeInNr] or 0,
-																	newvalues.get('/Ac/ActiveIn/L1/Current') or 0,
-																	newvalues.get('/Ac/ActiveIn/L2/Current') or 0,
-																	newvalues.get('/Ac/ActiveIn/L3/Current') or 0)
-
-			self._settings['%sconnmax' % activeIn] = max(self._settings['%sconnmax' % activeIn],
-																newvalues.get('/Ac/Consumption/L1/Current') or 0,
-																newvalues.get('/Ac/Consumption/L2/Current') or 0,
-																newvalues.get('/Ac/Consumption/L3/Current') or 0)
-
-			# DC input
-			self._settings['dcinmax'] = max(self._settings['dcinmax'] or 0,
-													sum([newvalues.get('/Dc/Charger/Power') or 0,
-														newvalues.get('/Dc/FuelCell/Power') or 0,
-														newvalues.get('/Dc/Alternator/Power') or 0]))
-
-			# DC output
-			self._settings['dcsysmax'] = _safemax(self._settings['dcsysmax'] or 0,
-															newvalues.get('/Dc/System/Power') or 0)
-
-			# PV power
-			self._settings['pvmax'] = _safemax(self._settings['pvmax'] or 0,
-													_safeadd(newvalues.get('/Dc/Pv/Power') or 0,
-													self._dbusservice['/Ac/PvOnGrid/L1/Power'],
-													self._dbusservice['/Ac/PvOnGrid/L2/Power'],
-													self._dbusservice['/Ac/PvOnGrid/L3/Power'],
-													self._dbusservice['/Ac/PvOnGenset/L1/Power'],
-													self._dbusservice['/Ac/PvOnGenset/L2/Power'],
-													self._dbusservice['/Ac/PvOnGenset/L3/Power'],
-													self._dbusservice['/Ac/PvOnOutput/L1/Power'],
-													self._dbusservice['/Ac/PvOnOutput/L2/Power'],
-													self._dbusservice['/Ac/PvOnOutput/L3/Power']))
+		# Bookkeeping, waits when the tick is over budget
+		self._tick_budget.run('gauges', self._update_gauge_maxima, newvalues)
 
 		# ==== UPDATE DBUS ITEMS ====
 		with self._dbusservice as sss:
@@ -1093,7 +1506,90 @@ class SystemCalc:
 				# Why the None? Because we want to invalidate things we don't have anymore.
 				sss[path] = newvalues.get(path, None)
 
+	def _update_gauge_maxima(self, newvalues):
+		if not self._settings['gaugeautomax']:
+			return
+
+		# min/max values are stored and updated in localsettings
+		# values are stored under /Settings/Gui/Briefview
+		# /Settings/Gui/Gauges/AutoMax:
+		#	1-> Automatic: Gauge limits are updated automatically and stored in localsettings
+		# 	0-> Manual: Gauge limits are entered manually by the user
+		# The gui pulls the gauge limits from localsettings and provides
+		# a means for the user to set them if Automax is off.
+
+		# AC output
+		# This maximum is maintained for 3 situations:
+		# 1: AC input 1 is connected
+		# 2: AC input 2 is connected
+		# 3: No AC input is connected
+		# All 3 scenarios may lead to different maximum values since the capabilities of the system changes.
+		# So 3 different maxima are stored and relayed to /Ac/Consumption/Current/Max based on the active scenario.
+		activeIn = 'acin1' if (self._dbusservice['/Ac/In/0/Connected'] == 1) else \
+					'acin2' if (self._dbusservice['/Ac/In/1/Connected'] == 1) else \
+					'noacin'
+
+		# Quattro has 2 AC inputs which cannot be active simultaneously.
+		# activeIn needs to 1 when 'Ac/In/1/Connected' is 1 and can be 0 otherwise.
+		activeInNr = int(activeIn[-1]) -1 if activeIn != 'noacin' else None
+
+		# AC input
+		# Minimum values occur when feeding back to the grid.
+		# For the minimum value, make sure it is 0 at its maximum.
+		# Update correct '/Ac/In/..' based on the current active input.
+		# When no inputs are active, paths '/Ac/In/[0/1]/Current/[Min/Max] will all be invalidated.
+		if(activeInNr != None):
+			self._settings['acin%smin' % activeInNr] = min(0,
+																self._settings['acin%smin' % activeInNr] or float("inf"),
+																newvalues.get('/Ac/ActiveIn/L1/Current') or float("inf"),
+																newvalues.get('/Ac/ActiveIn/L2/Current') or float("inf"),
+																newvalues.get('/Ac/ActiveIn/L3/Current') or float("inf"))
+
+			self._settings['acin%smax' % activeInNr] = max(self._settings['acin%smax' % activeInNr] or 0,
+																newvalues.get('/Ac/ActiveIn/L1/Current') or 0,
+																newvalues.get('/Ac/ActiveIn/L2/Current') or 0,
+																newvalues.get('/Ac/ActiveIn/L3/Current') or 0)
+
+		self._settings['%sconnmax' % activeIn] = max(self._settings['%sconnmax' % activeIn],
+															newvalues.get('/Ac/Consumption/L1/Current') or 0,
+															newvalues.get('/Ac/Consumption/L2/Current') or 0,
+															newvalues.get('/Ac/Consumption/L3/Current') or 0)
+
+		# DC input
+		self._settings['dcinmax'] = max(self._settings['dcinmax'] or 0,
+												sum([newvalues.get('/Dc/Charger/Power') or 0,
+													newvalues.get('/Dc/FuelCell/Power') or 0,
+													newvalues.get('/Dc/Alternator/Power') or 0]))
+
+		# DC output
+		self._settings['dcsysmax'] = _safemax(self._settings['dcsysmax'] or 0,
+														newvalues.get('/Dc/System/Power') or 0)
+
+		# PV power
+		self._settings['pvmax'] = _safemax(self._settings['pvmax'] or 0,
+												_safeadd(newvalues.get('/Dc/Pv/Power') or 0,
+												self._dbusservice['/Ac/PvOnGrid/L1/Power'],
+												self._dbusservice['/Ac/PvOnGrid/L2/Power'],
+												self._dbusservice['/Ac/PvOnGrid/L3/Power'],
+												self._dbusservice['/Ac/PvOnGenset/L1/Power'],
+												self._dbusservice['/Ac/PvOnGenset/L2/Power'],
+												self._dbusservice['/Ac/PvOnGenset/L3/Power'],
+												self._dbusservice['/Ac/PvOnOutput/L1/Power'],
+												self._dbusservice['/Ac/PvOnOutput/L2/Power'],
+												self._dbusservice['/Ac/PvOnOutput/L3/Power']))
+
 	def _handleservicechange(self):
+		# The lists below only change with the topology. VE.Bus /State
+		# changes often while charging, don't rebuild them for that.
+		if self._available_services_version != self._topology_version:
+			self._available_services_version = self._topology_version
+			self._update_available_battery_services()
+
+		self._determinebatteryservice()
+
+		self._changed = True
+
+	def _update_available_battery_services(self):
 		# Update the available battery monitor services, used to populate the dropdown in the settings.
 		# Below code makes a dictionary. The key is [dbuserviceclass]/[deviceinstance]. For example
 		# "battery/245". The value is the name to show to the user in the dropdown. The full dbus-
@@ -1107,11 +1603,19 @@ class SystemCalc:
 		services.update({k: v for k, v in self._get_connected_service_list(
 			'com.victronenergy.inverter').items() if self._dbusmonitor.get_value(k, '/Soc') is not None})
 
+		# Nothing to do if the same services with the same names are still
+		# there.
+		available = [(servicename, instance, self._get_readable_service_name(servicename))
+			for servicename, instance in services.items()]
+		if available == self._available_services:
+			return
+		self._available_services = available
+
 		ul = {self.BATSERVICE_DEFAULT: 'Automatic', self.BATSERVICE_NOBATTERY: 'No battery monitor'}
 		for servicename, instance in services.items():
 			key = self._get_instance_service_name(servicename, instance)
 			ul[key] = self._get_readable_service_name(servicename)
-		self._dbusservice['/AvailableBatteryServices'] = json.dumps(ul)
+		self._publish('/AvailableBatteryServices', json.dumps(ul))
 
 		ul = {self.BATSERVICE_DEFAULT: 'Automatic', self.BATSERVICE_NOBATTERY: 'No battery monitor'}
 		# For later: for device supporting multiple Dc measurement we should add entries for /Dc/1 etc as
@@ -1119,16 +1623,49 @@ class SystemCalc:
 		for servicename, instance in services.items():
 			key = self._get_instance_service_name(servicename, instance).replace('.', '_').replace('/', '_') + '/Dc/0'
 			ul[key] = self._get_readable_service_name(servicename)
-		self._dbusservice['/AvailableBatteryMeasurements'] = ul
-
-		self._determinebatteryservice()
-
-		self._changed = True
+		self._publish('/AvailableBatteryMeasurements', ul)
+
+	def _publish(self, path, value):
+		""" Sets one of our own paths if the value changed. """
+		if self._dbusservice[path] != value:
+			self._dbusservice[path] = value
+
+	def _output_changed(self, path, value):
+		""" Called for every path of ours that is added, removed or
+		    changed, also when a delegate sets it. """
+		self._changelog.add(path)
+		self.recorder.record('output', path, value)
+
+	def get_changes_since(self, seq):
+		""" Returns the current sequence number, and a list of paths that
+		    changed after seq. The list is None if the change log does not go
+		    back that far, in which case the caller must fall back to
+		    GetItems. Paths changed by clients over D-Bus are not logged. """
+		return self._changelog.seq, self._changelog.changes_since(seq)
 
 	def _get_readable_service_name(self, servicename):
-		return '%s on %s' % (
-			self._dbusmonitor.get_value(servicename, '/ProductName'),
-			self._dbusmonitor.get_value(servicename, '/Mgmt/Connection'))
+		try:
+			return self._readable_names[servicename]
+		except KeyError:
+			name = self._readable_names[servicename] = '%s on %s' % (
+				self._dbusmonitor.get_value(servicename, '/ProductName'),
+				self._dbusmonitor.get_value(servicename, '/Mgmt/Connection'))
+			return name
+
+	def _topology_changed(self):
+		self._topology_version += 1
+		self._readable_names.clear()
+
+	def _update_topology_validity(self, service, path):
+		""" Bumps the topology version if path on service went from invalid
+		    to valid or the other way round. """
+		valid = self._dbusmonitor.get_value(service, path) is not None
+		if valid != ((service, path) in self._valid_topology_paths):
+			if valid:
+				self._valid_topology_paths.add((service, path))
+			else:
+				self._valid_topology_paths.discard((service, path))
+			self._topology_changed()
 
 	def _get_instance_service_name(self, service, instance):
 		return '%s/%s' % ('.'.join(service.split('.')[0:3]), instance)
@@ -1144,14 +1681,41 @@ class SystemCalc:
 				or self._dbusmonitor.get_value(servicename, '/Mgmt/Connection') is None):
 				del services[servicename]
 
+	def _activity(self):
+		""" Something meaningful happened, run at the normal pace. """
+		self._quiet_ticks = 0
+		if loop_monitor.idle and self._idle_after is not None:
+			logger.debug('Inputs changed, timers back to normal')
+			loop_monitor.set_idle(False)
+
 	def _dbus_value_changed(self, dbusServiceName, dbusPath, dict, changes, deviceInstance):
 		self._changed = True
+		value = self._dbusmonitor.get_value(dbusServiceName, dbusPath)
+		self.recorder.record('value', dbusServiceName, dbusPath, value)
+		if self._idle_after is not None and (dbusPath.startswith('/Alarms/') or
+				self._quiescence.changed(dbusServiceName, dbusPath, value)):
+			self._activity()
+
+		if dbusPath in TOPOLOGY_VALIDITY_PATHS:
+			self._update_topology_validity(dbusServiceName, dbusPath)
 
 		# Workaround because com.victronenergy.vebus is available even when there is no vebus product
 		# connected.
-		if (dbusPath in ['/Connected', '/ProductName', '/Mgmt/Connection'] or
-			(dbusPath == '/State' and dbusServiceName.split('.')[0:3] == ['com', 'victronenergy', 'vebus'])):
+		if dbusPath in TOPOLOGY_PATHS:
+			self._topology_changed()
 			self._handleservicechange()
+		elif dbusPath == '/State' and self._get_service_id(dbusServiceName).service_class == 'vebus':
+			self._handleservicechange()
+
+		sc = self._get_service_id(dbusServiceName).service_class
+		aggregate = self._dc_aggregates.get(sc)
+		if aggregate is not None:
+			aggregate.update(dbusServiceName, dbusPath)
+
+		modules = self._value_routes.get(sc, self._value_routes[None])
+		if modules:
+			for m in modules:
+				m.value_changed(dbusServiceName, dbusPath, value)
 
 		# Track the timezone changes
 		if dbusPath == '/Settings/System/TimeZone':
@@ -1161,39 +1725,123 @@ class SystemCalc:
 				time.tzset()
 
 	def _device_added(self, service, instance, do_service_change=True):
-		if do_service_change:
-			self._handleservicechange()
-
-		for m in self._modules:
+		self.recorder.record('added', service, instance, {path: self._dbusmonitor.get_value(service, path)
+			for path in self._dbus_tree.get('.'.join(service.split('.')[:3]), ())})
+		self._activity()
+		self._service_ids[service] = ServiceId.parse(service, instance)
+		for path in TOPOLOGY_VALIDITY_PATHS:
+			if self._dbusmonitor.get_value(service, path) is not None:
+				self._valid_topology_paths.add((service, path))
+		self._topology_changed()
+
+		aggregate = self._dc_aggregates.get(self._service_ids[service].service_class)
+		if aggregate is not None:
+			aggregate.add(service)
+
+		for m in self._route(self._device_routes, service):
 			m.device_added(service, instance, do_service_change)
 
+		self._devices_added.append((service, instance))
+		if do_service_change:
+			self._schedule_device_changes()
+
 	def _device_removed(self, service, instance):
+		self.recorder.record('removed', service)
+		self._activity()
+		self._valid_topology_paths = set(
+			p for p in self._valid_topology_paths if p[0] != service)
+		self._topology_changed()
+
+		aggregate = self._dc_aggregates.get(self._get_service_id(service).service_class)
+		if aggregate is not None:
+			aggregate.remove(service)
+
+		for m in self._route(self._device_routes, service):
+			m.device_removed(service, instance)
+		self._service_ids.pop(service, None)
+		self.writer.service_removed(service)
+
+		self._devices_removed.append((service, instance))
+		self._schedule_device_changes()
+
+	def _schedule_device_changes(self):
+		# When a VE.Can bus or USB hub comes up, many services appear at
+		# once. Handle the service change only once for all of them, on the
+		# next main loop iteration.
+		if not self._device_changes_scheduled:
+			self._device_changes_scheduled = True
+			GLib.idle_add(exit_on_error, self._process_device_changes)
+
+	def _process_device_changes(self):
+		self._device_changes_scheduled = False
+		if not (self._devices_added or self._devices_removed):
+			return False
+
+		added, self._devices_added = self._devices_added, []
+		removed, self._devices_removed = self._devices_removed, []
+
 		self._handleservicechange()
 
+		# Each delegate only hears about the services it handles
+		routed = {}
+		for i, changes in enumerate((added, removed)):
+			for service, instance in changes:
+				for m in self._route(self._device_routes, service):
+					routed.setdefault(m, ([], []))[i].append((service, instance))
+
 		for m in self._modules:
-			m.device_removed(service, instance)
+			if m in routed:
+				m.devices_changed(*routed[m])
+
+		return False
 
 	def _gettext(self, path, value):
-		item = self._summeditems.get(path)
-		if item is not None:
-			try:
-				gettext = item['gettext']
-			except KeyError:
-				pass
-			else:
-				if callable(gettext):
-					return gettext(value)
-				return gettext % value
-		return str(value)
+		# The GUI asks for the text of the same unchanged values over and
+		# over, remember the last one for each path.
+		try:
+			v, text = self._texts[path]
+		except KeyError:
+			pass
+		else:
+			if v is value or (type(v) is type(value) and v == value):
+				return text
+
+		text = self._formatters.get(path, str)(value)
+		self._texts[path] = (value, text)
+		return text
 
 	def _compute_number_of_phases(self, path, newvalues):
+		try:
+			paths = self._phase_power_paths[path]
+		except KeyError:
+			paths = self._phase_power_paths[path] = tuple(
+				(phase, '%s/L%s/Power' % (path, phase)) for phase in range(1, 4))
+
 		number_of_phases = None
-		for phase in range(1, 4):
-			p = newvalues.get('%s/L%s/Power' % (path, phase))
-			if p is not None:
+		for phase, p in paths:
+			if newvalues.get(p) is not None:
 				number_of_phases = phase
 		newvalues[path + '/NumberOfPhases'] = number_of_phases
 
+	def _get_ac_contributions(self, inverters, active_input):
+		""" Returns, for each phase, the (service, power path, current path)
+		    of the active AC input of each non-VE.Bus inverter, and the
+		    (service, power, current, apparent power, voltage paths) of their
+		    AC outputs. These only change with the topology, so the result is
+		    kept until the list of inverters or the active input changes. """
+		key = (tuple(inverters), active_input)
+		if self._ac_contributions is None or self._ac_contributions[0] != key:
+			inputs = {}
+			outputs = {}
+			for paths in PHASE_PATHS:
+				inputs[paths.phase] = [(i, paths.inverter_in_p[active_input],
+					paths.inverter_in_i[active_input]) for i in inverters] \
+					if active_input in (0, 1) else []
+				outputs[paths.phase] = [(i, paths.out_p, paths.out_i, paths.out_s,
+					paths.out_v) for i in inverters]
+			self._ac_contributions = (key, (inputs, outputs))
+		return self._ac_contributions[1]
+
 	def _get_connected_service_list(self, classfilter=None):
 		services = self._dbusmonitor.get_service_list(classfilter=classfilter)
 		self._remove_unconnected_services(services)
@@ -1217,20 +1865,108 @@ class SystemCalc:
 		return (s[0][1], s[0][0])
 
 
+class ChangeLogExport(dbus.service.Object):
+	""" Exports GetChangesSince, which allows a client that reconnects to
+	    fetch only the items that changed since it last looked, instead of
+	    transferring the whole tree using GetItems. """
+	def __init__(self, bus, objectpath, systemcalc):
+		dbus.service.Object.__init__(self, bus, objectpath)
+		self._systemcalc = systemcalc
+
+	# Returns the current sequence number, a flag that is set if the client
+	# must do a full resync, the changed items in the same format as
+	# GetItems, and the paths that were removed.
+	@dbus.service.method('com.victronenergy.BusItem', in_signature='t', out_signature='tba{sa{sv}}as')
+	def GetChangesSince(self, seq):
+		seq, paths = self._systemcalc.get_changes_since(seq)
+		if paths is None:
+			return seq, True, dbus.Dictionary({}, signature='sa{sv}'), dbus.Array([], signature='s')
+
+		# The items themselves give the value and text, like GetItems does
+		objects = self._systemcalc._dbusservice._dbusobjects
+		items = {}
+		removed = []
+		for path in paths:
+			item = objects.get(path)
+			if item is None:
+				removed.append(path)
+			else:
+				items[path] = {'Value': item.GetValue(), 'Text': item.GetText()}
+		return seq, False, dbus.Dictionary(items, signature='sa{sv}'), \
+			dbus.Array(removed, signature='s')
+
+
+class GatedDbusMonitor(DbusMonitor):
+	""" A DbusMonitor whose tree can change at runtime. Every class of
+	    service that may get paths later must be in the tree from the
+	    start, if need be without paths, so its services are known. New
+	    paths are read with one asynchronous GetItems call per service.
+	    Until the reply is in they are invalid, changes signalled in the
+	    meantime are picked up. Changes to removed paths are ignored from
+	    then on, just like changes to paths that were never in the tree. """
+	def add_paths(self, tree):
+		for serviceclass, paths in tree.items():
+			self.dbusTree.setdefault(serviceclass, {}).update(paths)
+			for name, service in self.servicesByName.items():
+				if not name.startswith(serviceclass + '.'):
+					continue
+				for path, options in paths.items():
+					service.paths[path] = MonitoredValue(None, '', options)
+				self.dbusConn.call_async(name, '/', None, 'GetItems', '', [],
+					reply_handler=partial(self._add_paths_done, name, service, list(paths)),
+					error_handler=partial(self._add_paths_failed, name))
+
+	def _add_paths_done(self, name, service, paths, items):
+		if self.servicesByName.get(name) is not service:
+			return # Gone, or came back as a new service
+		for path in paths:
+			item = items.get(path)
+			current = service.paths.get(path)
+			if item is None or current is None:
+				continue # Not there, or removed again
+			value = unwrap_dbus_value(item['Value'])
+			service.paths[path] = MonitoredValue(value, str(item['Text']), current.options)
+			if value is not None and self.valueChangedCallback is not None:
+				self.valueChangedCallback(name, path, current.options, item,
+					service.deviceInstance)
+
+	def _add_paths_failed(self, name, error):
+		logger.warning('Cannot read the new paths of %s: %s', name, error)
+
+	def remove_paths(self, tree):
+		for serviceclass, paths in tree.items():
+			known = self.dbusTree.get(serviceclass, {})
+			for path in paths:
+				known.pop(path, None)
+			for name, service in self.servicesByName.items():
+				if name.startswith(serviceclass + '.'):
+					for path in paths:
+						service.paths.pop(path, None)
+
 class DbusSystemCalc(SystemCalc):
+	service_name = 'com.victronenergy.system'
+
 	def _create_dbus_monitor(self, *args, **kwargs):
-		return DbusMonitor(*args, **kwargs)
+		return GatedDbusMonitor(*args, **kwargs)
+
+	def _create_write_collector(self):
+		return WriteCollector(self._dbusmonitor, self._dbusmonitor.dbusConn)
 
 	def _create_settings(self, *args, **kwargs):
 		bus = dbus.SessionBus() if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus()
-		return SettingsDevice(bus, *args, timeout=10, **kwargs)
+		try:
+			return BulkSettingsDevice(bus, *args, timeout=10, **kwargs)
+		except BulkSettingsUnsupported:
+			logger.info('localsettings has no AddSettings, adding settings one by one')
+			return SettingsDevice(bus, *args, timeout=10, **kwargs)
 
 	def _create_dbus_service(self):
 		venusversion, venusbuildtime = self._get_venus_versioninfo()
 
-		dbusservice = VeDbusService('com.victronenergy.system', register=False)
+		dbusservice = VeDbusService(self.service_name, register=False)
 		dbusservice.add_mandatory_paths(
-			processname=__file__,
+			# Not __file__, that is inside the zip when run from a bundle
+			processname=sys.argv[0],
 			processversion=softwareVersion,
 			connection='data from other dbus processes',
 			deviceinstance=0,
@@ -1240,6 +1976,7 @@ class DbusSystemCalc(SystemCalc):
 			hardwareversion=None,
 			connected=1)
 		dbusservice.add_path('/FirmwareBuild', value=venusbuildtime)
+		self._changelogexport = ChangeLogExport(dbusservice.dbusconn, '/ChangeLog', self)
 		return dbusservice
 
 	def _get_venus_versioninfo(self):
@@ -1252,6 +1989,36 @@ class DbusSystemCalc(SystemCalc):
 			pass
 		return 0, '0'
 
+class _DiscardWrites(object):
+	""" Takes the place of the monitor of a WriteCollector, and drops
+	    every write. """
+	def set_value_async(self, service, path, value):
+		pass
+
+class BenchmarkSystemCalc(DbusSystemCalc):
+	""" Starts up next to the running systemcalc, without disturbing it. It
+	    publishes under a name of its own, keeps the settings at their
+	    defaults without registering them, and sends no writes to other
+	    services. """
+	service_name = 'com.victronenergy.benchmark.systemcalc_{}'.format(os.getpid())
+
+	def _create_write_collector(self):
+		return WriteCollector(_DiscardWrites())
+
+	def _create_settings(self, *args, **kwargs):
+		return DefaultSettings(*args, **kwargs)
+
+def benchmark_report(systemcalc):
+	print('Imports (ms, including nested imports):')
+	for name, t in sorted(_import_times.items(), key=lambda x: -x[1]):
+		print('  {:<40}{:8.1f}'.format(name, t * 1000))
+	print('Delegate setup (ms):')
+	for name, t in sorted(systemcalc._delegate_times.items(), key=lambda x: -x[1]):
+		print('  {:<40}{:8.1f}'.format(name, t * 1000))
+	print('Startup stages (ms):')
+	for stage in STARTUP_STAGES:
+		print('  {:<40}{:8}'.format(stage, systemcalc._startup_times.get(stage, '-')))
+
 if __name__ == "__main__":
 	# Argument parsing
 	parser = argparse.ArgumentParser(
@@ -1261,6 +2028,20 @@ if __name__ == "__main__":
 
 	parser.add_argument("-d", "--debug", help="set logging level to debug",
 					action="store_true")
+	parser.add_argument("--log-blocking-calls", help="log blocking D-Bus calls with their duration and call site",
+					action="store_true")
+	parser.add_argument("--profile-dir", help="directory profiles requested on /Debug/Profile/Run are written to",
+					default=tempfile.gettempdir())
+	parser.add_argument("--warm-start", help="file our outputs and state are kept in over a restart",
+					default=os.path.join(tempfile.gettempdir(), 'dbus-systemcalc-warmstart.json'))
+	parser.add_argument("--benchmark-startup", help="start up next to the running service, report how long the imports and each stage took, and exit",
+					action="store_true")
+	parser.add_argument("--flight-recorder", help="file the last ticks are written to when exiting on an error",
+					default=os.path.join(tempfile.gettempdir(), 'dbus-systemcalc-flightrecorder.json.gz'))
+	parser.add_argument("--idle-after", help="stretch timers for work that can wait after this many seconds without meaningful changes, 0 never does",
+					type=int, default=IDLE_AFTER)
+	parser.add_argument("--tick-budget", help="milliseconds a tick may take before work that can wait is deferred, 0 never defers",
+					type=int, default=TICK_BUDGET)
 
 	args = parser.parse_args()
 
@@ -1270,7 +2051,19 @@ if __name__ == "__main__":
 	# Have a mainloop, so we can send/receive asynchronous calls to and from dbus
 	DBusGMainLoop(set_as_default=True)
 
-	systemcalc = DbusSystemCalc()
+	systemcalc = (BenchmarkSystemCalc if args.benchmark_startup else DbusSystemCalc)(
+		warmstart=WarmStart(args.warm_start),
+		idle_after=args.idle_after or None,
+		tick_budget=args.tick_budget / 1000.0 if args.tick_budget else None)
+	if args.benchmark_startup:
+		systemcalc._finish_startup()
+		benchmark_report(systemcalc)
+		sys.exit(0)
+	systemcalc.profiler.directory = args.profile_dir
+	crash_handlers.append(lambda: systemcalc.dump_flight_recorder(args.flight_recorder))
+	if args.log_blocking_calls:
+		systemcalc._dbusservice['/Debug/LogBlockingCalls'] = 1
+		systemcalc._blocking_calls.enable()
 
 	# Start and run the mainloop
 	logger.info("Starting mainloop, responding only on events")
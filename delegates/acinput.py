@@ -47,6 +47,8 @@ class InverterCharger(AcSource):
 		return True
 
 class AcInputs(SystemCalcDelegate):
+	service_classes = ('grid', 'genset', 'acsystem')
+
 	def __init__(self):
 		super(AcInputs, self).__init__()
 		self.gridmeters = {}
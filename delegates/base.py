@@ -4,6 +4,11 @@ class TrackInstance(type):
 		return klass._instance
 
 class SystemCalcDelegate(object, metaclass=TrackInstance):
+	# Service classes (the third part of the service name, eg 'battery' or
+	# 'vebus') for which this delegate wants device_added, device_removed,
+	# devices_changed and value_changed calls. None means all services.
+	service_classes = None
+
 	def __new__(klass, *args, **kwargs):
 		klass._instance = super(SystemCalcDelegate, klass).__new__(klass)
 		return klass._instance
@@ -29,6 +34,18 @@ class SystemCalcDelegate(object, metaclass=TrackInstance):
 		"""
 		return []
 
+	def get_feature_input(self):
+		"""In derived classes that implement a feature that can be switched off, this function should
+		return the alias of the setting that switches it, and the D-Bus paths that are only used while
+		the feature is on, in the same format as get_input. These paths are only monitored while the
+		setting is not 0.
+		Example:
+		def get_feature_input(self):
+			return ('dess_mode', [
+				('com.victronenergy.acsystem', ['/Ess/AcPowerSetpoint'])])
+		"""
+		return None, []
+
 	def get_output(self):
 		"""In derived classes this function should return the list or D-Bus paths used as input. This will be
 		used to create the D-Bus items in the com.victronenergy.system service. You can include a gettext
@@ -63,8 +80,33 @@ class SystemCalcDelegate(object, metaclass=TrackInstance):
 	def update_values(self, newvalues):
 		pass
 
+	def get_state(self):
+		""" Returns internal state worth keeping over a restart, such as
+		    filters and counters, as something that can be stored as JSON.
+		    None means there is nothing to keep. """
+		return None
+
+	def set_state(self, state):
+		""" Restores the state returned by get_state before a restart.
+		    Called once at startup, after set_sources. """
+		pass
+
 	def device_added(self, service, instance, do_service_change=True):
 		pass
 
 	def device_removed(self, service, instance):
 		pass
+
+	def devices_changed(self, added, removed):
+		""" Called once after a batch of services appeared or disappeared,
+		    after device_added and device_removed were called for each of
+		    them. added and removed are lists of (service, instance) tuples.
+		    Work that only needs doing once for the whole batch, such as
+		    rebuilding lists of devices, belongs here. """
+		pass
+
+	def value_changed(self, service, path, value):
+		""" Called when a monitored path on one of the services in
+		    service_classes changes. Only called on delegates that implement
+		    it. """
+		pass
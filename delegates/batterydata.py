@@ -1,13 +1,15 @@
-from gi.repository import GLib
 import json
 from collections import defaultdict
 from itertools import chain
 from functools import partial
-from sc_utils import reify, smart_dict
+from sc_utils import reify, smart_dict, ExpiringCache, loop_monitor, exit_on_error
 from delegates.base import SystemCalcDelegate
+from bulksettings import add_settings_async
 
-# Victron packages
-from ve_utils import exit_on_error
+# The configuration of batteries that went away is kept for a while, in case
+# they come back. Age in seconds.
+DEPARTED_BATTERIES_SIZE = 32
+DEPARTED_BATTERIES_MAXAGE = 3600
 
 class BatteryConfiguration(object):
 	""" Holds custom mapping information about a service that corresponds to a
@@ -21,25 +23,53 @@ class BatteryConfiguration(object):
 
 	def bind_settings(self):
 		config_id = self.service.replace('.', '_')
-		self.service_item = self.parent._settings.addSetting(
-			"/Settings/SystemSetup/Batteries/Configuration/{}/Service".format(config_id),
-			"", 0, 0, callback=partial(self.on_setting_change, "service", str))
-		self.name_item = self.parent._settings.addSetting(
-			"/Settings/SystemSetup/Batteries/Configuration/{}/Name".format(config_id),
-			"", 0, 0, callback=partial(self.on_setting_change, "name", str))
-		self.enabled_item = self.parent._settings.addSetting(
-			"/Settings/SystemSetup/Batteries/Configuration/{}/Enabled".format(config_id),
-			0, 0, 1, callback=partial(self.on_setting_change, "enabled", bool))
-		self.service_item.set_value(self.service)
-		self.enabled = bool(self.enabled_item.get_value())
-		self.name = str(self.name_item.get_value())
+		path = "/Settings/SystemSetup/Batteries/Configuration/{}".format(config_id)
+		self.service_item, self.name_item, self.enabled_item = add_settings_async(
+			self.parent._settings, [
+				(path + "/Service", self.service, 0, 0, False,
+					partial(self.on_setting_change, "service", str)),
+				(path + "/Name", "", 0, 0, False,
+					partial(self.on_setting_change, "name", str)),
+				(path + "/Enabled", 0, 0, 1, False,
+					partial(self.on_setting_change, "enabled", bool))],
+			partial(self.on_settings_bound, path + "/Service"))
+
+	def on_settings_bound(self, service_path, items):
+		service_item, name_item, enabled_item = items
+		# Settings registered by older versions may hold a different value.
+		# Correct it, without waiting for the write to complete.
+		if service_item.get_value() != self.service:
+			self.parent.systemcalc.writer.set_value_async(
+				'com.victronenergy.settings', service_path, self.service)
+		self.enabled = bool(enabled_item.get_value())
+		self.name = str(name_item.get_value())
+		self.parent.changed = True
 
 	def on_setting_change(self, key, cast, service, path, value):
 		setattr(self, key, cast(value['Value']))
 		self.parent.changed = True
 
 
+# Mapping of the keys in a battery summary to the paths published under
+# /Batteries/<id> for that battery.
+BATTERY_PATHS = (
+	('id', '/Id'),
+	('instance', '/Instance'),
+	('voltage', '/Voltage'),
+	('current', '/Current'),
+	('power', '/Power'),
+	('temperature', '/Temperature'),
+	('soc', '/Soc'),
+	('timetogo', '/TimeToGo'),
+	('name', '/Name'),
+	('state', '/State'),
+	('bmsstate', '/BmsState'),
+	('active_battery_service', '/ActiveBatteryService'))
+
 class BatteryTracker(object):
+	# Paths that only affect the name
+	_name_paths = ('/CustomName', '/ProductName')
+
 	_paths = (
 		'/Dc/0/Voltage',
 		'/Dc/0/Current',
@@ -55,6 +85,8 @@ class BatteryTracker(object):
 		self.monitor = monitor
 		self.channel = None
 		self._tracked = { k: None for k in self._paths }
+		self._data_cache = None
+		self.published = None
 
 	@property
 	def valid(self):
@@ -77,6 +109,12 @@ class BatteryTracker(object):
 			of service and the instance. """
 		return "{}/{}".format('.'.join(self.service.split('.')[:3]), self.instance)
 
+	@reify
+	def path_prefix(self):
+		""" The path under which this battery is published. """
+		return '/Batteries/{}'.format(
+			self.service_id.replace('.', '_').replace('/', '_'))
+
 	def update(self):
 		changed = False
 		for k, v in self._tracked.items():
@@ -84,8 +122,22 @@ class BatteryTracker(object):
 			if n != v:
 				self._tracked[k] = n
 				changed = True
+		if changed:
+			self._data_cache = None
 		return changed
 
+	def value_changed(self, path, value):
+		""" Update a single tracked value. Returns True if the summary
+		    of this battery changed. """
+		if path in self._tracked:
+			if self._tracked[path] == value:
+				return False
+			self._tracked[path] = value
+		elif path not in self._name_paths:
+			return False
+		self._data_cache = None
+		return True
+
 	def _data(self):
 		power = self._tracked['/Dc/0/Power']
 		voltage = self._tracked['/Dc/0/Voltage']
@@ -106,7 +158,9 @@ class BatteryTracker(object):
 		}
 
 	def data(self):
-		return { k: v for k, v in self._data().items() if v is not None }
+		if self._data_cache is None:
+			self._data_cache = { k: v for k, v in self._data().items() if v is not None }
+		return self._data_cache
 
 class SecondaryBatteryTracker(BatteryTracker):
 	""" Used to track the starter battery where available. """
@@ -182,12 +236,18 @@ class MultiTracker(BatteryTracker):
 		return True
 
 class BatteryData(SystemCalcDelegate):
-	def __init__(self):
+	service_classes = ('battery', 'charger', 'vebus', 'multi', 'inverter',
+		'genset', 'dcgenset', 'settings')
+
+	def __init__(self, sc):
 		SystemCalcDelegate.__init__(self)
+		self.systemcalc = sc
 		self.batteries = defaultdict(list)
 		self.changed = False
 		self.deviceschanged = False
 		self.configured_batteries = {}
+		self.departed_batteries = ExpiringCache(DEPARTED_BATTERIES_SIZE,
+			DEPARTED_BATTERIES_MAXAGE)
 		self.active_battery_service = None
 
 	def set_sources(self, dbusmonitor, settings, dbusservice):
@@ -196,7 +256,7 @@ class BatteryData(SystemCalcDelegate):
 		# Publish the battery configuration
 		self._dbusservice.add_path('/Batteries', value=None)
 		self._dbusservice.add_path('/AvailableBatteries', value=None)
-		self._timer = GLib.timeout_add(5000, exit_on_error, self._on_timer)
+		self._timer = loop_monitor.timeout_add_adaptive(5000, exit_on_error, self._on_timer)
 
 	def get_input(self):
 		return [
@@ -240,20 +300,37 @@ class BatteryData(SystemCalcDelegate):
 				SecondaryBatteryTracker(service, instance, self._dbusmonitor, 0),
 				FischerPandaTracker(service, instance, self._dbusmonitor))
 		elif service == 'com.victronenergy.settings':
+			# Bindings of departed batteries are stale now, they are
+			# created again if the battery returns.
+			self.departed_batteries.clear()
 			for cb in self.configured_batteries.values():
 				cb.bind_settings()
 
 	def device_removed(self, service, instance):
 		if service in self.batteries:
-			del self.batteries[service]
+			for t in self.batteries.pop(service):
+				self._unpublish(t)
+				config = self.configured_batteries.pop(t.service_id, None)
+				if config is not None:
+					self.departed_batteries.put(t.service_id, config)
 			self.changed = True
 			self.deviceschanged = True
 
+	def value_changed(self, service, path, value):
+		for t in self.batteries.get(service, ()):
+			if t.value_changed(path, value):
+				self.changed = True
+
 	def add_trackers(self, service, *args):
 		self.batteries[service].extend(args)
 		for t in args:
+			t.update()
 			if t.service_id not in self.configured_batteries:
-				self.add_configured_battery(t.service_id)
+				config = self.departed_batteries.pop(t.service_id)
+				if config is None:
+					self.add_configured_battery(t.service_id)
+				else:
+					self.configured_batteries[t.service_id] = config
 
 	def is_enabled(self, tracker):
 		return tracker.service_id in self.configured_batteries and \
@@ -265,27 +342,53 @@ class BatteryData(SystemCalcDelegate):
 		except (KeyError, AttributeError):
 			return None
 
-	def update_values(self, newvalues=None):
-		self.changed = any([tracker.update() for tracker in chain.from_iterable(
-			self.batteries.values())]) or self.changed
-
 	def add_configured_battery(self, service):
 		self.configured_batteries[service] = BatteryConfiguration(
 			self, service)
 
+	def _publish(self, tracker, data):
+		""" Update the /Batteries/<id> tree of a single battery. Only the
+		    values that differ from what was last published are set. """
+		published = tracker.published
+		if published == data:
+			return
+		if published is None:
+			for k, p in BATTERY_PATHS:
+				self._dbusservice.add_path(tracker.path_prefix + p, data.get(k))
+		else:
+			for k, p in BATTERY_PATHS:
+				v = data.get(k)
+				if published.get(k) != v:
+					self._dbusservice[tracker.path_prefix + p] = v
+		tracker.published = data
+
+	def _unpublish(self, tracker):
+		if tracker.published is not None:
+			for k, p in BATTERY_PATHS:
+				path = tracker.path_prefix + p
+				if path in self._dbusservice:
+					del self._dbusservice[path]
+			tracker.published = None
+
 	def _on_timer(self):
 		active = self._dbusservice['/ActiveBatteryService']
 		if self.changed or self.active_battery_service != active:
-			# Update the summary
+			# Update the summary. The per-battery data is cached on each
+			# tracker and only recalculated for batteries that changed.
 			is_active = lambda x: active == x.service_id
 			kwargs = lambda x: {k: v for k, v in (('active_battery_service', is_active(x)),
 				('name', self.config_name(x))) if v is not None}
 
-			self._dbusservice['/Batteries'] = [
-				dict(tracked.data(), **kwargs(tracked)) \
-					for tracked in chain.from_iterable(self.batteries.values()) \
-					if (tracked.valid and self.is_enabled(tracked)) or is_active(tracked)
-			]
+			batteries = []
+			for tracked in chain.from_iterable(self.batteries.values()):
+				if (tracked.valid and self.is_enabled(tracked)) or is_active(tracked):
+					data = dict(tracked.data(), **kwargs(tracked))
+					batteries.append(data)
+					self._publish(tracked, data)
+				elif tracked.published:
+					self._publish(tracked, {})
+			self._dbusservice['/Batteries'] = batteries
+			self.changed = False
 
 		if self.deviceschanged or self.active_battery_service != active:
 			# This is returned as JSON, because QML won't let us pass
@@ -298,7 +401,6 @@ class BatteryData(SystemCalcDelegate):
 				} for b in chain.from_iterable(self.batteries.values()) if b.valid })
 			self.deviceschanged = False
 
-			self.changed = False
-
 		self.active_battery_service = active
+		self.departed_batteries.expire()
 		return True
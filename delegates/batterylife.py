@@ -1,9 +1,8 @@
 import logging
-from gi.repository import GLib
+from sc_utils import loop_monitor, exit_on_error
 from datetime import datetime, timedelta
 
 # Victron packages
-from ve_utils import exit_on_error
 from delegates.base import SystemCalcDelegate
 
 # Path constants
@@ -62,7 +61,7 @@ class BatteryLife(SystemCalcDelegate):
 	def __init__(self):
 		super(BatteryLife, self).__init__()
 		self._tracked_values = {}
-		self._timer = GLib.timeout_add(900000, exit_on_error, self._on_timer)
+		self._timer = loop_monitor.timeout_add(900000, exit_on_error, self._on_timer)
 
 	def set_sources(self, dbusmonitor, settings, dbusservice):
 		super(BatteryLife, self).set_sources(dbusmonitor, settings, dbusservice)
@@ -1,13 +1,10 @@
 from collections import namedtuple
 from itertools import chain
-from gi.repository import GLib
+from sc_utils import loop_monitor, exit_on_error
 from dbus.exceptions import DBusException
 from delegates.base import SystemCalcDelegate
 from delegates.dvcc import Dvcc
 
-# Victron packages
-from ve_utils import exit_on_error
-
 # Write temperature this often (in 3-second units)
 TEMPERATURE_INTERVAL = 3
 
@@ -23,6 +20,11 @@ class TemperatureSensor(namedtuple('TemperatureSensor', ('service', 'path', 'ins
 	def valid(self):
 		return self.isvalid()
 
+	@property
+	def validity_path(self):
+		""" The path that isvalid depends on. """
+		return self.path
+
 	@property
 	def service_class(self):
 		return '.'.join(self.service.split('.')[:3])
@@ -34,8 +36,14 @@ class TemperatureSensor(namedtuple('TemperatureSensor', ('service', 'path', 'ins
 class DedicatedSensor(TemperatureSensor):
 	""" This represents a ADC sensor, as opposed to one attached to the battery
 	    service, solar charger or Multi. """
+	@property
+	def validity_path(self):
+		return '/TemperatureType'
 
 class BatterySense(SystemCalcDelegate):
+	service_classes = ('battery', 'vebus', 'solarcharger', 'inverter', 'multi',
+		'alternator', 'temperature')
+
 	TEMPSERVICE_DEFAULT = 'default'
 	TEMPSERVICE_NOSENSOR = 'nosensor'
 
@@ -55,6 +63,15 @@ class BatterySense(SystemCalcDelegate):
 		self.temperaturesensors = {}
 		self.tick = TEMPERATURE_INTERVAL
 
+		# Sensors by (service class, instance), the name of each valid
+		# sensor by service, and the explicitly selected sensor. The
+		# temperature service setting is parsed only when it changes.
+		self._sensor_index = {}
+		self._available = {}
+		self._selection_setting = None
+		self._selection = None
+		self._selected = None
+
 	def get_input(self):
 		return [
 			('com.victronenergy.solarcharger', [
@@ -112,7 +129,7 @@ class BatterySense(SystemCalcDelegate):
 		self._dbusservice.add_path('/Dc/Battery/TemperatureService', value=None)
 		self._dbusservice.add_path('/Dc/Battery/Temperature', value=None, gettextcallback=lambda p, v: '{:.1F} C'.format(v))
 		self._dbusservice.add_path('/Debug/DisableBatterySense', value=0, writeable=True)
-		self._timer = GLib.timeout_add(3000, exit_on_error, self._on_timer)
+		self._timer = loop_monitor.timeout_add(3000, exit_on_error, self._on_timer)
 
 	@property
 	def temperature_service(self):
@@ -152,21 +169,40 @@ class BatterySense(SystemCalcDelegate):
 
 		return '{} on {}'.format(name, connection)
 
-	def update_temperature_sensors(self, *args):
+	def _update_available(self, sensor):
+		""" Update the entry of a single sensor in the list of available
+		    temperature services. Returns True if the list changed. """
+		if sensor.valid:
+			entry = (sensor.instance_service_name+sensor.path,
+				self.nice_name(sensor.service))
+			if self._available.get(sensor.service) != entry:
+				self._available[sensor.service] = entry
+				return True
+		elif self._available.pop(sensor.service, None) is not None:
+			return True
+		return False
+
+	def _publish_available(self):
 		services = {
 			self.TEMPSERVICE_DEFAULT: 'Automatic',
 			self.TEMPSERVICE_NOSENSOR: 'No sensor'}
-
-		for sensor in self.temperaturesensors.values():
-			if sensor.valid:
-				name = self._dbusmonitor.get_value(sensor.service, '/ProductName')
-				services[sensor.instance_service_name+sensor.path] = self.nice_name(sensor.service)
-
+		services.update(self._available.values())
 		self._dbusservice['/AvailableTemperatureServices'] = services
 
-	def _find_device_instance(self, serviceclass, instance):
-		di = {(s.service_class, s.instance): s.service for s in self.temperaturesensors.values()}
-		return di.get((serviceclass, instance))
+	@staticmethod
+	def _parse_selection(temperature_service):
+		""" Parse an explicit temperature service selection into a
+		    (serviceclass, instance, path) tuple, or None if it is not
+		    valid. """
+		try:
+			serviceclass, instance, path = temperature_service.split('/', 2)
+			return serviceclass, int(instance), '/' + path
+		except (AttributeError, ValueError):
+			return None
+
+	def _update_selection(self):
+		self._selected = None if self._selection is None else \
+			self._sensor_index.get(self._selection[:2])
 
 	def _determine_temperature(self):
 		# Business Logic:
@@ -183,17 +219,15 @@ class BatterySense(SystemCalcDelegate):
 
 		# Selected battery service
 		if temperature_service != self.TEMPSERVICE_DEFAULT:
-			try:
-				serviceclass, instance, path = temperature_service.split('/', 2)
-				instance = int(instance)
-			except ValueError:
-				return None, None
-			else:
-				s = self._find_device_instance(serviceclass, instance)
-				if s is not None and self.temperaturesensors[s].valid:
-					return safe_float(self._dbusmonitor.get_value(s, '/'+path)), s
-				else:
-					return None, None
+			if temperature_service != self._selection_setting:
+				self._selection_setting = temperature_service
+				self._selection = self._parse_selection(temperature_service)
+				self._update_selection()
+			sensor = self._selected
+			if sensor is not None and sensor.valid:
+				return safe_float(self._dbusmonitor.get_value(
+					sensor.service, self._selection[2])), sensor.service
+			return None, None
 
 		# Default: Use battery service
 		if self.systemcalc._batteryservice is not None:
@@ -213,22 +247,51 @@ class BatterySense(SystemCalcDelegate):
 				service.startswith('com.victronenergy.inverter.') or \
 				service.startswith('com.victronenergy.multi.') or \
 				service.startswith('com.victronenergy.alternator'):
-			self.temperaturesensors[service] = TemperatureSensor(service,
+			sensor = TemperatureSensor(service,
 				'/Dc/0/Temperature', instance,
 				lambda s=service: self._dbusmonitor.get_value(s, '/Dc/0/Temperature') is not None)
-			self._dbusmonitor.track_value(service, '/Dc/0/Temperature', self.update_temperature_sensors)
-			self.update_temperature_sensors()
 		elif service.startswith('com.victronenergy.temperature.'):
-			self.temperaturesensors[service] = DedicatedSensor(service,
+			sensor = DedicatedSensor(service,
 				'/Temperature', instance,
 				lambda s=service: self._dbusmonitor.get_value(s, '/TemperatureType') == 0)
-			self._dbusmonitor.track_value(service, '/TemperatureType', self.update_temperature_sensors)
-			self.update_temperature_sensors()
+		else:
+			return
+
+		self.temperaturesensors[service] = sensor
+		self._sensor_index[(sensor.service_class, instance)] = sensor
+		self._update_available(sensor)
+		self._update_selection()
 
 	def device_removed(self, service, instance):
-		if service in self.temperaturesensors:
-			del self.temperaturesensors[service]
-			self.update_temperature_sensors()
+		sensor = self.temperaturesensors.pop(service, None)
+		if sensor is None:
+			return
+		key = (sensor.service_class, sensor.instance)
+		if self._sensor_index.get(key) is sensor:
+			del self._sensor_index[key]
+			# Fall back to another sensor with the same instance, if any
+			for other in self.temperaturesensors.values():
+				if (other.service_class, other.instance) == key:
+					self._sensor_index[key] = other
+		self._available.pop(service, None)
+		self._update_selection()
+
+	def devices_changed(self, added, removed):
+		self._publish_available()
+
+	def value_changed(self, service, path, value):
+		# Update the entry of this sensor when its validity or its name
+		# changes.
+		sensor = self.temperaturesensors.get(service)
+		if sensor is None:
+			return
+		if path == sensor.validity_path:
+			if sensor.valid == (service in self._available):
+				return
+		elif path not in ('/ProductName', '/Mgmt/Connection'):
+			return
+		if self._update_available(sensor):
+			self._publish_available()
 
 	def _on_timer(self):
 		if self._dbusservice['/Debug/DisableBatterySense']:
@@ -254,6 +317,8 @@ class BatterySense(SystemCalcDelegate):
 				int(self.has_tsense and Dvcc.instance.has_dvcc) and \
 				self._distribute_sense_temperature()
 		self.tick = (self.tick - 1) % TEMPERATURE_INTERVAL
+
+		self.systemcalc.writer.flush()
 		return True
 
 	def _service_is_battery(self, service):
@@ -276,7 +341,7 @@ class BatterySense(SystemCalcDelegate):
 		if has_vsense and vebus_path is not None and \
 			vebus_path != sense_voltage_service and \
 			self._dbusmonitor.get_value(vebus_path, '/FirmwareFeatures/BolUBatAndTBatSense') == 1:
-			self._dbusmonitor.set_value_async(vebus_path, '/BatterySense/Voltage',
+			self.systemcalc.writer.set_value_async(vebus_path, '/BatterySense/Voltage',
 				sense_voltage)
 			multi_written = self.VSENSE_ON
 
@@ -299,7 +364,7 @@ class BatterySense(SystemCalcDelegate):
 				continue
 			if not self._dbusmonitor.seen(service, '/Link/VoltageSense'):
 				continue
-			self._dbusmonitor.set_value_async(service, '/Link/VoltageSense', sense_voltage)
+			self.systemcalc.writer.set_value_async(service, '/Link/VoltageSense', sense_voltage)
 			charger_written = self.VSENSE_ON
 
 		# Only forward to the VE.Can if the voltage is not coming from it, or
@@ -307,7 +372,7 @@ class BatterySense(SystemCalcDelegate):
 		vecan = self._dbusmonitor.get_service_list('com.victronenergy.vecan')
 		if len(vecan) and (self._service_is_battery(sense_voltage_service) or not self._service_on_vecan(sense_voltage_service)):
 			for _ in vecan.keys():
-				self._dbusmonitor.set_value_async(_, '/Link/VoltageSense', sense_voltage)
+				self.systemcalc.writer.set_value_async(_, '/Link/VoltageSense', sense_voltage)
 			charger_written = self.VSENSE_ON
 
 		return multi_written, charger_written
@@ -339,7 +404,7 @@ class BatterySense(SystemCalcDelegate):
 			# Skip for old firmware versions to save some dbus traffic
 			if not self._dbusmonitor.seen(service, '/Link/BatteryCurrent'):
 				continue # No such feature on this charger
-			self._dbusmonitor.set_value_async(service, '/Link/BatteryCurrent', battery_current)
+			self.systemcalc.writer.set_value_async(service, '/Link/BatteryCurrent', battery_current)
 			sent = BatterySense.ISENSE_ENABLED
 
 		# Forward isense to VE.Can only if it doesn't come from there
@@ -348,7 +413,7 @@ class BatterySense(SystemCalcDelegate):
 			sense_origin = self._dbusmonitor.get_value(sense_voltage_service, '/Mgmt/Connection')
 			if sense_origin and sense_origin != 'VE.Can':
 				for service in vecan.keys():
-					self._dbusmonitor.set_value_async(service, '/Link/BatteryCurrent', battery_current)
+					self.systemcalc.writer.set_value_async(service, '/Link/BatteryCurrent', battery_current)
 					sent = BatterySense.ISENSE_ENABLED
 
 		return sent
@@ -374,7 +439,7 @@ class BatterySense(SystemCalcDelegate):
 
 			# VE.Can chargers don't have this path, so only set it when it has been seen
 			if self._dbusmonitor.seen(charger, '/Link/TemperatureSense'):
-				self._dbusmonitor.set_value_async(charger, '/Link/TemperatureSense', sense_temp)
+				self.systemcalc.writer.set_value_async(charger, '/Link/TemperatureSense', sense_temp)
 			written = 1
 
 		# Write to supporting inverters
@@ -387,13 +452,13 @@ class BatterySense(SystemCalcDelegate):
 				continue
 
 			if self._dbusmonitor.seen(charger, '/Link/TemperatureSense'):
-				self._dbusmonitor.set_value_async(charger, '/Link/TemperatureSense', sense_temp)
+				self.systemcalc.writer.set_value_async(charger, '/Link/TemperatureSense', sense_temp)
 			written = 1
 
 		# Also update the multi
 		vebus = self._dbusservice['/VebusService']
 		if vebus is not None and vebus != sense_temp_service and self._dbusmonitor.seen(vebus, '/BatterySense/Temperature'):
-			self._dbusmonitor.set_value_async(vebus, '/BatterySense/Temperature',
+			self.systemcalc.writer.set_value_async(vebus, '/BatterySense/Temperature',
 				sense_temp)
 			written = 1
 
@@ -401,7 +466,7 @@ class BatterySense(SystemCalcDelegate):
 		vecan = self._dbusmonitor.get_service_list('com.victronenergy.vecan')
 		if len(vecan) and (self._service_is_battery(sense_temp_service) or not self._service_on_vecan(sense_temp_service)):
 			for _ in vecan.keys():
-				self._dbusmonitor.set_value_async(_, '/Link/TemperatureSense', sense_temp)
+				self.systemcalc.writer.set_value_async(_, '/Link/TemperatureSense', sense_temp)
 			written = 1
 
 		return written
@@ -82,6 +82,8 @@ class Battery(object):
 
 class BatteryService(SystemCalcDelegate):
 	""" Keeps track of the (auto-)selected bms service. """
+	service_classes = ('battery',)
+
 	BMSSERVICE_DEFAULT = -1
 	BMSSERVICE_NOBMS = -255
 
@@ -126,8 +128,6 @@ class BatteryService(SystemCalcDelegate):
 	def device_added(self, service, instance, *args):
 		if service.startswith('com.victronenergy.battery.'):
 			self._batteries[instance] = Battery(self._dbusmonitor, service, instance)
-			self._dbusmonitor.track_value(service, "/Info/MaxChargeVoltage", self._set_bms)
-			self._dbusmonitor.track_value(service, "/CustomName", self._set_bms)
 			self._set_bms()
 
 	def device_removed(self, service, instance):
@@ -135,6 +135,10 @@ class BatteryService(SystemCalcDelegate):
 			del self._batteries[instance]
 			self._set_bms()
 
+	def value_changed(self, service, path, value):
+		if path in ('/Info/MaxChargeVoltage', '/CustomName'):
+			self._set_bms()
+
 	def battery_service_changed(self, auto, oldservice, newservice):
 		self._set_bms()
 
@@ -3,11 +3,9 @@ from gi.repository import GLib
 import logging
 import os
 import sc_utils
+from sc_utils import exit_on_error
 import traceback
 
-# Victron packages
-from ve_utils import exit_on_error
-
 from delegates.base import SystemCalcDelegate
 
 class BuzzerControl(SystemCalcDelegate):
@@ -65,7 +63,7 @@ class BuzzerControl(SystemCalcDelegate):
 			value = 1 if int(value) == 1 else 0
 			if value == 1:
 				if self._timer is None:
-					self._timer = GLib.timeout_add(500, exit_on_error, self._on_timer)
+					self._timer = sc_utils.loop_monitor.timeout_add(500, exit_on_error, self._on_timer)
 					self.set_buzzer(True)
 			elif self._timer is not None:
 				GLib.source_remove(self._timer)
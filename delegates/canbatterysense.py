@@ -3,12 +3,12 @@ from gi.repository import GLib
 from dbus.exceptions import DBusException
 from delegates.base import SystemCalcDelegate
 from delegates.batteryservice import BatteryService
-from ve_utils import exit_on_error
-from sc_utils import safeadd
+from sc_utils import safeadd, exit_on_error
 
 class CanBatterySense(SystemCalcDelegate):
-	def __init__(self):
+	def __init__(self, sc):
 		super(CanBatterySense, self).__init__()
+		self.systemcalc = sc
 
 	def get_input(self):
 		return [
@@ -36,8 +36,8 @@ class CanBatterySense(SystemCalcDelegate):
 				bms.service != batteryservice.service and \
 				batteryservice.soc is not None:
 			# Copy sense data across
-			self._dbusmonitor.set_value_async(bms.service, '/Sense/Voltage', batteryservice.voltage)
-			self._dbusmonitor.set_value_async(bms.service, '/Sense/Current', batteryservice.current)
+			self.systemcalc.writer.set_value_async(bms.service, '/Sense/Voltage', batteryservice.voltage)
+			self.systemcalc.writer.set_value_async(bms.service, '/Sense/Current', batteryservice.current)
 			if batteryservice.temperature is not None:
-				self._dbusmonitor.set_value_async(bms.service, '/Sense/Temperature', batteryservice.temperature)
-			self._dbusmonitor.set_value_async(bms.service, '/Sense/Soc', batteryservice.soc)
+				self.systemcalc.writer.set_value_async(bms.service, '/Sense/Temperature', batteryservice.temperature)
+			self.systemcalc.writer.set_value_async(bms.service, '/Sense/Soc', batteryservice.soc)
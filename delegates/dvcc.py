@@ -7,8 +7,7 @@ from itertools import count, chain
 from functools import partial, wraps
 
 # Victron packages
-from sc_utils import safeadd, copy_dbus_value, reify, ExpiringValue
-from ve_utils import exit_on_error
+from sc_utils import safeadd, copy_dbus_value, reify, ExpiringValue, loop_monitor, exit_on_error
 
 from delegates.base import SystemCalcDelegate
 from delegates.batteryservice import BatteryService
@@ -180,10 +179,16 @@ class LowPassFilter(object):
 	def value(self):
 		return self._value
 
+	@value.setter
+	def value(self, v):
+		self._value = v
+
 class BaseCharger(object):
-	def __init__(self, monitor, service):
+	def __init__(self, monitor, service, writer=None):
 		self.monitor = monitor
 		self.service = service
+		# Writes go through the collector when there is one
+		self.writer = monitor if writer is None else writer
 		self.is_vecan = self.connection == 'VE.Can'
 
 	def _get_path(self, path):
@@ -191,7 +196,14 @@ class BaseCharger(object):
 
 	def _set_path(self, path, v):
 		if self.monitor.seen(self.service, path):
-			self.monitor.set_value_async(self.service, path, v)
+			self.writer.set_value_async(self.service, path, v)
+
+	@property
+	def quarantined(self):
+		""" True while writes to this charger are held back, because it
+		    stopped replying. """
+		return self.writer is not self.monitor and \
+			self.writer.quarantined(self.service)
 
 	@property
 	def firmwareversion(self):
@@ -280,8 +292,8 @@ class SolarCharger(BaseCharger, Networkable):
 	""" Encapsulates a solar charger on dbus. Exposes dbus paths as convenient
 	    attributes. """
 
-	def __init__(self, monitor, service):
-		super().__init__(monitor, service)
+	def __init__(self, monitor, service, writer=None):
+		super().__init__(monitor, service, writer)
 		self._smoothed_current = LowPassFilter((2 * pi)/20, self.chargecurrent or 0)
 		self._has_externalcontrol_support = False
 
@@ -341,8 +353,8 @@ class InverterCharger(SolarCharger):
 	    which has a solar input and can charge the battery like a solar
 	    charger, but is also an inverter.
 	"""
-	def __init__(self, monitor, service):
-		super(InverterCharger, self).__init__(monitor, service)
+	def __init__(self, monitor, service, writer=None):
+		super(InverterCharger, self).__init__(monitor, service, writer)
 
 	@property
 	def has_externalcontrol_support(self):
@@ -465,26 +477,27 @@ class ChargerSubsystem(object):
 	    charger, to collectively make up a charging system (sans Multi).
 	    Properties related to the whole system or some combination of the
 	    individual chargers are exposed here as attributes. """
-	def __init__(self, monitor):
+	def __init__(self, monitor, writer=None):
 		self.monitor = monitor
+		self.writer = writer
 		self._solarchargers = {}
 		self._inverterchargers = {}
 		self._otherchargers = {}
 
 	def add_solar_charger(self, service):
-		self._solarchargers[service] = charger = SolarCharger(self.monitor, service)
+		self._solarchargers[service] = charger = SolarCharger(self.monitor, service, self.writer)
 		return charger
 
 	def add_alternator(self, service):
-		self._otherchargers[service] = charger = Alternator(self.monitor, service)
+		self._otherchargers[service] = charger = Alternator(self.monitor, service, self.writer)
 		return charger
 
 	def add_dcgenset(self, service):
-		self._otherchargers[service] = dcgenset = DcGenset(self.monitor, service)
+		self._otherchargers[service] = dcgenset = DcGenset(self.monitor, service, self.writer)
 		return dcgenset
 
 	def add_invertercharger(self, service):
-		self._inverterchargers[service] = inverter = InverterCharger(self.monitor, service)
+		self._inverterchargers[service] = inverter = InverterCharger(self.monitor, service, self.writer)
 		return inverter
 
 	def remove_charger(self, service):
@@ -562,16 +575,17 @@ class ChargerSubsystem(object):
 		# bit 2: Remote Hub-1 control (MPPT will accept charge voltage and max charge current)
 		# bit 3: Remote BMS control (MPPT enter BMS mode)
 		network_mode = 1 | (0 if charge_voltage is None and max_charge_current is None else 4) | (8 if has_bms else 0)
+		# Writes to quarantined chargers are held back, they don't count
 		network_mode_written = False
 		for charger in self:
 			charger.networkmode = network_mode
-			network_mode_written = True
+			network_mode_written = network_mode_written or not charger.quarantined
 
 		# Distribute the voltage setpoint to all solar chargers.
 		# Non-solar chargers are controlled elsewhere.
 		voltage_written = 0
 		if charge_voltage is not None:
-			voltage_written = int(len(self)>0)
+			voltage_written = int(any(not c.quarantined for c in self))
 			for charger in chain(self._solarchargers.values(),
 					self._inverterchargers.values()):
 				# VE.Can chargers get their voltage from the VE.Can interface
@@ -849,6 +863,9 @@ class Multi(object):
 
 class Dvcc(SystemCalcDelegate):
 	""" This is the main DVCC delegate object. """
+	service_classes = ('solarcharger', 'inverter', 'multi', 'vecan', 'alternator',
+		'dcgenset', 'battery')
+
 	def __init__(self, sc):
 		super(Dvcc, self).__init__()
 		self.systemcalc = sc
@@ -953,7 +970,7 @@ class Dvcc(SystemCalcDelegate):
 
 	def set_sources(self, dbusmonitor, settings, dbusservice):
 		SystemCalcDelegate.set_sources(self, dbusmonitor, settings, dbusservice)
-		self._chargesystem = ChargerSubsystem(dbusmonitor)
+		self._chargesystem = ChargerSubsystem(dbusmonitor, self.systemcalc.writer)
 		self._inverters = InverterSubsystem(dbusmonitor)
 		self._multi = Multi(dbusmonitor, dbusservice)
 
@@ -970,6 +987,18 @@ class Dvcc(SystemCalcDelegate):
 		self._dbusservice.add_path('/Dvcc/Alarms/FirmwareInsufficient', value=0)
 		self._dbusservice.add_path('/Dvcc/Alarms/MultipleBatteries', value=0)
 
+	def get_state(self):
+		return {
+			'dcsyscurrent': self._dcsyscurrent.value,
+			'vebusdccurrent': self._multi._dc_current.value}
+
+	def set_state(self, state):
+		# The filters pick up from where they were, and converge on live
+		# data from there. Charge voltages are not kept, they come from
+		# the battery.
+		self._dcsyscurrent.value = float(state['dcsyscurrent'])
+		self._multi._dc_current.value = float(state['vebusdccurrent'])
+
 	def device_added(self, service, instance, do_service_change=True):
 		service_type = service.split('.')[2]
 		if service_type == 'solarcharger':
@@ -994,7 +1023,7 @@ class Dvcc(SystemCalcDelegate):
 			return
 
 		if self._timer is None:
-			self._timer = GLib.timeout_add(1000, exit_on_error, self._on_timer)
+			self._timer = loop_monitor.timeout_add(1000, exit_on_error, self._on_timer)
 
 	def device_removed(self, service, instance):
 		if service in self._chargesystem:
@@ -1066,6 +1095,13 @@ class Dvcc(SystemCalcDelegate):
 		return self._chargesystem.want_bms
 
 	def _on_timer(self):
+		try:
+			return self._control_chargers()
+		finally:
+			# Send the writes made to the chargers, grouped by service
+			self.systemcalc.writer.flush()
+
+	def _control_chargers(self):
 		def update_solarcharger_control_flags(voltage_written, current_written, chargevoltage):
 			self._dbusservice['/Control/SolarChargeVoltage'] = voltage_written
 			self._dbusservice['/Control/SolarChargeCurrent'] = current_written
@@ -1351,7 +1387,7 @@ class Dvcc(SystemCalcDelegate):
 		if vecan_voltage is None:
 			for service in self._vecan_services:
 				try:
-					self._dbusmonitor.set_value_async(service, '/Link/NetworkMode',
+					self.systemcalc.writer.set_value_async(service, '/Link/NetworkMode',
 						1 | (0 if max_charge_current is None else 4))
 				except DBusException:
 					pass
@@ -1362,9 +1398,10 @@ class Dvcc(SystemCalcDelegate):
 					# raise an DBusException which we will ignore cheerfully. If we
 					# cannot set the NetworkMode there is no point in setting the
 					# ChargeVoltage.
-					self._dbusmonitor.set_value_async(service, '/Link/NetworkMode', network_mode)
-					self._dbusmonitor.set_value_async(service, '/Link/ChargeVoltage', vecan_voltage)
-					voltage_written = 1
+					self.systemcalc.writer.set_value_async(service, '/Link/NetworkMode', network_mode)
+					self.systemcalc.writer.set_value_async(service, '/Link/ChargeVoltage', vecan_voltage)
+					if not self.systemcalc.writer.quarantined(service):
+						voltage_written = 1
 				except DBusException:
 					pass
 
@@ -1409,13 +1446,17 @@ class Dvcc(SystemCalcDelegate):
 					continue
 				charger.networkmode = network_mode
 
+				# Writes to a quarantined charger are held back, and do
+				# not count as written
+				written = int(not charger.quarantined)
+
 				if charge_voltage is not None:
 					charger.chargevoltage = charge_voltage
-					voltage_written = 1
+					voltage_written = voltage_written or written
 
 				if max_charge_current is not None:
 					charger.maxchargecurrent = max_charge_current
-					current_written = 1
+					current_written = current_written or written
 			except DBusException:
 				# If the charger for whatever reason doesn't have the /Link
 				# path, ignore it. This is the legacy implementation and
@@ -1434,8 +1475,9 @@ class Dvcc(SystemCalcDelegate):
 					# for example if the D-Bus path has not been written for more than 60 (?) seconds.
 					# In case there is no path at all, the set_value below will raise an DBusException
 					# which we will ignore cheerfully.
-					self._dbusmonitor.set_value_async(service, '/Link/ChargeVoltage', charge_voltage)
-					voltage_written = 1
+					self.systemcalc.writer.set_value_async(service, '/Link/ChargeVoltage', charge_voltage)
+					if not self.systemcalc.writer.quarantined(service):
+						voltage_written = 1
 				except DBusException:
 					pass
 
@@ -1,5 +1,5 @@
 from datetime import datetime
-from gi.repository import GLib
+from sc_utils import loop_monitor
 from delegates.base import SystemCalcDelegate
 from delegates.batterysoc import BatterySoc
 from delegates.schedule import ScheduledWindow
@@ -309,6 +309,7 @@ class DynamicEssWindow(ScheduledWindow):
 class DynamicEss(SystemCalcDelegate, ChargeControl):
 	control_priority = 0
 	_get_time = datetime.now
+	service_classes = ('vebus', 'acsystem')
 
 	def __init__(self):
 		super(DynamicEss, self).__init__()
@@ -343,7 +344,7 @@ class DynamicEss(SystemCalcDelegate, ChargeControl):
 		self._dbusservice.add_path('/DynamicEss/AllowGridFeedIn', value=None)
 
 		if self.mode > 0:
-			self._timer = GLib.timeout_add(INTERVAL * 1000, self._on_timer)
+			self._timer = loop_monitor.timeout_add(INTERVAL * 1000, self._on_timer)
 
 	def get_settings(self):
 		# Settings for DynamicEss
@@ -378,12 +379,18 @@ class DynamicEss(SystemCalcDelegate, ChargeControl):
 		return settings
 
 	def get_input(self):
+		# Needed for /DynamicEss/Available, also while switched off
 		return [
+			('com.victronenergy.acsystem', [
+				 '/Capabilities/HasDynamicEssSupport'])
+		]
+
+	def get_feature_input(self):
+		return 'dess_mode', [
 			(HUB4_SERVICE, ['/Overrides/ForceCharge',
 				'/Overrides/MaxDischargePower', '/Overrides/Setpoint',
 				'/Overrides/FeedInExcess']),
 			('com.victronenergy.acsystem', [
-				 '/Capabilities/HasDynamicEssSupport',
 				 '/Ess/AcPowerSetpoint',
 				 '/Ess/InverterPowerSetpoint',
 				 '/Ess/UseInverterPowerSetpoint',
@@ -427,7 +434,7 @@ class DynamicEss(SystemCalcDelegate, ChargeControl):
 	def settings_changed(self, setting, oldvalue, newvalue):
 		if setting == 'dess_mode':
 			if oldvalue == 0 and newvalue > 0:
-				self._timer = GLib.timeout_add(INTERVAL * 1000, self._on_timer)
+				self._timer = loop_monitor.timeout_add(INTERVAL * 1000, self._on_timer)
 
 	def windows(self):
 		starttimes = (self._settings['dess_start_{}'.format(i)] for i in range(NUM_SCHEDULES))
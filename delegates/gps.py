@@ -1,6 +1,8 @@
 from delegates.base import SystemCalcDelegate
 
 class Gps(SystemCalcDelegate):
+	service_classes = ('gps',)
+
 	def __init__(self):
 		super(Gps, self).__init__()
 		self.gpses = set()
@@ -12,13 +14,16 @@ class Gps(SystemCalcDelegate):
 	def device_added(self, service, instance, *args):
 		if service.startswith('com.victronenergy.gps.'):
 			self.gpses.add((instance, service))
-			self._dbusmonitor.track_value(service, "/Fix", self.update)
 			self.update()
 
 	def device_removed(self, service, instance):
 		self.gpses.discard((instance, service))
 		self.update()
 
+	def value_changed(self, service, path, value):
+		if path == '/Fix':
+			self.update()
+
 	def get_input(self):
 		return [('com.victronenergy.gps', [
 				'/DeviceInstance',
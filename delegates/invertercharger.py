@@ -9,6 +9,8 @@ class Service(object):
 		self.instance = instance
 
 class InverterCharger(SystemCalcDelegate):
+	service_classes = ('multi', 'inverter')
+
 	def __init__(self):
 		super(InverterCharger, self).__init__()
 		self.devices = {}
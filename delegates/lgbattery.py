@@ -1,10 +1,12 @@
 import logging
-from dbus.exceptions import DBusException
 from delegates.base import SystemCalcDelegate
 
 class LgCircuitBreakerDetect(SystemCalcDelegate):
-	def __init__(self):
+	service_classes = ('battery',)
+
+	def __init__(self, sc):
 		SystemCalcDelegate.__init__(self)
+		self.systemcalc = sc
 		self._lg_voltage_buffer = None
 		self._lg_battery = None
 
@@ -54,7 +56,9 @@ class LgCircuitBreakerDetect(SystemCalcDelegate):
 				(battery_voltage, battery_current, self._lg_voltage_buffer))
 			self._dbusservice['/Dc/Battery/Alarms/CircuitBreakerTripped'] = 2
 			self._lg_voltage_buffer = []
-			try:
-				self._dbusmonitor.set_value(vebus_path, '/Mode', 4)
-			except DBusException:
-				logging.error('Cannot switch off vebus device')
+			self.systemcalc.writer.set_value_async(vebus_path, '/Mode', 4,
+				callback=self._on_switched_off)
+
+	def _on_switched_off(self, error):
+		if error is not None:
+			logging.error('Cannot switch off vebus device: %s' % error)
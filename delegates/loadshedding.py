@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-from gi.repository import GLib
+from sc_utils import loop_monitor
 from delegates.base import SystemCalcDelegate
 from delegates.schedule import ScheduledWindow
 from delegates.batterysoc import BatterySoc
@@ -68,6 +68,7 @@ class LoadSheddingWindow(ScheduledWindow):
 class LoadShedding(SystemCalcDelegate, ChargeControl):
 	control_priority = 10
 	_get_time = datetime.now
+	service_classes = ('multi',)
 
 	def __init__(self):
 		super(LoadShedding, self).__init__()
@@ -87,7 +88,7 @@ class LoadShedding(SystemCalcDelegate, ChargeControl):
 			gettextcallback=lambda p, v: datetime.fromtimestamp(v).isoformat())
 
 		if self.mode > 0:
-			self._timer = GLib.timeout_add(INTERVAL * 1000, self._on_timer)
+			self._timer = loop_monitor.timeout_add(INTERVAL * 1000, self._on_timer)
 
 	def get_settings(self):
 		# Settings for LoadShedding
@@ -120,8 +121,8 @@ class LoadShedding(SystemCalcDelegate, ChargeControl):
 
 		return settings
 
-	def get_input(self):
-		return [
+	def get_feature_input(self):
+		return 'loadshedding_mode', [
 			(HUB4_SERVICE, [
 				'/Overrides/ForceCharge',
 				'/Overrides/MaxDischargePower'
@@ -138,7 +139,7 @@ class LoadShedding(SystemCalcDelegate, ChargeControl):
 	def settings_changed(self, setting, oldvalue, newvalue):
 		if setting == 'loadshedding_mode':
 			if oldvalue == 0 and newvalue > 0:
-				self._timer = GLib.timeout_add(INTERVAL * 1000, self._on_timer)
+				self._timer = loop_monitor.timeout_add(INTERVAL * 1000, self._on_timer)
 
 	def device_added(self, service, instance, *args):
 		if service.startswith('com.victronenergy.multi.'):
@@ -66,6 +66,8 @@ class Service(object):
 		return v == 1
 
 class Multi(SystemCalcDelegate):
+	service_classes = ('vebus',)
+
 	def __init__(self):
 		super(Multi, self).__init__()
 		self.multis = {}
@@ -104,7 +106,6 @@ class Multi(SystemCalcDelegate):
 	def device_added(self, service, instance, *args):
 		if service.startswith('com.victronenergy.vebus.'):
 			self.multis[service] = Service(self._dbusmonitor, service, instance)
-			self._dbusmonitor.track_value(service, "/Connected", self._set_multi)
 			self._set_multi()
 
 	def device_removed(self, service, instance):
@@ -112,6 +113,10 @@ class Multi(SystemCalcDelegate):
 			del self.multis[service]
 			self._set_multi()
 
+	def value_changed(self, service, path, value):
+		if path == '/Connected' and service in self.multis:
+			self._set_multi()
+
 	def _set_multi(self, *args, **kwargs):
 		# If platform has an onboard mkx, use only that as VE.Bus service.
 		# On other platforms, use the Multi with the lowest DeviceInstance.
@@ -1,10 +1,21 @@
 from delegates.base import SystemCalcDelegate
 from sc_utils import safeadd
 
+# Input paths of each phase, and the output paths of each phase for each
+# possible position.
+PHASE_PATHS = tuple(('/Ac/L%s/Power' % phase, '/Ac/L%s/Current' % phase)
+	for phase in range(1, 4))
+POSITION_PATHS = {position: tuple(('%s/L%s/Power' % (position, phase),
+	'%s/L%s/Current' % (position, phase)) for phase in range(1, 4))
+	for position in ('/Ac/PvOnOutput', '/Ac/PvOnGrid', '/Ac/PvOnGenset')}
+
 class PvInverters(SystemCalcDelegate):
+	service_classes = ('pvinverter', 'settings')
+
 	def __init__(self):
 		super(PvInverters, self).__init__()
 		self.pvinverters = set()
+		self._positions = {}
 
 	def set_sources(self, dbusmonitor, settings, dbusservice):
 		super(PvInverters, self).set_sources(dbusmonitor, settings, dbusservice)
@@ -50,11 +61,25 @@ class PvInverters(SystemCalcDelegate):
 	def device_added(self, service, instance, *args):
 		if service.startswith('com.victronenergy.pvinverter.'):
 			self.pvinverters.add(service)
-			self._updatepvinverterspidlist()
+		elif service == 'com.victronenergy.settings':
+			self._positions.clear()
 
 	def device_removed(self, service, instance):
-		if service in self.pvinverters:
-			self.pvinverters.discard(service)
+		self.pvinverters.discard(service)
+		self._positions.pop(service, None)
+
+	def value_changed(self, service, path, value):
+		# The mapped positions depend on the position of the inverter,
+		# and on what is connected to the AC inputs.
+		if path == '/Position':
+			self._positions.pop(service, None)
+		elif path in ('/Settings/SystemSetup/AcInput1',
+				'/Settings/SystemSetup/AcInput2'):
+			self._positions.clear()
+
+	def devices_changed(self, added, removed):
+		if any(s in self.pvinverters for s, _ in added) or \
+				any(s.startswith('com.victronenergy.pvinverter.') for s, _ in removed):
 			self._updatepvinverterspidlist()
 
 	def _updatepvinverterspidlist(self):
@@ -79,22 +104,33 @@ class PvInverters(SystemCalcDelegate):
 			2: '/Ac/PvOnGenset',
 			3: '/Ac/PvOnGrid'}.get(s)
 
+	def _get_position_paths(self, pvinverter):
+		""" Returns the output paths for each phase of this PV inverter,
+		    or None if its position is unknown. Cached until the position
+		    or the AC input settings change. """
+		try:
+			return self._positions[pvinverter]
+		except KeyError:
+			# Position will be None if PV inverter service has just been removed (after retrieving the
+			# service list). Don't cache that.
+			pos = self._dbusmonitor.get_value(pvinverter, '/Position')
+			if pos is None:
+				return None
+			paths = self._positions[pvinverter] = POSITION_PATHS.get(self.map_position(pos))
+			return paths
+
 	def get_totals(self):
 		newvalues = {}
 		for pvinverter in self.pvinverters:
-			# Position will be None if PV inverter service has just been removed (after retrieving the
-			# service list).
-			pos = self._dbusmonitor.get_value(pvinverter, '/Position')
-			if pos is not None and (position := self.map_position(pos)) is not None:
-				for phase in range(1, 4):
-					power = self._dbusmonitor.get_value(pvinverter, '/Ac/L%s/Power' % phase)
+			positionpaths = self._get_position_paths(pvinverter)
+			if positionpaths is not None:
+				for (ppath, cpath), (powerpath, currentpath) in zip(PHASE_PATHS, positionpaths):
+					power = self._dbusmonitor.get_value(pvinverter, ppath)
 					if power is not None:
-						path = '%s/L%s/Power' % (position, phase)
-						newvalues[path] = safeadd(newvalues.get(path), power)
+						newvalues[powerpath] = safeadd(newvalues.get(powerpath), power)
 
-					current = self._dbusmonitor.get_value(pvinverter, '/Ac/L%s/Current' % phase)
+					current = self._dbusmonitor.get_value(pvinverter, cpath)
 					if current is not None:
-						path = '%s/L%s/Current' % (position, phase)
-						newvalues[path] = safeadd(newvalues.get(path), current)
+						newvalues[currentpath] = safeadd(newvalues.get(currentpath), current)
 
 		return newvalues
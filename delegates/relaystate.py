@@ -1,12 +1,10 @@
 from gi.repository import GLib
+from sc_utils import loop_monitor, exit_on_error
 import logging
 import os
 import traceback
 from glob import glob
 
-# Victron packages
-from ve_utils import exit_on_error
-
 from delegates.base import SystemCalcDelegate
 
 class RelayState(SystemCalcDelegate):
@@ -69,7 +67,7 @@ class RelayState(SystemCalcDelegate):
 		self._update_relay_state()
 
 		# Watch changes and update dbus. Do we still need this?
-		GLib.timeout_add(5000, exit_on_error, self._update_relay_state)
+		loop_monitor.timeout_add_adaptive(5000, exit_on_error, self._update_relay_state)
 		return False
 
 	def _update_relay_state(self):
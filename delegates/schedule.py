@@ -1,11 +1,9 @@
 from __future__ import division
 from enum import IntEnum
 import logging
-from gi.repository import GLib
+from sc_utils import loop_monitor, exit_on_error
 from datetime import datetime, timedelta, time, date
 
-# Victron packages
-from ve_utils import exit_on_error
 from delegates.base import SystemCalcDelegate
 from delegates.batterylife import BatteryLife, BLPATH
 from delegates.batterylife import State as BatteryLifeState
@@ -219,6 +217,7 @@ class ScheduledCharging(SystemCalcDelegate, ChargeControl):
 	""" Let the system do other things based on time schedule. """
 	control_priority = 20
 	_get_time = datetime.now
+	service_classes = ('acsystem',)
 
 	def __init__(self):
 		super(ScheduledCharging, self).__init__()
@@ -226,7 +225,7 @@ class ScheduledCharging(SystemCalcDelegate, ChargeControl):
 		self.active = False
 		self.hysteresis = True
 		self.devices = []
-		self._timer = GLib.timeout_add(5000, exit_on_error, self._on_timer)
+		self._timer = loop_monitor.timeout_add(5000, exit_on_error, self._on_timer)
 
 	def set_sources(self, dbusmonitor, settings, dbusservice):
 		super(ScheduledCharging, self).set_sources(dbusmonitor, settings, dbusservice)
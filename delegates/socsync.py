@@ -1,15 +1,27 @@
 from dbus.exceptions import DBusException
 from delegates.base import SystemCalcDelegate
 from delegates.multi import Multi
-from sc_utils import safeadd
+from sc_utils import safeadd, ServiceAggregate
+
+def _measure_pv_current(monitor, service):
+	return monitor.get_value(service, '/Dc/0/Current', 0), \
+		-(monitor.get_value(service, '/Load/I', 0) or 0)
+
+def _combine_pv_current(contributions):
+	pv_current = 0
+	for i, l in contributions:
+		pv_current = safeadd(pv_current, i, l)
+	return pv_current
 
 class SocSync(SystemCalcDelegate):
 	""" This is similar to VebusSocWriter, but for InverterRS. """
+	service_classes = ('vecan', 'solarcharger')
+
 	def __init__(self, sc):
 		super(SocSync, self).__init__()
 		self.systemcalc = sc
 		self.vecan = set()
-		self.solarchargers = set()
+		self.solarchargers = None
 
 	def get_input(self):
 		return [
@@ -22,6 +34,11 @@ class SocSync(SystemCalcDelegate):
 				'/Mgmt/Connection'
 		])]
 
+	def set_sources(self, dbusmonitor, settings, dbusservice):
+		super(SocSync, self).set_sources(dbusmonitor, settings, dbusservice)
+		self.solarchargers = ServiceAggregate(dbusmonitor,
+			('/Dc/0/Current', '/Load/I'), _measure_pv_current, _combine_pv_current)
+
 	def device_added(self, service, instance, *args):
 		if service.startswith('com.victronenergy.vecan.'):
 			self.vecan.add(service)
@@ -32,7 +49,10 @@ class SocSync(SystemCalcDelegate):
 
 	def device_removed(self, service, instance):
 		self.vecan.discard(service)
-		self.solarchargers.discard(service)
+		self.solarchargers.remove(service)
+
+	def value_changed(self, service, path, value):
+		self.solarchargers.update(service, path)
 
 	def update_values(self, newvalues):
 		# Sync SOC with all non-VE.Bus inverter-chargers
@@ -44,17 +64,13 @@ class SocSync(SystemCalcDelegate):
 					# In case service goes down while we write, ignore
 					# exception
 					try:
-						self._dbusmonitor.set_value_async(service, '/Link/Soc', soc)
+						self.systemcalc.writer.set_value_async(service, '/Link/Soc', soc)
 					except DBusException:
 						pass
 
 		# Sync ExtraBatteryCurrent, but only consider currents from
 		# VE.Direct chargers and the Multi
-		pv_current = 0
-		for service in self.solarchargers:
-			pv_current = safeadd(pv_current,
-				self._dbusmonitor.get_value(service, '/Dc/0/Current', 0),
-				-(self._dbusmonitor.get_value(service, '/Load/I', 0) or 0))
+		pv_current = self.solarchargers.totals
 
 		# Add current from Multi
 		multi = Multi.instance.multi
@@ -63,7 +79,7 @@ class SocSync(SystemCalcDelegate):
 
 		for service in self.vecan:
 			try:
-				self._dbusmonitor.set_value_async(service,
+				self.systemcalc.writer.set_value_async(service,
 					'/Link/ExtraBatteryCurrent', pv_current)
 			except DBusException:
 				pass
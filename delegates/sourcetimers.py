@@ -1,8 +1,6 @@
 from time import time
-from gi.repository import GLib
+from sc_utils import loop_monitor, exit_on_error
 
-# Victron packages
-from ve_utils import exit_on_error
 from delegates.base import SystemCalcDelegate
 
 class SourceTimers(SystemCalcDelegate):
@@ -25,11 +23,19 @@ class SourceTimers(SystemCalcDelegate):
 
 	def set_sources(self, dbusmonitor, settings, dbusservice):
 		super(SourceTimers, self).set_sources(dbusmonitor, settings, dbusservice)
-		for p in set(self._paths.values()):
+		self._timer_paths = sorted(set(self._paths.values())) + ['/Timers/TimeOff']
+		for p in self._timer_paths:
 			self._dbusservice.add_path(p, value=0)
-		self._dbusservice.add_path('/Timers/TimeOff', value=0)
 		self._on_timer()
-		self._timer = GLib.timeout_add(10000, exit_on_error, self._on_timer)
+		self._timer = loop_monitor.timeout_add_adaptive(10000, exit_on_error, self._on_timer)
+
+	def get_state(self):
+		return {p: self._dbusservice[p] for p in self._timer_paths}
+
+	def set_state(self, state):
+		# Add the time counted before the restart
+		for p in self._timer_paths:
+			self._dbusservice[p] += int(state.get(p, 0))
 
 	@property
 	def elapsed(self):
@@ -1,11 +1,9 @@
 from dbus.exceptions import DBusException
 from gi.repository import GLib
+from sc_utils import loop_monitor, exit_on_error
 import logging
 from itertools import islice
 
-# Victron packages
-from ve_utils import exit_on_error
-
 from delegates.base import SystemCalcDelegate
 
 class VebusSocWriter(SystemCalcDelegate):
@@ -23,7 +21,7 @@ class VebusSocWriter(SystemCalcDelegate):
 	def __init__(self):
 		SystemCalcDelegate.__init__(self)
 		GLib.idle_add(exit_on_error, lambda: not self._write_vebus_soc())
-		GLib.timeout_add(10000, exit_on_error, self._write_vebus_soc)
+		loop_monitor.timeout_add(10000, exit_on_error, self._write_vebus_soc)
 
 	def get_input(self):
 		return [('com.victronenergy.vebus', [
@@ -0,0 +1,83 @@
+import gzip
+import json
+import time
+from collections import deque
+
+# Number of ticks kept by the flight recorder
+FLIGHT_RECORDER_TICKS = 120
+
+class FlightRecorder(object):
+	""" Keeps what happened during the last size ticks: value changes,
+	    device events and settings changes, and the outputs and writes to
+	    other services they led to. Along with that it keeps the state of
+	    the services and settings from before the oldest tick, so that the
+	    ticks can be replayed, see scripts/flightrecorder2test.py.
+
+	    Events are tuples, recorded in the order they happen:
+	        ('added', service, instance, {path: value})
+	        ('removed', service)
+	        ('value', service, path, value)
+	        ('setting', path, value)
+	        ('output', path, value)
+	        ('write', service, path, value)
+	    Events that come in after a tick are recorded with the next one.
+	    Within a tick, only the latest value, setting, output or write of
+	    each path is kept, in the place of the first one. So a path that
+	    changes at a high rate does not make a tick grow without bound. """
+	def __init__(self, size=FLIGHT_RECORDER_TICKS, clock=time.time):
+		self.size = size
+		self.clock = clock
+		self.services = {} # service -> [instance, {path: value}]
+		self.settings = {} # path -> value
+		self.ticks = deque()
+		self.tick()
+
+	def tick(self):
+		""" Closes the current tick and starts recording the next. """
+		if len(self.ticks) >= self.size:
+			self._apply(self.ticks.popleft()[1])
+		self._events = []
+		self._index = {} # (kind, service, path) -> index in self._events
+		self.ticks.append((self.clock(), self._events))
+
+	def record(self, *event):
+		kind = event[0]
+		if kind in ('added', 'removed'):
+			# Later changes must not move to before this event
+			self._index.clear()
+			self._events.append(event)
+			return
+		key = event[:-1]
+		i = self._index.get(key)
+		if i is None:
+			self._index[key] = len(self._events)
+			self._events.append(event)
+		else:
+			self._events[i] = event
+
+	def _apply(self, events):
+		""" Moves the state forward past a tick that drops out. """
+		for event in events:
+			kind = event[0]
+			if kind == 'added':
+				self.services[event[1]] = [event[2], dict(event[3])]
+			elif kind == 'removed':
+				self.services.pop(event[1], None)
+			elif kind == 'value':
+				if event[1] in self.services:
+					self.services[event[1]][1][event[2]] = event[3]
+			elif kind == 'setting':
+				self.settings[event[1]] = event[2]
+
+	def dump(self, filename):
+		with gzip.open(filename, 'wt') as f:
+			json.dump({
+				'version': 1,
+				'services': self.services,
+				'settings': self.settings,
+				'ticks': [{'time': t, 'events': events} for t, events in self.ticks]
+			}, f, separators=(',', ':'), default=str)
+
+def load(filename):
+	with gzip.open(filename, 'rt') as f:
+		return json.load(f)
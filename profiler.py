@@ -0,0 +1,52 @@
+import cProfile
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+class Profiler(object):
+	""" Profiles the main loop for a while with cProfile, without a restart.
+	    cProfile only sees the thread it is enabled in, which is the one
+	    running the main loop. The statistics are written in pstats format
+	    to a file in directory, which can be inspected with
+	    python3 -m pstats <file>. """
+	def __init__(self, directory, clock=time.time):
+		self.directory = directory
+		self.clock = clock
+		self._profile = None
+
+	@property
+	def running(self):
+		return self._profile is not None
+
+	def start(self):
+		if self._profile is not None:
+			return False
+		profile = cProfile.Profile()
+		try:
+			profile.enable()
+		except ValueError as e:
+			# Another profiler is already active
+			logger.error('Cannot start profiler: %s', e)
+			return False
+		self._profile = profile
+		return True
+
+	def stop(self):
+		""" Stops profiling and returns the name of the file the statistics
+		    were written to, or None if that failed. """
+		if self._profile is None:
+			return None
+		profile, self._profile = self._profile, None
+		profile.disable()
+		filename = os.path.join(self.directory, time.strftime(
+			'dbus-systemcalc-%Y%m%d-%H%M%S.prof', time.localtime(self.clock())))
+		try:
+			os.makedirs(self.directory, exist_ok=True)
+			profile.dump_stats(filename)
+		except OSError as e:
+			logger.error('Cannot write profile to %s: %s', filename, e)
+			return None
+		logger.info('Profile written to %s', filename)
+		return filename
@@ -1,8 +1,36 @@
+import sys
+import time
+import traceback
+from bisect import bisect_left
 from functools import update_wrapper
-from collections import Mapping
+from collections import Counter, Mapping, OrderedDict, namedtuple
+from gi.repository import GLib
+
+# Victron packages
+from ve_utils import exit_on_error as _exit_on_error
 
 VictronServicePrefix = 'com.victronenergy'
 
+# Functions called, without arguments, before exit_on_error ends the process
+crash_handlers = []
+
+
+def exit_on_error(func, *args, **kwargs):
+	""" Like ve_utils.exit_on_error, which ends the process when func
+	    raises, but runs the crash handlers first. """
+	try:
+		return func(*args, **kwargs)
+	except:
+		e = sys.exc_info()[1]
+		for handler in crash_handlers:
+			try:
+				handler()
+			except Exception:
+				traceback.print_exc()
+		def reraise():
+			raise e
+		return _exit_on_error(reraise)
+
 
 def safeadd(*values):
 	""" Adds all parameters passed to this function. Parameters which are None
@@ -37,6 +65,21 @@ def service_instance_name(service_name, instance):
 	return '%s/%s' % (service_base_name(service_name), instance)
 
 
+class ServiceId(namedtuple('ServiceId', ('service_class', 'suffix', 'instance'))):
+	'''A D-Bus service name split into its parts.
+	Example: com.victronenergy.grid.cgwacs_ttyUSB0_di30_mb1 with instance 30
+	yields ServiceId('grid', 'cgwacs_ttyUSB0_di30_mb1', 30). The service class
+	is None for services outside com.victronenergy.'''
+	__slots__ = ()
+
+	@classmethod
+	def parse(cls, service_name, instance=None):
+		parts = service_name.split('.', 3)
+		if len(parts) < 3 or '.'.join(parts[:2]) != VictronServicePrefix:
+			return cls(None, service_name, instance)
+		return cls(parts[2], parts[3] if len(parts) > 3 else '', instance)
+
+
 def gpio_paths(etc_path):
 	try:
 		with open(etc_path, 'rt') as r:
@@ -105,3 +148,502 @@ class ExpiringValue(object):
 	def set(self, v):
 		self._value = v
 		self._ttl = self._maxage
+
+class ExpiringCache(object):
+	""" Bounded store for the state of things that went away, but may
+	    come back, eg the configuration of a device that disconnected. Holds
+	    at most maxsize entries, dropping the oldest first. Like ExpiringValue
+	    this doesn't use a timer: expire() drops the entries stored more than
+	    maxage seconds ago. The age is measured on clock, not in calls to
+	    expire(), so it holds when the caller runs on a stretched timer. """
+	def __init__(self, maxsize, maxage, clock=time.monotonic):
+		self._maxsize = maxsize
+		self._maxage = maxage
+		self.clock = clock
+		self._entries = OrderedDict() # key -> (value, deadline), oldest first
+
+	def __len__(self):
+		return len(self._entries)
+
+	def __contains__(self, key):
+		return key in self._entries
+
+	def put(self, key, value):
+		self._entries.pop(key, None)
+		self._entries[key] = (value, self.clock() + self._maxage)
+		while len(self._entries) > self._maxsize:
+			self._entries.popitem(last=False)
+
+	def pop(self, key, default=None):
+		try:
+			return self._entries.pop(key)[0]
+		except KeyError:
+			return default
+
+	def clear(self):
+		self._entries.clear()
+
+	def expire(self):
+		now = self.clock()
+		while self._entries:
+			key, (_, deadline) = next(iter(self._entries.items()))
+			if deadline > now:
+				break
+			del self._entries[key]
+
+class ChangeLog(object):
+	""" Bounded log of changed paths. Every change is tagged with a
+	    monotonically increasing sequence number, so that a client that
+	    already has a copy of our values can ask for just the paths that
+	    changed since the last sequence number it saw. Only the latest change
+	    of each path is kept. Once more than size distinct paths have changed
+	    the oldest entries are dropped, and clients that are further behind
+	    than that must resync using GetItems. """
+	def __init__(self, size, start=0):
+		self._size = size
+		self._log = OrderedDict() # path -> sequence number, oldest first
+		self._seq = self._floor = start
+
+	@property
+	def seq(self):
+		return self._seq
+
+	def add(self, path):
+		self._seq += 1
+		self._log.pop(path, None)
+		self._log[path] = self._seq
+		if len(self._log) > self._size:
+			_, self._floor = self._log.popitem(last=False)
+
+	def changes_since(self, seq):
+		""" Returns the list of paths changed after seq, most recent first,
+		    or None if the log no longer covers seq. """
+		if seq < self._floor or seq > self._seq:
+			return None
+		changes = []
+		for path in reversed(self._log):
+			if self._log[path] <= seq:
+				break
+			changes.append(path)
+		return changes
+
+class ObservedService(object):
+	""" Wraps a VeDbusService, and calls changed(path, value) for every
+	    path that is added, removed or set to a different value, whichever
+	    code sets it. Values set inside a with block are observed too. All
+	    else is left to the wrapped service.
+
+	    Values restored from before a restart are published like any other,
+	    but read as None through the wrapper, so code using it never acts
+	    on them. Setting such a path to None keeps the restored value, the
+	    first valid value replaces it. """
+	def __init__(self, service, changed):
+		self._service = service
+		self._changed = changed
+		self.restored = set() # Paths that hold a restored value
+
+	def __getattr__(self, name):
+		return getattr(self._service, name)
+
+	def __contains__(self, path):
+		return path in self._service
+
+	def __getitem__(self, path):
+		return None if path in self.restored else self._service[path]
+
+	def published(self, path):
+		""" Returns the value of path as published, restored or not. """
+		return self._service[path]
+
+	def _set(self, target, path, value):
+		if path in self.restored:
+			if value is None:
+				return
+			self.restored.discard(path)
+		changed = target[path] != value
+		target[path] = value
+		if changed:
+			self._changed(path, value)
+
+	def __setitem__(self, path, value):
+		self._set(self._service, path, value)
+
+	def __delitem__(self, path):
+		self.restored.discard(path)
+		del self._service[path]
+		self._changed(path, None)
+
+	def add_path(self, path, value=None, *args, **kwargs):
+		result = self._service.add_path(path, value, *args, **kwargs)
+		self._changed(path, value)
+		return result
+
+	def restore(self, values):
+		""" Publishes values, a dict of path to value, on those paths that
+		    have no value yet. """
+		for path, value in values.items():
+			if value is not None and path in self._service and self._service[path] is None:
+				self._service[path] = value
+				self.restored.add(path)
+				self._changed(path, value)
+
+	def expire_restored(self):
+		""" Invalidates the restored values that are still published. """
+		restored, self.restored = self.restored, set()
+		for path in restored:
+			self._service[path] = None
+			self._changed(path, None)
+
+	def __enter__(self):
+		return _ObservedContext(self._service.__enter__(), self)
+
+	def __exit__(self, *exc):
+		return self._service.__exit__(*exc)
+
+class _ObservedContext(object):
+	""" What ObservedService hands out in a with block. """
+	def __init__(self, context, observed):
+		self._context = context
+		self._observed = observed
+
+	def __getattr__(self, name):
+		return getattr(self._context, name)
+
+	def __contains__(self, path):
+		return path in self._context
+
+	def __getitem__(self, path):
+		return None if path in self._observed.restored else self._context[path]
+
+	def __setitem__(self, path, value):
+		self._observed._set(self._context, path, value)
+
+class ServiceAggregate(object):
+	""" Keeps running totals over all services of a kind. The contribution
+	    of a service is measured when it is added, and measured again only
+	    when one of the paths it depends on changes. The difference with
+	    the previous contribution is then added to the running sums, so the
+	    cost does not depend on the number of services. As rounding errors
+	    add up that way, the sums are added up anew every RECOMPUTE_AFTER
+	    changes, and when a service goes away or has no valid data anymore.
+
+	    measure(monitor, service) returns the contribution of a service:
+	    None if it has no valid data, or a tuple (terms, info), where terms
+	    is a dict of quantities to add up. finish(sums, first, last)
+	    returns the totals, from the sums of the quantities that at least
+	    one service contributes, and the info of the first and the last
+	    valid contribution in the order the services were added, or None
+	    if there is none. """
+	RECOMPUTE_AFTER = 1000
+
+	def __init__(self, monitor, paths, measure, finish):
+		self._monitor = monitor
+		self.paths = frozenset(paths)
+		self._measure = measure
+		self._finish = finish
+		self._contributions = OrderedDict()
+		self._sums = {}
+		self._counts = {}
+		self._changes = 0
+		self._totals = None
+		self._dirty = True
+
+	def __contains__(self, service):
+		return service in self._contributions
+
+	def __len__(self):
+		return len(self._contributions)
+
+	def _apply(self, terms, sign):
+		for k, v in terms.items():
+			n = self._counts.get(k, 0) + sign
+			if n == 0:
+				# The last one leaves no rounding errors behind
+				del self._counts[k], self._sums[k]
+			else:
+				self._counts[k] = n
+				self._sums[k] = self._sums.get(k, 0) + sign * v
+
+	def _recompute(self):
+		self._sums = {}
+		self._counts = {}
+		self._changes = 0
+		for c in self._contributions.values():
+			if c is not None:
+				self._apply(c[0], 1)
+
+	def _set(self, service, c):
+		old = self._contributions.get(service)
+		self._contributions[service] = c
+		self._dirty = True
+		self._changes += 1
+		if (old is not None and c is None) or self._changes >= self.RECOMPUTE_AFTER:
+			self._recompute()
+			return
+		if old is not None:
+			self._apply(old[0], -1)
+		if c is not None:
+			self._apply(c[0], 1)
+
+	def add(self, service):
+		self._set(service, self._measure(self._monitor, service))
+
+	def remove(self, service):
+		if service in self._contributions:
+			del self._contributions[service]
+			self._dirty = True
+			self._recompute()
+
+	def update(self, service, path):
+		if path in self.paths and service in self._contributions:
+			c = self._measure(self._monitor, service)
+			if c != self._contributions[service]:
+				self._set(service, c)
+
+	def _info(self, contributions):
+		for c in contributions:
+			if c is not None:
+				return c[1]
+		return None
+
+	@property
+	def totals(self):
+		if self._dirty:
+			contributions = self._contributions.values()
+			self._totals = self._finish(dict(self._sums), self._info(contributions),
+				self._info(reversed(contributions)))
+			self._dirty = False
+		return self._totals
+
+
+class LoopTimer(object):
+	""" Firing statistics of one kind of timer. """
+	def __init__(self, name):
+		self.name = name
+		self.runs = 0
+		self.maxlag = 0
+		self.maxduration = 0
+
+class AdaptiveTimer(object):
+	""" A timer that runs stretch times less often while the main loop is
+	    idle. Going idle takes effect at the next run, waking up right
+	    away. """
+	def __init__(self, monitor, interval, callback, *args):
+		self.monitor = monitor
+		self.interval = interval
+		self.callback = callback
+		self.args = args
+		self.current = None
+		self._source = None
+		self._running = False
+		self._start()
+
+	def _wanted(self):
+		return self.interval * self.monitor.stretch if self.monitor.idle else self.interval
+
+	def _start(self):
+		self.current = self._wanted()
+		self._source = GLib.timeout_add(self.current,
+			self.monitor.wrap(self.current, self._run, self.callback, *self.args))
+		if self.current != self.interval:
+			self.monitor._stretched.add(self)
+		else:
+			self.monitor._stretched.discard(self)
+
+	def _run(self, callback, *args):
+		self._running = True
+		try:
+			keep = callback(*args)
+		finally:
+			self._running = False
+		if not keep:
+			self._source = None
+			self.monitor._stretched.discard(self)
+			return False
+		if self.current != self._wanted():
+			self._start()
+			return False
+		return True
+
+	def wake(self):
+		# A running timer picks up the new interval when it returns
+		if self._source is not None and not self._running:
+			GLib.source_remove(self._source)
+			self._start()
+
+class LoopMonitor(object):
+	""" Measures how late timers fire compared to when they were due. All
+	    timers and D-Bus callbacks share the same GLib main loop, so a timer
+	    that fires late was held up by whatever ran before it. When a timer
+	    is more than threshold seconds late, the timer callback that ran
+	    last is counted as the culprit if it took more than threshold
+	    seconds itself. Otherwise the time went elsewhere, eg to D-Bus
+	    traffic, and 'other' is counted.
+
+	    Timers are added with timeout_add, which takes the same arguments as
+	    GLib.timeout_add. A timer is named after the last callable passed,
+	    so that the name of a callback wrapped in exit_on_error is used.
+
+	    Timers added with timeout_add_adaptive run stretch times less often
+	    while the loop is idle, see set_idle. Use them only for work that
+	    can wait. """
+	buckets = (10, 50, 100, 500, 1000, 5000) # milliseconds
+	stretch = 5
+
+	def __init__(self, threshold=0.1, clock=time.monotonic):
+		self.threshold = threshold
+		self.clock = clock
+		self.timers = {} # name -> LoopTimer
+		self.histogram = [0] * (len(self.buckets) + 1)
+		self.culprits = Counter()
+		self.changed = False
+		self.idle = False
+		self._last = 'other'
+		self._stretched = set()
+
+	def timeout_add(self, interval, callback, *args):
+		return GLib.timeout_add(interval, self.wrap(interval, callback, *args))
+
+	def timeout_add_adaptive(self, interval, callback, *args):
+		return AdaptiveTimer(self, interval, callback, *args)
+
+	def set_idle(self, idle):
+		""" Stretches the adaptive timers while idle. When no longer idle,
+		    stretched timers are put back on their normal interval right
+		    away. """
+		if idle == self.idle:
+			return
+		self.idle = idle
+		self.changed = True
+		if not idle:
+			for timer in list(self._stretched):
+				timer.wake()
+
+	def wrap(self, interval, callback, *args):
+		""" Returns a function that calls callback(*args) and records how
+		    late it is, assuming it is called every interval
+		    milliseconds. """
+		name = [f for f in (callback,) + args if callable(f)][-1].__qualname__
+		timer = self.timers.get(name)
+		if timer is None:
+			timer = self.timers[name] = LoopTimer(name)
+			self.changed = True
+		interval = interval / 1000.0
+		due = [self.clock() + interval]
+
+		def run():
+			start = self.clock()
+			lag = max(0, start - due[0])
+			self._record(timer, lag)
+			try:
+				return callback(*args)
+			finally:
+				# GLib schedules the next run relative to this one
+				due[0] = start + interval
+				duration = self.clock() - start
+				timer.runs += 1
+				timer.maxduration = max(timer.maxduration, duration)
+				self._last = name if duration > self.threshold else 'other'
+		return run
+
+	def _record(self, timer, lag):
+		self.histogram[bisect_left(self.buckets, lag * 1000)] += 1
+		timer.maxlag = max(timer.maxlag, lag)
+		if lag > self.threshold:
+			self.culprits[self._last] += 1
+			self.changed = True
+
+	def stats(self):
+		return {
+			'idle': int(self.idle),
+			'histogram': dict(zip([str(b) for b in self.buckets] + ['+Inf'],
+				self.histogram)),
+			'culprits': dict(self.culprits),
+			'timers': {t.name: {
+				'runs': t.runs,
+				'maxlag': round(t.maxlag * 1000),
+				'maxduration': round(t.maxduration * 1000)}
+				for t in self.timers.values()}
+		}
+
+class TickBudget(object):
+	""" Keeps the work done in a tick within budget seconds. Work that can
+	    wait is passed to run. Once the tick has used up its budget, that
+	    work is deferred to the main loop's idle time, one piece per
+	    iteration. Deferred work with the same key is replaced by newer
+	    work, so only the latest runs. A budget of None never defers. """
+	def __init__(self, budget=None, clock=time.monotonic):
+		self.budget = budget
+		self.clock = clock
+		self.deferrals = 0
+		self.changed = False
+		self._start = None
+		self._pending = OrderedDict()
+		self._scheduled = False
+
+	def begin(self):
+		self._start = self.clock()
+
+	def end(self):
+		self._start = None
+
+	@property
+	def exceeded(self):
+		return self.budget is not None and self._start is not None and \
+			self.clock() - self._start > self.budget
+
+	def run(self, key, callback, *args):
+		if not self.exceeded:
+			# Anything deferred under this key is out of date now
+			self._pending.pop(key, None)
+			callback(*args)
+			return
+
+		self._pending[key] = (callback, args)
+		self.deferrals += 1
+		self.changed = True
+		if not self._scheduled:
+			self._scheduled = True
+			GLib.idle_add(exit_on_error, self._run_pending)
+
+	def _run_pending(self):
+		if self._pending:
+			key, (callback, args) = self._pending.popitem(last=False)
+			callback(*args)
+		self._scheduled = bool(self._pending)
+		return self._scheduled
+
+	@property
+	def pending(self):
+		return list(self._pending)
+
+class Quiescence(object):
+	""" Tells meaningful changes from noise. The deadband of a path is
+	    looked up by its last part, eg 'Power'. A value changes meaningfully
+	    when it moves more than the deadband away from where it was at the
+	    last meaningful change. A deadband of 0 makes every change count,
+	    paths without a deadband never count. """
+	def __init__(self, deadbands):
+		self.deadbands = deadbands
+		self._reference = {}
+
+	def changed(self, service, path, value):
+		deadband = self.deadbands.get(path[path.rfind('/') + 1:])
+		if deadband is None:
+			return False
+		key = (service, path)
+		reference = self._reference.get(key)
+		if reference is not None and value is not None:
+			try:
+				if abs(value - reference) <= deadband:
+					return False
+			except TypeError:
+				if value == reference:
+					return False
+		elif key in self._reference and value is reference:
+			return False
+		self._reference[key] = value
+		return True
+
+# Shared by all timers on the main loop
+loop_monitor = LoopMonitor()
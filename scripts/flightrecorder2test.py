@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+""" Turns a flight recorder dump, written when dbus_systemcalc exits on an
+    error, into a test case that replays the recorded ticks on
+    MockSystemCalc. Put the output in the tests directory and run it to
+    reproduce the failure:
+
+    ./flightrecorder2test.py /tmp/dbus-systemcalc-flightrecorder.json.gz \\
+        > ../tests/replay_test.py
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+import flightrecorder
+
+HEADER = '''#!/usr/bin/env python3
+# Replay of {source}, generated by scripts/flightrecorder2test.py
+import unittest
+
+# This adapts sys.path to include all relevant packages
+import context
+
+# our own packages
+from base import TestSystemCalcBase
+
+# Monkey patching for unit tests
+import patches
+
+class TestReplay(TestSystemCalcBase):
+	def __init__(self, methodName='runTest'):
+		TestSystemCalcBase.__init__(self, methodName)
+
+	def setUp(self):
+		TestSystemCalcBase.setUp(self)
+'''
+
+FOOTER = '''
+if __name__ == '__main__':
+	unittest.main()
+'''
+
+def service_values(instance, values):
+	values = dict(values)
+	values['/DeviceInstance'] = instance
+	return values
+
+def convert(dump, source, check_outputs, out):
+	out.write(HEADER.format(source=source))
+	for path, value in sorted(dump['settings'].items()):
+		out.write('\t\tself._set_setting({!r}, {!r})\n'.format(path, value))
+	for service, (instance, values) in sorted(dump['services'].items()):
+		out.write('\t\tself._monitor.add_service({!r}, {!r})\n'.format(
+			service, service_values(instance, values)))
+
+	out.write('\n\tdef test_replay(self):\n')
+	ticks = dump['ticks']
+	for i, tick in enumerate(ticks):
+		outputs = {}
+		out.write('\t\t# Tick {} of {}, at {}\n'.format(i + 1, len(ticks), tick['time']))
+		for event in tick['events']:
+			kind, args = event[0], event[1:]
+			if kind == 'added':
+				out.write('\t\tself._monitor.add_service({!r}, {!r})\n'.format(
+					args[0], service_values(args[1], args[2])))
+			elif kind == 'removed':
+				out.write('\t\tself._monitor.remove_service({!r})\n'.format(args[0]))
+			elif kind == 'value':
+				out.write('\t\tself._monitor.set_value({!r}, {!r}, {!r})\n'.format(*args))
+			elif kind == 'setting':
+				out.write('\t\tself._set_setting({!r}, {!r})\n'.format(*args))
+			elif kind == 'write':
+				out.write('\t\t# wrote {} {} = {!r}\n'.format(*args))
+			elif kind == 'output':
+				outputs[args[0]] = args[1]
+		out.write('\t\tself._update_values()\n')
+		# The last tick is the one that failed, its outputs are incomplete
+		if check_outputs and outputs and i < len(ticks) - 1:
+			out.write('\t\tself._check_values({!r})\n'.format(outputs))
+	out.write(FOOTER)
+
+def main():
+	parser = argparse.ArgumentParser(
+		description='Converts a flight recorder dump into a replay test case')
+	parser.add_argument('dump', help='the flight recorder file')
+	parser.add_argument('--check-outputs', action='store_true',
+		help='check the outputs published in each tick against the recording')
+	args = parser.parse_args()
+
+	convert(flightrecorder.load(args.dump), os.path.basename(args.dump),
+		args.check_outputs, sys.stdout)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+""" Builds a single file bundle (a zipapp) of dbus_systemcalc, its
+    delegates and the velib modules it uses. The bundle holds bytecode
+    only, so nothing has to be parsed or compiled at startup, and nothing
+    has to be written to a read-only root filesystem. The bytecode is not
+    optimized by default: that would strip the asserts systemcalc relies on.
+
+    The bytecode is specific to the Python version this runs with, which
+    must match the target. """
+
+import argparse
+import io
+import marshal
+import os
+import sys
+import zipfile
+from importlib.util import MAGIC_NUMBER
+
+# Not alter_sys, that would set sys.argv[0] to a path inside the bundle
+MAIN = '''import runpy
+runpy.run_module('dbus_systemcalc', run_name='__main__')
+'''
+
+OPTIMIZE = 0
+
+def pyc(source, filename, optimize):
+	""" Returns the contents of an unchecked .pyc file for source. """
+	code = compile(source, filename, 'exec', dont_inherit=True, optimize=optimize)
+	data = io.BytesIO()
+	data.write(MAGIC_NUMBER)
+	# Flags: not hash based. The source is not in the bundle, so the mtime
+	# and size are never checked.
+	data.write((0).to_bytes(4, 'little'))
+	data.write((0).to_bytes(4, 'little'))
+	data.write((len(source) & 0xFFFFFFFF).to_bytes(4, 'little'))
+	marshal.dump(code, data)
+	return data.getvalue()
+
+def main():
+	parser = argparse.ArgumentParser(description='Builds a bytecode bundle of dbus_systemcalc')
+	parser.add_argument('-o', '--output', required=True, help='the bundle to write')
+	parser.add_argument('--root', required=True,
+		help='source directory, files below it keep their relative path in the bundle')
+	parser.add_argument('--lib', action='append', default=[],
+		help='a library module to put at the top of the bundle')
+	parser.add_argument('-O', '--optimize', type=int, default=OPTIMIZE,
+		help='optimization level, as for compile(), 1 and up strip the asserts')
+	parser.add_argument('files', nargs='+', help='modules to put in the bundle')
+	args = parser.parse_args()
+
+	modules = [(f, os.path.relpath(f, args.root)) for f in args.files] + \
+		[(f, os.path.basename(f)) for f in args.lib]
+
+	with open(args.output, 'wb') as out:
+		out.write(b'#!/usr/bin/python3 -u\n')
+		with zipfile.ZipFile(out, 'w', zipfile.ZIP_STORED) as bundle:
+			bundle.writestr('__main__.pyc', pyc(MAIN, '__main__.py', args.optimize))
+			for filename, arcname in modules:
+				with open(filename, 'rb') as f:
+					source = f.read()
+				bundle.writestr(os.path.splitext(arcname)[0] + '.pyc',
+					pyc(source, arcname, args.optimize))
+	os.chmod(args.output, 0o755)
+	print('{}: {} modules'.format(args.output, len(modules) + 1))
+
+if __name__ == "__main__":
+	main()
@@ -91,3 +91,77 @@ class TestHubSystem(TestSystemCalcBase):
 		data = self._service._dbusobjects['/Batteries']
 		self.assertTrue(len(data) == 1)
 		self.assertEqual(data[0]['name'], "battery")
+
+	def test_battery_paths(self):
+		mock_load_configured_batteries(BatteryData.instance, [
+			{"name": None, "service": "com.victronenergy.battery/0", "enabled": True},
+			{"name": None, "service": "com.victronenergy.battery/1", "enabled": True},
+		])
+
+		self._update_values(5000)
+		self._check_values({
+			'/Batteries/com_victronenergy_battery_0/Voltage': 12.15,
+			'/Batteries/com_victronenergy_battery_0/ActiveBatteryService': True,
+			'/Batteries/com_victronenergy_battery_1/Name': 'Sled battery',
+			'/Batteries/com_victronenergy_battery_1/ActiveBatteryService': False,
+		})
+
+		# Only the battery that changed is recalculated
+		trackers = BatteryData.instance.batteries
+		first = trackers['com.victronenergy.battery.ttyO1'][0].data()
+		self._monitor.set_value('com.victronenergy.battery.ttyO2', '/Dc/0/Voltage', 12.4)
+		self.assertIs(trackers['com.victronenergy.battery.ttyO1'][0].data(), first)
+
+		self._update_values(5000)
+		self._check_values({
+			'/Batteries/com_victronenergy_battery_1/Voltage': 12.4,
+		})
+		data = {b['instance']: b['voltage'] for b in self._service._dbusobjects['/Batteries']}
+		self.assertEqual(data, {0: 12.15, 1: 12.4})
+
+		# Removing the battery removes its paths
+		self._remove_device('com.victronenergy.battery.ttyO2')
+		self._update_values(5000)
+		self.assertNotIn('/Batteries/com_victronenergy_battery_1/Voltage', self._service)
+
+	def test_departed_batteries(self):
+		from delegates.batterydata import DEPARTED_BATTERIES_SIZE, \
+			DEPARTED_BATTERIES_MAXAGE, BATTERY_PATHS
+		bd = BatteryData.instance
+		config = bd.configured_batteries['com.victronenergy.battery/1']
+		now = [0]
+		bd.departed_batteries.clock = lambda: now[0]
+		published = lambda: len([p for p in self._service._dbusobjects
+			if p.startswith('/Batteries/')])
+
+		# Batteries that come and go do not accumulate state, nor paths
+		for i in range(2, 102):
+			service = 'com.victronenergy.battery.ttyUSB{}'.format(i)
+			service_id = 'com.victronenergy.battery/{}'.format(i)
+			bd.configured_batteries[service_id] = MockBatteryConfiguration(
+				service_id, None, True)
+			self._add_device(service, product_name='battery',
+				values={'/Dc/0/Voltage': 12.0, '/DeviceInstance': i})
+			self._update_values(5000)
+			self.assertIn('/Batteries/com_victronenergy_battery_{}/Voltage'.format(i),
+				self._service)
+			self.assertLessEqual(published(), 3 * len(BATTERY_PATHS))
+			self._remove_device(service)
+			self._update_values(5000)
+			self.assertLessEqual(len(bd.departed_batteries), DEPARTED_BATTERIES_SIZE)
+		self._remove_device('com.victronenergy.battery.ttyO2')
+		self.assertEqual(len(bd.batteries), 1)
+		self.assertEqual(len(bd.configured_batteries), 2)
+		self.assertEqual(len(bd.departed_batteries), DEPARTED_BATTERIES_SIZE)
+		self.assertLessEqual(published(), 2 * len(BATTERY_PATHS))
+
+		# A returning battery gets its configuration back
+		self._add_device('com.victronenergy.battery.ttyO2',
+			product_name='battery',
+			values={'/Dc/0/Voltage': 12.15, '/DeviceInstance': 1})
+		self.assertIs(bd.configured_batteries['com.victronenergy.battery/1'], config)
+
+		# The others are forgotten after a while, however often the timer ran
+		now[0] = DEPARTED_BATTERIES_MAXAGE
+		self._update_values(5000)
+		self.assertEqual(len(bd.departed_batteries), 0)
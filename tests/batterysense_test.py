@@ -1035,3 +1035,50 @@ class VoltageSenseTest(TestSystemCalcBase):
 		self._check_external_values({
 			'com.victronenergy.alternator.ttyO1': {
 				'/Link/BatteryCurrent': 5.3}})
+
+	def test_temperature_sensor_registry(self):
+		self._add_device('com.victronenergy.temperature.ttyO3',
+			product_name='temperature sensor',
+			values={
+				'/Temperature': 9,
+				'/TemperatureType': 0,
+				'/DeviceInstance': 3})
+		self._update_values(3000)
+		self.assertEqual(self._service['/AvailableTemperatureServices'], {
+			'default': 'Automatic',
+			'nosensor': 'No sensor',
+			'com.victronenergy.temperature/3/Temperature': 'temperature sensor on dummy'})
+
+		# The selection is parsed once, not every tick
+		parsed = []
+		parse = BatterySense._parse_selection
+		BatterySense.instance._parse_selection = lambda v: parsed.append(v) or parse(v)
+		self._set_setting('/Settings/SystemSetup/TemperatureService', 'com.victronenergy.temperature/3/Temperature')
+		self._update_values(9000)
+		self.assertEqual(parsed, ['com.victronenergy.temperature/3/Temperature'])
+		self._check_values({
+			'/Dc/Battery/Temperature': 9,
+			'/Dc/Battery/TemperatureService': 'com.victronenergy.temperature.ttyO3'})
+
+		# The sensor is dropped from the list when it is no longer a battery
+		# sensor, and no longer used.
+		self._monitor.set_value('com.victronenergy.temperature.ttyO3', '/TemperatureType', 1)
+		self.assertFalse('com.victronenergy.temperature/3/Temperature' in \
+			self._service['/AvailableTemperatureServices'])
+		self._update_values(3000)
+		self._check_values({
+			'/Dc/Battery/Temperature': None,
+			'/Dc/Battery/TemperatureService': None})
+
+		# A sensor that comes back with the same instance is used again
+		self._remove_device('com.victronenergy.temperature.ttyO3')
+		self._add_device('com.victronenergy.temperature.ttyO4',
+			product_name='temperature sensor',
+			values={
+				'/Temperature': 11,
+				'/TemperatureType': 0,
+				'/DeviceInstance': 3})
+		self._update_values(3000)
+		self._check_values({
+			'/Dc/Battery/Temperature': 11,
+			'/Dc/Battery/TemperatureService': 'com.victronenergy.temperature.ttyO4'})
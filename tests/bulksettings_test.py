@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+import unittest
+from types import SimpleNamespace
+from dbus.exceptions import DBusException
+
+# This adapts sys.path to include all relevant packages
+import context
+
+# our own packages
+from bulksettings import BulkSettingsDevice, BulkSettingsUnsupported, DefaultSettings, \
+	add_settings_async
+from delegates.batterydata import BatteryConfiguration
+
+class MockBus(object):
+	""" Stands in for localsettings on the bus. Records the calls made. """
+	def __init__(self, values, refuse=(), bulk=True, reply_values=True):
+		self.values = values
+		self.refuse = refuse
+		self.bulk = bulk
+		self.reply_values = reply_values
+		self.calls = []
+		self.receivers = []
+		self.held = None # Replies to asynchronous calls, when held back
+
+	def name_has_owner(self, name):
+		return True
+
+	def add_signal_receiver(self, handler, **kwargs):
+		bus = self
+		class Match(object):
+			def remove(self):
+				bus.receivers.remove(handler)
+		self.receivers.append(handler)
+		return Match()
+
+	def _call(self, path, method, args):
+		if method == 'AddSettings':
+			if not self.bulk:
+				raise DBusException('No AddSettings',
+					name='org.freedesktop.DBus.Error.UnknownMethod')
+			results = []
+			for s in args[0]:
+				p = str(s['path'])
+				if p in self.refuse:
+					results.append({'path': p, 'error': -2})
+				else:
+					self.values.setdefault(p, s['default'])
+					results.append({'path': p, 'error': 0})
+					if self.reply_values:
+						results[-1]['value'] = self.values[p]
+			return results
+		if method == 'GetValue':
+			return self.values[path]
+		if method == 'SetValue':
+			self.values[path] = args[0]
+
+	def call_blocking(self, service, path, interface, method, signature, args):
+		self.calls.append(method)
+		return self._call(path, method, args)
+
+	def call_async(self, service, path, interface, method, signature, args,
+			reply_handler, error_handler):
+		self.calls.append(method)
+		def reply():
+			result = self._call(path, method, args)
+			if result is None:
+				reply_handler()
+			else:
+				reply_handler(result)
+		if self.held is None:
+			reply()
+		else:
+			self.held.append(reply)
+
+	def release(self):
+		""" Sends the held replies. Replies to calls made meanwhile are
+		    held until the next release. """
+		held, self.held = self.held, []
+		for reply in held:
+			reply()
+
+	def changed(self, path, value):
+		self.values[path] = value
+		for handler in self.receivers:
+			handler({'Value': value, 'Text': str(value)}, path=path)
+
+class TestBulkSettings(unittest.TestCase):
+	def setUp(self):
+		self.events = []
+		self.supported = {
+			'batteryservice': ['/Settings/SystemSetup/BatteryService', 'default', 0, 0],
+			'hasdcsystem': ['/Settings/SystemSetup/HasDcSystem', 0, 0, 1],
+			'pvmax': ['/Settings/Gui/Gauges/Pv/Power/Max', float(0), 0, float("inf")]}
+
+	def _callback(self, setting, oldvalue, newvalue):
+		self.events.append((setting, oldvalue, newvalue))
+
+	def test_bulk_registration(self):
+		bus = MockBus({'/Settings/SystemSetup/HasDcSystem': 1})
+		settings = BulkSettingsDevice(bus, self.supported, self._callback)
+
+		# One call to add them all, which replies with their values, no
+		# matter how many settings there are.
+		self.assertEqual(bus.calls, ['AddSettings'])
+		self.assertEqual(settings['hasdcsystem'], 1)
+		self.assertEqual(settings['batteryservice'], 'default')
+
+		settings['pvmax'] = 500
+		self.assertEqual(settings['pvmax'], 500)
+		self.assertEqual(bus.values['/Settings/Gui/Gauges/Pv/Power/Max'], 500)
+
+		bus.changed('/Settings/SystemSetup/HasDcSystem', 0)
+		self.assertEqual(settings['hasdcsystem'], 0)
+		self.assertEqual(self.events[-1], ('hasdcsystem', 1, 0))
+
+	def test_bulk_registration_no_values(self):
+		# Older versions of localsettings leave the values out of the reply
+		bus = MockBus({'/Settings/SystemSetup/HasDcSystem': 1}, reply_values=False)
+		settings = BulkSettingsDevice(bus, self.supported, self._callback)
+		self.assertEqual(bus.calls, ['AddSettings'] + ['GetValue'] * 3)
+		self.assertEqual(settings['hasdcsystem'], 1)
+		self.assertEqual(settings['batteryservice'], 'default')
+
+	def test_refused_setting(self):
+		bus = MockBus({}, refuse=('/Settings/SystemSetup/HasDcSystem',))
+		settings = BulkSettingsDevice(bus, self.supported, self._callback)
+		self.assertEqual(settings['hasdcsystem'], 0)
+		self.assertEqual(settings['batteryservice'], 'default')
+
+	def test_add_setting(self):
+		bus = MockBus({})
+		settings = BulkSettingsDevice(bus, self.supported, self._callback)
+		changes = []
+		del bus.calls[:]
+		item = settings.addSetting('/Settings/SystemSetup/Batteries/Configuration/x/Name',
+			'', 0, 0, callback=lambda service, path, c: changes.append(c['Value']))
+		self.assertEqual(bus.calls, ['AddSettings'])
+		self.assertEqual(item.get_value(), '')
+		self.assertEqual(changes, [])
+		bus.changed('/Settings/SystemSetup/Batteries/Configuration/x/Name', 'House')
+		self.assertEqual(item.get_value(), 'House')
+		self.assertEqual(changes, ['House'])
+
+	def test_add_setting_stored(self):
+		path = '/Settings/SystemSetup/Batteries/Configuration/x/Name'
+		bus = MockBus({path: 'House'})
+		settings = BulkSettingsDevice(bus, self.supported, self._callback)
+		changes = []
+		del bus.calls[:]
+		bus.held = []
+
+		# The default until localsettings replies, then the stored value,
+		# which is passed on like any other change.
+		item = settings.addSetting(path, '', 0, 0,
+			callback=lambda service, path, c: changes.append(c['Value']))
+		self.assertEqual(item.get_value(), '')
+		bus.release()
+		self.assertEqual(item.get_value(), 'House')
+		self.assertEqual(changes, ['House'])
+		self.assertEqual(bus.calls, ['AddSettings'])
+
+	def test_add_settings_async(self):
+		base = '/Settings/SystemSetup/Batteries/Configuration/x'
+		bus = MockBus({base + '/Enabled': 1}, refuse=(base + '/Name',),
+			reply_values=False)
+		settings = BulkSettingsDevice(bus, self.supported, self._callback)
+		replies = []
+		del bus.calls[:]
+		bus.held = []
+		items = settings.addSettingsAsync([
+			(base + '/Name', '', 0, 0, False, None),
+			(base + '/Enabled', 0, 0, 1, False, None)], replies.append)
+		self.assertEqual([i.get_value() for i in items], ['', 0])
+
+		# Without the values in the reply, they are read one by one
+		bus.release()
+		self.assertEqual(replies, [])
+		self.assertEqual(bus.calls, ['AddSettings', 'GetValue'])
+		bus.release()
+		self.assertEqual(replies, [items])
+		self.assertEqual([i.get_value() for i in items], ['', 1])
+
+	def test_battery_configuration(self):
+		path = '/Settings/SystemSetup/Batteries/Configuration/com_victronenergy_battery/1'
+		bus = MockBus({path + '/Service': 'old', path + '/Enabled': 1})
+		settings = BulkSettingsDevice(bus, self.supported, self._callback)
+		writes = []
+		writer = SimpleNamespace(set_value_async=lambda service, path, value:
+			writes.append((path, value)))
+		parent = SimpleNamespace(_settings=settings, changed=False,
+			systemcalc=SimpleNamespace(writer=writer))
+		del bus.calls[:]
+		bus.held = []
+
+		# All three settings with one call, nothing known until the reply
+		config = BatteryConfiguration(parent, 'com.victronenergy.battery/1')
+		self.assertEqual(bus.calls, ['AddSettings'])
+		self.assertFalse(config.enabled)
+
+		bus.release()
+		self.assertTrue(config.enabled)
+		self.assertEqual(config.name, '')
+		self.assertTrue(parent.changed)
+		self.assertEqual(writes, [(path + '/Service', 'com.victronenergy.battery/1')])
+
+	def test_unsupported(self):
+		bus = MockBus({}, bulk=False)
+		with self.assertRaises(BulkSettingsUnsupported):
+			BulkSettingsDevice(bus, self.supported, self._callback)
+		self.assertEqual(bus.receivers, [])
+
+	def test_default_settings(self):
+		settings = DefaultSettings(self.supported, self._callback)
+		self.assertEqual(settings['batteryservice'], 'default')
+		settings['pvmax'] = 500
+		self.assertEqual(settings['pvmax'], 500)
+
+		replies = []
+		items = add_settings_async(settings,
+			[('/Settings/x/Name', 'House', 0, 0, False, None)], replies.append)
+		self.assertEqual(replies, [items])
+		self.assertEqual(items[0].get_value(), 'House')
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+import marshal
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# This adapts sys.path to include all relevant packages
+import context
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(1, os.path.join(ROOT, 'scripts'))
+import mkbundle
+
+class TestBundle(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.directory = tempfile.mkdtemp()
+		cls.bundle = os.path.join(cls.directory, 'dbus_systemcalc.py')
+		# The Makefile takes the source directory from PWD
+		subprocess.run(['make', '-s', 'BUNDLE=' + cls.bundle, cls.bundle],
+			cwd=ROOT, env=dict(os.environ, PWD=ROOT), check=True,
+			stdout=subprocess.DEVNULL)
+
+	@classmethod
+	def tearDownClass(cls):
+		shutil.rmtree(cls.directory)
+
+	def _run(self, *args):
+		return subprocess.run([sys.executable, self.bundle] + list(args),
+			cwd=self.directory, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+			universal_newlines=True, timeout=60)
+
+	def test_imports(self):
+		# All imports are done before the arguments are parsed
+		result = self._run('--help')
+		self.assertEqual(result.returncode, 0, result.stdout)
+		self.assertIn('--benchmark-startup', result.stdout)
+
+	def test_asserts_kept(self):
+		code = marshal.loads(mkbundle.pyc(b'assert False', 'x.py', mkbundle.OPTIMIZE)[16:])
+		with self.assertRaises(AssertionError):
+			exec(code, {})
+
+	@unittest.skipUnless('DBUS_SESSION_BUS_ADDRESS' in os.environ, 'needs a session bus')
+	def test_benchmark_startup(self):
+		result = self._run('--benchmark-startup')
+		self.assertEqual(result.returncode, 0, result.stdout)
+		self.assertIn('Startup stages', result.stdout)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+import unittest
+
+# This adapts sys.path to include all relevant packages
+import context
+
+# our own packages
+from base import TestSystemCalcBase
+import flightrecorder
+from flightrecorder import FlightRecorder
+
+# Monkey patching for unit tests
+import patches
+
+class TestFlightRecorder(TestSystemCalcBase):
+	def __init__(self, methodName='runTest'):
+		TestSystemCalcBase.__init__(self, methodName)
+
+	def test_ring(self):
+		recorder = FlightRecorder(size=2, clock=lambda: 0)
+		recorder.record('added', 'com.victronenergy.battery.ttyO2', 2, {'/Soc': 50})
+		recorder.tick()
+		recorder.record('value', 'com.victronenergy.battery.ttyO2', '/Soc', 51)
+		recorder.record('setting', '/Settings/SystemSetup/BatteryService', 'nobattery')
+		self.assertEqual(recorder.services, {})
+
+		# The oldest tick drops out, and moves the state forward
+		recorder.tick()
+		self.assertEqual(recorder.services, {
+			'com.victronenergy.battery.ttyO2': [2, {'/Soc': 50}]})
+		recorder.tick()
+		self.assertEqual(recorder.services, {
+			'com.victronenergy.battery.ttyO2': [2, {'/Soc': 51}]})
+		self.assertEqual(recorder.settings, {
+			'/Settings/SystemSetup/BatteryService': 'nobattery'})
+		self.assertEqual(len(recorder.ticks), 2)
+
+	def test_coalesce(self):
+		recorder = FlightRecorder(size=2, clock=lambda: 0)
+		service = 'com.victronenergy.battery.ttyO2'
+		for soc in range(1000):
+			recorder.record('value', service, '/Soc', soc)
+			recorder.record('output', '/Dc/Battery/Soc', soc)
+		recorder.record('value', service, '/Dc/0/Voltage', 12.5)
+		self.assertEqual(recorder.ticks[-1][1], [
+			('value', service, '/Soc', 999),
+			('output', '/Dc/Battery/Soc', 999),
+			('value', service, '/Dc/0/Voltage', 12.5)])
+
+		# Not across a service coming and going
+		recorder.tick()
+		recorder.record('value', service, '/Soc', 50)
+		recorder.record('removed', service)
+		recorder.record('added', service, 2, {'/Soc': 51})
+		recorder.record('value', service, '/Soc', 52)
+		self.assertEqual(len(recorder.ticks[-1][1]), 4)
+
+	def test_systemcalc_recording(self):
+		self._add_device('com.victronenergy.battery.ttyO2', product_name='battery',
+			values={
+				'/Dc/0/Voltage': 12.3,
+				'/Dc/0/Current': 5.3,
+				'/Dc/0/Power': 65,
+				'/Soc': 15.3,
+				'/DeviceInstance': 2})
+		self._update_values()
+		self._monitor.set_value('com.victronenergy.battery.ttyO2', '/Soc', 16)
+		self._set_setting('/Settings/SystemSetup/HasDcSystem', 1)
+
+		recorder = self._system_calc.recorder
+		events = [e for _, events in recorder.ticks for e in events]
+		self.assertIn(('value', 'com.victronenergy.battery.ttyO2', '/Soc', 16), events)
+		self.assertIn(('setting', '/Settings/SystemSetup/HasDcSystem', 1), events)
+		self.assertIn(('output', '/Dc/Battery/Soc', 15.3), events)
+		added = [e for e in events if e[0] == 'added']
+		self.assertEqual(added[0][1:3], ('com.victronenergy.battery.ttyO2', 2))
+		self.assertEqual(added[0][3]['/Soc'], 15.3)
+		self.assertEqual(recorder.settings['/Settings/SystemSetup/BatteryService'], 'default')
+
+		directory = tempfile.mkdtemp()
+		try:
+			filename = os.path.join(directory, 'recording.json.gz')
+			self._system_calc.dump_flight_recorder(filename)
+			dump = flightrecorder.load(filename)
+		finally:
+			shutil.rmtree(directory)
+		self.assertEqual(len(dump['ticks']), len(recorder.ticks))
+		self.assertIn(['value', 'com.victronenergy.battery.ttyO2', '/Soc', 16],
+			dump['ticks'][-1]['events'])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -86,6 +86,25 @@ class TestHubSystem(TestSystemCalcBase):
 			'/Control/SolarChargeVoltage': 1,
 			'/Control/SolarChargerVoltageSense': 1})
 
+	def test_hub1_control_voltage_quarantined(self):
+		# Writes to a charger that stopped replying are held back, so
+		# they are not reported as written.
+		self._system_calc.writer.quarantined = lambda service: True
+		self._update_values()
+		self._monitor.add_value('com.victronenergy.vebus.ttyO1', '/Hub/ChargeVoltage', 12.6)
+		self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/State', 2)
+		self._add_device('com.victronenergy.solarcharger.ttyO1', {
+			'/State': 0,
+			'/Link/NetworkMode': 0,
+			'/Link/ChargeVoltage': None,
+			'/Link/VoltageSense': None,
+			'/Dc/0/Voltage': 12.4,
+			'/Dc/0/Current': 9.7,
+			'/FirmwareVersion': 0x129},
+			connection='VE.Direct')
+		self._update_values(3000)
+		self._check_values({'/Control/SolarChargeVoltage': 0})
+
 	def test_hub1_control_voltage_without_state(self):
 		self._update_values()
 		self._monitor.add_value('com.victronenergy.vebus.ttyO1', '/Hub/ChargeVoltage', 12.6)
@@ -1344,6 +1363,7 @@ class TestHubSystem(TestSystemCalcBase):
 				'/Info/MaxChargeVoltage': 53.2,
 				'/Info/MaxDischargeCurrent': 25,
 				'/ProductId': 0xB009})
+		self._update_values()
 		self._check_values({'/ActiveBatteryService': 'com.victronenergy.battery/1'})
 		self.assertEqual(len(BatteryService.instance.bmses), 2)
 
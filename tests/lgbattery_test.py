@@ -54,5 +54,7 @@ class LgCircuitBreakerDetectTest(TestSystemCalcBase):
 		self._monitor.set_value('com.victronenergy.battery.ttyO2', '/Dc/0/Voltage', 41.8)
 		self._update_values()
 		self._check_values({'/Dc/Battery/Alarms/CircuitBreakerTripped': 2})
+		self._check_external_values({
+			'com.victronenergy.vebus.ttyO1': {'/Mode': 4}})
 		self._remove_device('com.victronenergy.battery.ttyO2')
 		self._check_values({'/Dc/Battery/Alarms/CircuitBreakerTripped': None})
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+# This adapts sys.path to include all relevant packages
+import context
+
+# our own packages
+from base import TestSystemCalcBase
+
+# Monkey patching for unit tests
+import patches
+
+class TestProfiler(TestSystemCalcBase):
+	def __init__(self, methodName='runTest'):
+		TestSystemCalcBase.__init__(self, methodName)
+
+	def setUp(self):
+		TestSystemCalcBase.setUp(self)
+		self._directory = tempfile.mkdtemp()
+		self._system_calc.profiler.directory = os.path.join(self._directory, 'profiles')
+
+	def tearDown(self):
+		self._system_calc.profiler.stop()
+		shutil.rmtree(self._directory)
+
+	def test_profile_run(self):
+		self._service.set_value('/Debug/Profile/Run', 2)
+		self.assertTrue(self._system_calc.profiler.running)
+		self._update_values()
+		self.assertTrue(self._system_calc.profiler.running)
+		self._check_values({'/Debug/Profile/Output': None})
+
+		self._update_values()
+		self.assertFalse(self._system_calc.profiler.running)
+		self._check_values({'/Debug/Profile/Run': 0})
+		output = self._service['/Debug/Profile/Output']
+		self.assertTrue(output.startswith(self._system_calc.profiler.directory))
+		self.assertTrue(pstats.Stats(output).total_calls > 0)
+
+	def test_profile_stop_early(self):
+		self._service.set_value('/Debug/Profile/Run', 60)
+		self._update_values()
+		self._service.set_value('/Debug/Profile/Run', 0)
+		self.assertFalse(self._system_calc.profiler.running)
+		self.assertTrue(os.path.exists(self._service['/Debug/Profile/Output']))
+
+	def test_invalid_value(self):
+		self._service.set_value('/Debug/Profile/Run', -1)
+		self.assertFalse(self._system_calc.profiler.running)
+		self._check_values({'/Debug/Profile/Run': 0})
+
+if __name__ == '__main__':
+	unittest.main()
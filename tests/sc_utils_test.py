@@ -44,3 +44,243 @@ class TestScUtils(unittest.TestCase):
 		self.assertEqual(54,
 			self._monitor.get_value('com.victronenergy.vebus.ttyO1',
 			'/BatteryOperationalLimits/MaxChargeVoltage'))
+
+	def test_change_log(self):
+		from sc_utils import ChangeLog
+		log = ChangeLog(3, 100)
+		self.assertEqual(log.changes_since(100), [])
+		log.add('/A')
+		log.add('/B')
+		log.add('/A')
+		self.assertEqual(log.seq, 103)
+		self.assertEqual(log.changes_since(100), ['/A', '/B'])
+		self.assertEqual(log.changes_since(102), ['/A'])
+		self.assertEqual(log.changes_since(103), [])
+
+		# Sequence numbers from before the log started, or from the future,
+		# require a resync.
+		self.assertIsNone(log.changes_since(99))
+		self.assertIsNone(log.changes_since(104))
+
+		# Log wraps, /B is dropped
+		log.add('/C')
+		log.add('/D')
+		self.assertIsNone(log.changes_since(101))
+		self.assertEqual(log.changes_since(102), ['/D', '/C', '/A'])
+
+	def test_observed_service(self):
+		from sc_utils import ObservedService
+		from mock_dbus_service import MockDbusService
+		changes = []
+		service = ObservedService(MockDbusService('com.victronenergy.system'),
+			lambda path, value: changes.append((path, value)))
+
+		service.add_path('/A', 1)
+		service['/A'] = 1 # Not a change
+		service['/A'] = 2
+		with service as s:
+			s['/A'] = 3
+		del service['/A']
+		self.assertEqual(changes, [('/A', 1), ('/A', 2), ('/A', 3), ('/A', None)])
+		self.assertNotIn('/A', service)
+
+	def test_service_id(self):
+		from sc_utils import ServiceId
+
+		sid = ServiceId.parse('com.victronenergy.grid.cgwacs_ttyUSB0_di30_mb1', 30)
+		self.assertEqual(sid, ('grid', 'cgwacs_ttyUSB0_di30_mb1', 30))
+		self.assertEqual(sid.service_class, 'grid')
+		self.assertEqual(ServiceId.parse('com.victronenergy.settings'),
+			('settings', '', None))
+		self.assertEqual(ServiceId.parse('org.freedesktop.DBus').service_class, None)
+
+	def test_service_aggregate(self):
+		from sc_utils import ServiceAggregate
+		measured = []
+		def measure(monitor, service):
+			measured.append(service)
+			v = monitor.get_value(service, '/Info/MaxChargeVoltage')
+			return None if v is None else ({'v': v}, service)
+		def finish(sums, first, last):
+			return sums.get('v'), first, last
+
+		aggregate = ServiceAggregate(self._monitor, ['/Info/MaxChargeVoltage'],
+			measure, finish)
+		self.assertEqual(aggregate.totals, (None, None, None))
+		aggregate.add('com.victronenergy.battery.ttyO2')
+		self.assertEqual(aggregate.totals[0], 55)
+		self.assertTrue('com.victronenergy.battery.ttyO2' in aggregate)
+
+		# Only the paths we depend on cause a new measurement
+		self._monitor.set_value('com.victronenergy.battery.ttyO2', '/Info/MaxChargeVoltage', 56)
+		aggregate.update('com.victronenergy.battery.ttyO2', '/Soc')
+		self.assertEqual(aggregate.totals[0], 55)
+		aggregate.update('com.victronenergy.battery.ttyO2', '/Info/MaxChargeVoltage')
+		self.assertEqual(aggregate.totals[0], 56)
+		self.assertEqual(len(measured), 2)
+
+		aggregate.remove('com.victronenergy.battery.ttyO2')
+		self.assertEqual(len(aggregate), 0)
+		self.assertEqual(aggregate.totals, (None, None, None))
+
+	def test_service_aggregate_running_sums(self):
+		from sc_utils import ServiceAggregate
+		values = {}
+		def measure(monitor, service):
+			v = values[service]
+			return None if v is None else ({'v': v}, service)
+		def finish(sums, first, last):
+			return sums.get('v'), first, last
+
+		aggregate = ServiceAggregate(None, ['/P'], measure, finish)
+		calls = []
+		recompute = aggregate._recompute
+		aggregate._recompute = lambda: calls.append(1) or recompute()
+		for i in range(3):
+			values['s%d' % i] = 0.1 * (i + 1)
+			aggregate.add('s%d' % i)
+		self.assertAlmostEqual(aggregate.totals[0], 0.6)
+		self.assertEqual(aggregate.totals[1:], ('s0', 's2'))
+
+		# Changes are added as a difference, without adding up again
+		for n in range(100):
+			values['s1'] = n / 10
+			aggregate.update('s1', '/P')
+		self.assertAlmostEqual(aggregate.totals[0], 0.4 + 9.9)
+		self.assertEqual(calls, [])
+
+		# Invalid data makes it add up anew, and leaves the service out
+		values['s0'] = None
+		aggregate.update('s0', '/P')
+		self.assertEqual(len(calls), 1)
+		self.assertAlmostEqual(aggregate.totals[0], 0.3 + 9.9)
+		self.assertEqual(aggregate.totals[1:], ('s1', 's2'))
+
+		# And so does every RECOMPUTE_AFTER changes
+		for n in range(ServiceAggregate.RECOMPUTE_AFTER):
+			values['s1'] = n
+			aggregate.update('s1', '/P')
+		self.assertEqual(len(calls), 2)
+
+	def test_expiring_cache(self):
+		from sc_utils import ExpiringCache
+		now = [0]
+		cache = ExpiringCache(2, 30, clock=lambda: now[0])
+		cache.put('a', 1)
+		cache.put('b', 2)
+		cache.put('c', 3)
+		self.assertEqual(len(cache), 2)
+		self.assertFalse('a' in cache)
+
+		# Storing again makes it the newest entry
+		cache.put('b', 4)
+		cache.put('d', 5)
+		self.assertEqual(cache.pop('c'), None)
+		self.assertEqual(cache.pop('b'), 4)
+		self.assertEqual(len(cache), 1)
+
+		# Age is in seconds, no matter how often expire() is called
+		now[0] = 29
+		cache.expire()
+		cache.expire()
+		self.assertTrue('d' in cache)
+		now[0] = 30
+		cache.expire()
+		self.assertEqual(len(cache), 0)
+
+	def test_loop_monitor(self):
+		from sc_utils import LoopMonitor
+		now = [0]
+		monitor = LoopMonitor(threshold=0.1, clock=lambda: now[0])
+
+		def slow():
+			now[0] += 0.5
+			return True
+		def fast():
+			return True
+		run_slow = monitor.wrap(1000, slow)
+		run_fast = monitor.wrap(1000, fast)
+		slow_name = 'TestScUtils.test_loop_monitor.<locals>.slow'
+		fast_name = 'TestScUtils.test_loop_monitor.<locals>.fast'
+
+		# The slow callback holds up the fast one
+		now[0] = 1
+		run_slow()
+		run_fast()
+		now[0] = 2.5
+		run_fast()
+		stats = monitor.stats()
+		self.assertEqual(stats['culprits'], {slow_name: 1})
+		self.assertEqual(stats['timers'][fast_name], {'runs': 2, 'maxlag': 500, 'maxduration': 0})
+		self.assertEqual(stats['timers'][slow_name]['maxduration'], 500)
+		self.assertEqual(stats['histogram']['10'], 2)
+		self.assertEqual(stats['histogram']['500'], 1)
+
+		# Lag that isn't caused by a timer callback
+		now[0] = 4
+		run_fast()
+		self.assertEqual(monitor.stats()['culprits'], {slow_name: 1, 'other': 1})
+
+	def test_adaptive_timer(self):
+		from sc_utils import LoopMonitor
+		import mock_gobject
+		mock_gobject.timer_manager.reset()
+		monitor = LoopMonitor()
+		runs = []
+		def tick():
+			runs.append(1)
+			return True
+		monitor.timeout_add_adaptive(1000, tick)
+
+		mock_gobject.timer_manager.run(5500)
+		self.assertEqual(len(runs), 5)
+
+		# Stretched from the next run on
+		monitor.set_idle(True)
+		mock_gobject.timer_manager.run(5000)
+		self.assertEqual(len(runs), 6)
+
+		# Back to normal right away
+		monitor.set_idle(False)
+		mock_gobject.timer_manager.run(2500)
+		self.assertEqual(len(runs), 8)
+
+	def test_quiescence(self):
+		from sc_utils import Quiescence
+		q = Quiescence({'Power': 50, 'State': 0})
+		self.assertTrue(q.changed('s', '/Dc/0/Power', 100))
+		self.assertFalse(q.changed('s', '/Dc/0/Power', 140))
+		self.assertFalse(q.changed('s', '/Dc/0/Power', 60))
+		self.assertTrue(q.changed('s', '/Dc/0/Power', 160))
+		self.assertTrue(q.changed('s', '/Dc/0/Power', None))
+		self.assertFalse(q.changed('s', '/Dc/0/Power', None))
+		self.assertTrue(q.changed('s', '/State', 3))
+		self.assertTrue(q.changed('s', '/State', 4))
+		self.assertFalse(q.changed('s', '/Dc/0/Voltage', 12.5))
+
+	def test_tick_budget(self):
+		from sc_utils import TickBudget
+		now = [0]
+		budget = TickBudget(0.1, clock=lambda: now[0])
+		done = []
+
+		budget.begin()
+		budget.run('gauges', done.append, 1)
+		now[0] = 0.2
+		budget.run('gauges', done.append, 2)
+		budget.run('writes', done.append, 3)
+		budget.run('gauges', done.append, 4)
+		budget.end()
+		self.assertEqual(done, [1])
+		self.assertEqual(budget.deferrals, 3)
+		self.assertEqual(budget.pending, ['gauges', 'writes'])
+
+		# One piece per main loop iteration, only the latest of each
+		self.assertTrue(budget._run_pending())
+		self.assertEqual(done, [1, 4])
+		self.assertFalse(budget._run_pending())
+		self.assertEqual(done, [1, 4, 3])
+
+		# Outside a tick, nothing waits
+		budget.run('gauges', done.append, 5)
+		self.assertEqual(done, [1, 4, 3, 5])
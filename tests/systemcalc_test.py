@@ -1,16 +1,154 @@
 #!/usr/bin/env python3
+import dbus
 import json
 import unittest
+from types import SimpleNamespace
 
 # This adapts sys.path to include all relevant packages
 import context
 
+# Testing tools
+import mock_gobject
+from mock_dbus_monitor import MockDbusMonitor
+
 # our own packages
-from base import TestSystemCalcBase
+from base import TestSystemCalcBase, MockSystemCalc
+import dbus_systemcalc
+from dbus_systemcalc import FEATURE_DETACH_TICKS
 
 # Monkey patching for unit tests
 import patches
 
+class TreeTrackingMonitor(MockDbusMonitor):
+	""" Keeps track of the tree as it is changed at runtime, and of the
+	    services present at the time. """
+	def __init__(self, tree, *args, **kwargs):
+		MockDbusMonitor.__init__(self, tree, *args, **kwargs)
+		self.tree = {service: set(paths) for service, paths in tree.items()}
+		self.changes = []
+
+	def add_paths(self, tree):
+		for service, paths in tree.items():
+			self.tree.setdefault(service, set()).update(paths)
+			self.changes.append(('add', service, sorted(self.get_service_list(service))))
+
+	def remove_paths(self, tree):
+		for service, paths in tree.items():
+			self.tree[service].difference_update(paths)
+			self.changes.append(('remove', service, sorted(self.get_service_list(service))))
+
+class GatedSystemCalc(MockSystemCalc):
+	gate_features = True
+
+	def _create_dbus_monitor(self, *args, **kwargs):
+		return TreeTrackingMonitor(*args, **kwargs)
+
+class FakeConnection(object):
+	def __init__(self):
+		self.calls = []
+
+	def call_async(self, service, path, interface, method, signature, args,
+			reply_handler, error_handler):
+		self.calls.append((service, method, reply_handler))
+
+class FakeService(object):
+	def __init__(self, name, instance):
+		self.name = name
+		self.deviceInstance = instance
+		self.paths = {}
+
+class FakeItem(object):
+	def __init__(self, value, text):
+		self.value = value
+		self.text = text
+
+	def GetValue(self):
+		return self.value
+
+	def GetText(self):
+		return self.text
+
+class TestChangeLogExport(unittest.TestCase):
+	def test_changes_since(self):
+		log = dbus_systemcalc.ChangeLog(10, 100)
+		for path in ('/Dc/Battery/Voltage', '/Batteries', '/ServiceMapping/x'):
+			log.add(path)
+		objects = {
+			'/Dc/Battery/Voltage': FakeItem(12.5, '12.50V'),
+			'/Batteries': FakeItem('[]', 'two batteries')}
+		systemcalc = SimpleNamespace(_dbusservice=SimpleNamespace(_dbusobjects=objects),
+			get_changes_since=lambda seq: (log.seq, log.changes_since(seq)))
+		export = SimpleNamespace(_systemcalc=systemcalc)
+
+		# Texts come from the items, removed paths are listed apart
+		seq, resync, items, removed = dbus_systemcalc.ChangeLogExport.GetChangesSince(export, 100)
+		self.assertEqual((seq, resync), (103, False))
+		self.assertEqual(items['/Batteries'], {'Value': '[]', 'Text': 'two batteries'})
+		self.assertEqual(items['/Dc/Battery/Voltage']['Text'], '12.50V')
+		self.assertEqual(list(removed), ['/ServiceMapping/x'])
+
+		seq, resync, items, removed = dbus_systemcalc.ChangeLogExport.GetChangesSince(export, 0)
+		self.assertTrue(resync)
+
+class TestGatedDbusMonitor(unittest.TestCase):
+	acsystem = 'com.victronenergy.acsystem.socketcan_can0_sys0'
+	options = {'code': None, 'whenToLog': 'configChange', 'accessLevel': None}
+
+	def setUp(self):
+		# Only what add_paths and remove_paths use of a DbusMonitor
+		self.changes = []
+		self.service = FakeService(self.acsystem, 0)
+		self.monitor = dbus_systemcalc.GatedDbusMonitor.__new__(dbus_systemcalc.GatedDbusMonitor)
+		self.monitor.dbusTree = {'com.victronenergy.acsystem': {}}
+		self.monitor.servicesByName = {self.acsystem: self.service}
+		self.monitor.dbusConn = FakeConnection()
+		self.monitor.valueChangedCallback = lambda service, path, *args: \
+			self.changes.append((service, path))
+
+	def _items(self, **values):
+		return {'/Ess/' + k: {'Value': dbus.Int32(v), 'Text': str(v)} for k, v in values.items()}
+
+	def test_attach(self):
+		self.monitor.add_paths({'com.victronenergy.acsystem': {
+			'/Ess/AcPowerSetpoint': self.options,
+			'/Ess/DisableFeedIn': self.options}})
+
+		# One call per service, nothing blocks. The paths are there, but
+		# invalid until the reply is in.
+		calls = self.monitor.dbusConn.calls
+		self.assertEqual([c[:2] for c in calls], [(self.acsystem, 'GetItems')])
+		self.assertIsNone(self.service.paths['/Ess/AcPowerSetpoint'].value)
+		self.assertIn('/Ess/DisableFeedIn', self.monitor.dbusTree['com.victronenergy.acsystem'])
+
+		calls[0][2](self._items(AcPowerSetpoint=100, DisableFeedIn=0, UseInverterPowerSetpoint=1))
+		self.assertEqual(self.service.paths['/Ess/AcPowerSetpoint'].value, 100)
+		self.assertEqual(self.service.paths['/Ess/DisableFeedIn'].value, 0)
+		self.assertNotIn('/Ess/UseInverterPowerSetpoint', self.service.paths)
+		self.assertEqual(sorted(self.changes), [
+			(self.acsystem, '/Ess/AcPowerSetpoint'),
+			(self.acsystem, '/Ess/DisableFeedIn')])
+
+	def test_detach(self):
+		self.monitor.add_paths({'com.victronenergy.acsystem': {
+			'/Ess/AcPowerSetpoint': self.options}})
+		reply = self.monitor.dbusConn.calls[0][2]
+		self.monitor.remove_paths({'com.victronenergy.acsystem': {
+			'/Ess/AcPowerSetpoint': self.options}})
+		self.assertNotIn('/Ess/AcPowerSetpoint', self.service.paths)
+		self.assertNotIn('/Ess/AcPowerSetpoint', self.monitor.dbusTree['com.victronenergy.acsystem'])
+
+		# A reply that comes in late does not bring it back
+		reply(self._items(AcPowerSetpoint=100))
+		self.assertNotIn('/Ess/AcPowerSetpoint', self.service.paths)
+		self.assertEqual(self.changes, [])
+
+	def test_service_gone(self):
+		self.monitor.add_paths({'com.victronenergy.acsystem': {
+			'/Ess/AcPowerSetpoint': self.options}})
+		del self.monitor.servicesByName[self.acsystem]
+		self.monitor.dbusConn.calls[0][2](self._items(AcPowerSetpoint=100))
+		self.assertEqual(self.changes, [])
+
 class TestSystemCalc(TestSystemCalcBase):
 	def __init__(self, methodName='runTest'):
 		TestSystemCalcBase.__init__(self, methodName)
@@ -819,6 +957,63 @@ class TestSystemCalc(TestSystemCalcBase):
 		self._update_values()
 		self._check_values({'/ActiveBatteryService': 'com.victronenergy.battery/512'})
 
+	def test_battery_selection_cached(self):
+		self._add_device('com.victronenergy.battery.ttyO2',
+			product_name='battery',
+			values={
+				'/Dc/0/Voltage': 12.3,
+				'/Dc/0/Current': 5.3,
+				'/Dc/0/Power': 65,
+				'/Soc': 15.3,
+				'/DeviceInstance': 2})
+		self._update_values()
+		self._check_values({'/ActiveBatteryService': 'com.victronenergy.battery/2'})
+
+		calls = []
+		select = self._system_calc._compute_autoselect_battery_service
+		def _select():
+			calls.append(None)
+			return select()
+		self._system_calc._compute_autoselect_battery_service = _select
+
+		# Unrelated settings and values do not cause a new selection
+		version = self._system_calc._topology_version
+		self._set_setting('/Settings/SystemSetup/HasAcOutSystem', 0)
+		self._monitor.set_value('com.victronenergy.battery.ttyO2', '/Soc', 16)
+		self._update_values()
+		self.assertEqual(version, self._system_calc._topology_version)
+		self.assertEqual(calls, [])
+
+		# A change in validity does
+		self._monitor.set_value('com.victronenergy.battery.ttyO2', '/Soc', None)
+		self.assertNotEqual(version, self._system_calc._topology_version)
+		self._set_setting('/Settings/SystemSetup/HasDcSystem', 1)
+		self.assertEqual(len(calls), 1)
+
+		# Readable names follow the product name
+		self._monitor.set_value('com.victronenergy.battery.ttyO2', '/ProductName', 'renamed')
+		self.assertEqual(self._service['/AutoSelectedBatteryService'], 'renamed on dummy')
+		self.assertEqual(len(calls), 2)
+
+	def test_available_battery_services_not_rebuilt(self):
+		self._update_values()
+		calls = []
+		update = self._system_calc._update_available_battery_services
+		def _update():
+			calls.append(None)
+			update()
+		self._system_calc._update_available_battery_services = _update
+
+		# VE.Bus state changes do not change the list
+		for state in (4, 5, 3):
+			self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/State', state)
+		self.assertEqual(calls, [])
+
+		self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/ProductName', 'Quattro')
+		self.assertEqual(len(calls), 1)
+		self.assertEqual(json.loads(self._service['/AvailableBatteryServices'])['com.victronenergy.vebus/0'],
+			'Quattro on dummy')
+
 	def test_battery_selection_wrong_format(self):
 		self._set_setting('/Settings/SystemSetup/BatteryService', 'wrong format')
 		self._update_values()
@@ -1295,6 +1490,34 @@ class TestSystemCalc(TestSystemCalcBase):
 		self._update_values()
 		self.assertEqual([0xB0FE], self._service['/PvInvertersProductIds'])
 
+	def test_pv_inverter_position_changes(self):
+		self._add_device('com.victronenergy.pvinverter.fronius_122_2312', {
+			'/Ac/L1/Power': 500,
+			'/Ac/L1/Current': 2.2,
+			'/Position': 0,
+			'/ProductId': 0xB0FE
+		})
+		self._update_values()
+		self._check_values({
+			'/Ac/PvOnGrid/L1/Power': 500,
+			'/Ac/PvOnGenset/L1/Power': None,
+			'/Ac/PvOnOutput/L1/Power': None})
+
+		self._monitor.set_value('com.victronenergy.pvinverter.fronius_122_2312', '/Position', 1)
+		self._update_values()
+		self._check_values({
+			'/Ac/PvOnGrid/L1/Power': None,
+			'/Ac/PvOnOutput/L1/Power': 500,
+			'/Ac/PvOnOutput/L1/Current': 2.2})
+
+		self._monitor.set_value('com.victronenergy.pvinverter.fronius_122_2312', '/Position', 0)
+		self._monitor.set_value('com.victronenergy.settings', '/Settings/SystemSetup/AcInput1', 2)
+		self._update_values()
+		self._check_values({
+			'/Ac/PvOnGrid/L1/Power': None,
+			'/Ac/PvOnGenset/L1/Power': 500,
+			'/Ac/PvOnOutput/L1/Power': None})
+
 	def test_dcsystem_service(self):
 		self._set_setting('/Settings/SystemSetup/HasDcSystem', 1)
 		self._add_device('com.victronenergy.battery.ttyO2',
@@ -1563,5 +1786,210 @@ class TestSystemCalc(TestSystemCalcBase):
 			'/Ac/ConsumptionOnInput/L1/Current': None
 		})
 
+	def test_changes_since(self):
+		self._update_values()
+		seq, changes = self._system_calc.get_changes_since(0)
+		self.assertIsNone(changes) # Predates the log, must resync
+
+		self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/Ac/ActiveIn/L1/P', 200)
+		self._update_values()
+		newseq, changes = self._system_calc.get_changes_since(seq)
+		self.assertTrue(newseq > seq)
+		self.assertIn('/Ac/Grid/L1/Power', changes)
+		self.assertNotIn('/Dc/Battery/Voltage', changes)
+		self.assertEqual(self._system_calc.get_changes_since(newseq), (newseq, []))
+
+		self._add_device('com.victronenergy.battery.ttyO2',
+			product_name='battery', values={'/DeviceInstance': 3})
+		_, changes = self._system_calc.get_changes_since(newseq)
+		self.assertIn('/ServiceMapping/com_victronenergy_battery_3', changes)
+
+		# Paths that delegates set themselves are logged too
+		seq, _ = self._system_calc.get_changes_since(0)
+		self._system_calc._dbusservice['/Control/SolarChargeCurrent'] = 1
+		_, changes = self._system_calc.get_changes_since(seq)
+		self.assertEqual(changes, ['/Control/SolarChargeCurrent'])
+
+	def test_device_changes_batched(self):
+		from delegates import PvInverters
+		self._update_values()
+		calls = []
+		handleservicechange = self._system_calc._handleservicechange
+		def _handleservicechange():
+			calls.append(None)
+			handleservicechange()
+		self._system_calc._handleservicechange = _handleservicechange
+
+		for i in range(5):
+			self._add_device('com.victronenergy.pvinverter.fronius_122_23{}'.format(i), {
+				'/Ac/L1/Power': 500,
+				'/Position': 0,
+				'/ProductId': 0xB0F0 + i,
+				'/DeviceInstance': 20 + i})
+		self._add_device('com.victronenergy.battery.ttyO2',
+			product_name='battery', values={'/DeviceInstance': 3})
+		self._remove_device('com.victronenergy.pvinverter.fronius_122_234')
+
+		# Per-device callbacks are immediate, the service change is not
+		self.assertEqual(len(PvInverters.instance.pvinverters), 4)
+		self.assertEqual(calls, [])
+		self.assertNotIn('battery/3', self._service['/AvailableBatteryServices'])
+
+		self._update_values()
+		self.assertEqual(len(calls), 1)
+		self.assertIn('battery/3', self._service['/AvailableBatteryServices'])
+		self.assertEqual(sorted(self._service['/PvInvertersProductIds']),
+			[0xB0F0, 0xB0F1, 0xB0F2, 0xB0F3])
+
+	def test_gettext(self):
+		gettext = self._system_calc._gettext
+		self.assertEqual(gettext('/Dc/Battery/Voltage', 12.25), '12.25 V')
+		self.assertEqual(gettext('/Dc/Battery/State', 1), 'Charging')
+		self.assertEqual(gettext('/AutoSelectedBatteryService', 'battery on dummy'), 'battery on dummy')
+
+		# Texts of unchanged values are remembered
+		calls = []
+		self._system_calc._formatters['/Dc/Battery/Voltage'] = lambda v: calls.append(v) or str(v)
+		self.assertEqual(gettext('/Dc/Battery/Voltage', 12.25), '12.25 V')
+		self.assertEqual(calls, [])
+		self.assertEqual(gettext('/Dc/Battery/Voltage', 12.5), '12.5')
+		self.assertEqual(calls, [12.5])
+
+		# Same value, different type
+		self.assertEqual(gettext('/Dc/Battery/State', True), 'Charging')
+		self.assertEqual(gettext('/Ac/ActiveIn/Source', 1), '1')
+		self.assertEqual(gettext('/Ac/ActiveIn/Source', True), 'True')
+
+	def test_ac_contributions(self):
+		inverters = ['com.victronenergy.multi.ttyS1', 'com.victronenergy.multi.ttyS2']
+		inputs, outputs = self._system_calc._get_ac_contributions(inverters, 1)
+		self.assertEqual(inputs['L2'], [
+			('com.victronenergy.multi.ttyS1', '/Ac/In/2/L2/P', '/Ac/In/2/L2/I'),
+			('com.victronenergy.multi.ttyS2', '/Ac/In/2/L2/P', '/Ac/In/2/L2/I')])
+		self.assertEqual(outputs['L3'][1], ('com.victronenergy.multi.ttyS2',
+			'/Ac/Out/L3/P', '/Ac/Out/L3/I', '/Ac/Out/L3/S', '/Ac/Out/L3/V'))
+
+		# Cached while the topology stays the same
+		self.assertIs(self._system_calc._get_ac_contributions(list(inverters), 1)[0], inputs)
+
+		# No active input, no input contributions
+		inputs, outputs = self._system_calc._get_ac_contributions(inverters, 0xF0)
+		self.assertEqual(inputs['L1'], [])
+		self.assertEqual(len(outputs['L1']), 2)
+
+	def test_device_routing(self):
+		from delegates import BatteryService, Gps, PvInverters, ServiceMapper
+		routes = self._system_calc._device_routes
+		self.assertIn(BatteryService.instance, routes['battery'])
+		self.assertIn(ServiceMapper.instance, routes['battery'])
+		self.assertNotIn(Gps.instance, routes['battery'])
+		self.assertEqual(routes[None], [ServiceMapper.instance])
+
+		self._add_device('com.victronenergy.pvinverter.fronius_122_2312', {
+			'/Ac/L1/Power': 500,
+			'/Position': 0,
+			'/ProductId': 0xB0FE,
+			'/DeviceInstance': 20})
+		self._add_device('com.victronenergy.gps.ttyUSB0', {
+			'/Fix': 0,
+			'/DeviceInstance': 21})
+		self.assertEqual(PvInverters.instance.pvinverters,
+			set(['com.victronenergy.pvinverter.fronius_122_2312']))
+		self.assertEqual(Gps.instance.gpses, set([(21, 'com.victronenergy.gps.ttyUSB0')]))
+		self.assertEqual(self._system_calc._get_service_id(
+			'com.victronenergy.gps.ttyUSB0').instance, 21)
+
+		self._remove_device('com.victronenergy.gps.ttyUSB0')
+		self.assertEqual(Gps.instance.gpses, set())
+		self.assertIsNone(self._system_calc._get_service_id(
+			'com.victronenergy.gps.ttyUSB0').instance)
+
+	def test_staged_startup(self):
+		system_calc = MockSystemCalc()
+		monitor = system_calc._dbusmonitor
+		service = system_calc._dbusservice
+		for stage in ('Monitor', 'Settings', 'Service', 'Registered'):
+			self.assertIsNotNone(service['/Debug/Startup/' + stage])
+		self.assertIsNone(service['/Debug/Startup/FirstPublish'])
+
+		# Services that show up before the devices stage are only added once
+		monitor.add_service('com.victronenergy.battery.ttyO2', {
+			'/Connected': 1, '/ProductName': 'battery', '/Mgmt/Connection': 'dummy',
+			'/Dc/0/Voltage': 12.3, '/Dc/0/Current': 5.3, '/Dc/0/Power': 65,
+			'/Soc': 15.3, '/DeviceInstance': 2})
+		added = []
+		device_added = system_calc._device_added
+		def _device_added(service, *args, **kwargs):
+			added.append(service)
+			device_added(service, *args, **kwargs)
+		system_calc._device_added = _device_added
+
+		system_calc._finish_startup()
+		self.assertEqual(added, [])
+		for stage in ('Devices', 'FirstUpdate', 'FirstPublish'):
+			self.assertIsNotNone(service['/Debug/Startup/' + stage])
+		self.assertTrue(service['/Debug/Startup/FirstPublish'] >= service['/Debug/Startup/Registered'])
+		self.assertEqual(service['/Dc/Battery/Soc'], 15.3)
+
+	def test_feature_gated_input(self):
+		mock_gobject.timer_manager.reset()
+		system_calc = GatedSystemCalc()
+		monitor = system_calc._dbusmonitor
+		tree = monitor.tree
+		acsystem = 'com.victronenergy.acsystem.socketcan_can0_sys0'
+		monitor.add_service(acsystem, {
+			'/Connected': 1, '/ProductName': 'Multi RS', '/Mgmt/Connection': 'dummy',
+			'/DeviceInstance': 0, '/Capabilities/HasDynamicEssSupport': 1})
+		mock_gobject.timer_manager.run(1000)
+
+		# DESS is off, only what it needs to tell whether it is available
+		# is monitored.
+		self.assertIn('/Capabilities/HasDynamicEssSupport', tree['com.victronenergy.acsystem'])
+		self.assertNotIn('/Ess/AcPowerSetpoint', tree['com.victronenergy.acsystem'])
+		self.assertNotIn('/Settings/CGwacs/MaxFeedInPower', tree['com.victronenergy.settings'])
+		self.assertNotIn('/Ac/In/1/Type', tree.get('com.victronenergy.multi', ()))
+
+		del monitor.changes[:]
+		system_calc._settings['dess_mode'] = 1
+		self.assertIn('/Ess/AcPowerSetpoint', tree['com.victronenergy.acsystem'])
+		self.assertIn('/Settings/CGwacs/MaxFeedInPower', tree['com.victronenergy.settings'])
+		self.assertIn(('add', 'com.victronenergy.acsystem', [acsystem]), monitor.changes)
+
+		# Switched off, the paths stay for a while so DESS can wind down.
+		# Paths that other delegates use stay for good.
+		system_calc._settings['dess_mode'] = 0
+		mock_gobject.timer_manager.run(1000)
+		self.assertIn('/Ess/AcPowerSetpoint', tree['com.victronenergy.acsystem'])
+		del monitor.changes[:]
+		mock_gobject.timer_manager.run(FEATURE_DETACH_TICKS * 1000)
+		self.assertNotIn('/Ess/AcPowerSetpoint', tree['com.victronenergy.acsystem'])
+		self.assertIn(('remove', 'com.victronenergy.acsystem', [acsystem]), monitor.changes)
+		self.assertNotIn('/Settings/CGwacs/MaxFeedInPower', tree['com.victronenergy.settings'])
+		self.assertIn('/Overrides/ForceCharge', tree['com.victronenergy.hub4'])
+		self.assertIn('/Settings/CGwacs/Hub4Mode', tree['com.victronenergy.settings'])
+
+	def test_idle_mode(self):
+		from sc_utils import loop_monitor
+		mock_gobject.timer_manager.reset()
+		system_calc = MockSystemCalc(idle_after=5)
+		monitor = system_calc._dbusmonitor
+		monitor.add_service('com.victronenergy.battery.ttyO2', {
+			'/Connected': 1, '/ProductName': 'battery', '/Mgmt/Connection': 'dummy',
+			'/Dc/0/Voltage': 12.3, '/Dc/0/Current': 5.3, '/Dc/0/Power': 65,
+			'/Soc': 15.3, '/DeviceInstance': 2})
+		monitor.set_value('com.victronenergy.battery.ttyO2', '/Dc/0/Power', 70)
+		try:
+			mock_gobject.timer_manager.run(7000)
+			self.assertTrue(loop_monitor.idle)
+
+			# Noise does not wake it up, a real change does
+			monitor.set_value('com.victronenergy.battery.ttyO2', '/Dc/0/Voltage', 12.4)
+			monitor.set_value('com.victronenergy.battery.ttyO2', '/Dc/0/Power', 90)
+			self.assertTrue(loop_monitor.idle)
+			monitor.set_value('com.victronenergy.battery.ttyO2', '/Dc/0/Power', 500)
+			self.assertFalse(loop_monitor.idle)
+		finally:
+			loop_monitor.set_idle(False)
+
 if __name__ == '__main__':
 	unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+# This adapts sys.path to include all relevant packages
+import context
+
+# our own packages
+from base import TestSystemCalcBase, MockSystemCalc
+import mock_gobject
+import warmstart
+from warmstart import WarmStart
+
+# Monkey patching for unit tests
+import patches
+
+class TestWarmStart(TestSystemCalcBase):
+	def __init__(self, methodName='runTest'):
+		TestSystemCalcBase.__init__(self, methodName)
+
+	def setUp(self):
+		self._directory = tempfile.mkdtemp()
+		self._warmstart = WarmStart(os.path.join(self._directory, 'warmstart.json'))
+		self._restart()
+
+	def tearDown(self):
+		shutil.rmtree(self._directory)
+
+	def _restart(self):
+		mock_gobject.timer_manager.reset()
+		self._system_calc = MockSystemCalc(warmstart=self._warmstart)
+		self._monitor = self._system_calc._dbusmonitor
+		self._service = self._system_calc._dbusservice
+
+	def _add_battery(self, voltage, soc):
+		self._add_device('com.victronenergy.battery.ttyO2', product_name='battery',
+			values={
+				'/Dc/0/Voltage': voltage,
+				'/Dc/0/Current': 5.3,
+				'/Dc/0/Power': 65,
+				'/Soc': soc,
+				'/DeviceInstance': 2})
+
+	def test_warm_start(self):
+		self._add_battery(12.3, 15.3)
+		self._update_values()
+		self._service['/Timers/TimeOnInverter'] = 100
+		self._check_values({
+			'/Dc/Battery/Voltage': 12.3,
+			'/Dc/Battery/Soc': 15.3,
+			'/WarmStart/Stale': 0})
+
+		# A snapshot is taken every WARMSTART_INTERVAL ticks
+		for _ in range(warmstart.WARMSTART_INTERVAL):
+			self._update_values()
+		self.assertTrue(os.path.exists(self._warmstart.filename))
+
+		# After a restart, the restored values are published, for GUI and
+		# VRM, but read as invalid by the delegates until the battery is
+		# back.
+		self._restart()
+		self._check_values({
+			'/Dc/Battery/Voltage': None,
+			'/Dc/Battery/Soc': None})
+		self.assertEqual(self._service.published('/Dc/Battery/Voltage'), 12.3)
+		self.assertEqual(self._service.published('/Dc/Battery/Soc'), 15.3)
+		self.assertEqual(self._service.published('/Batteries')[0]['voltage'], 12.3)
+		stale = json.loads(self._service['/WarmStart/Paths'])
+		self.assertIn('/Dc/Battery/Voltage', stale)
+		self.assertIn('/Batteries', stale)
+		self.assertNotIn('/Debug/Writes', stale)
+		self.assertEqual(self._service['/WarmStart/Stale'], len(stale))
+		self.assertTrue(self._service['/Timers/TimeOnInverter'] >= 100)
+
+		self._add_battery(12.5, 16)
+		self._update_values()
+		self._check_values({
+			'/Dc/Battery/Voltage': 12.5,
+			'/Dc/Battery/Soc': 16})
+		stale = json.loads(self._service['/WarmStart/Paths'] or '[]')
+		self.assertNotIn('/Dc/Battery/Voltage', stale)
+		self.assertNotIn('/Dc/Battery/Soc', stale)
+
+		# Restored values that live data does not replace expire
+		self._remove_device('com.victronenergy.battery.ttyO2')
+		for _ in range(warmstart.WARMSTART_GRACE):
+			self._update_values()
+		self._check_values({
+			'/Dc/Battery/Voltage': None,
+			'/Dc/Battery/Soc': None,
+			'/WarmStart/Paths': None,
+			'/WarmStart/Stale': 0})
+		self.assertIsNone(self._service.published('/Dc/Battery/Voltage'))
+
+	def test_filters_restored(self):
+		from delegates import Dvcc
+		Dvcc.instance._dcsyscurrent.value = 12.5
+		self._system_calc._save_warm_start()
+		self._restart()
+		self.assertEqual(Dvcc.instance._dcsyscurrent.value, 12.5)
+
+	def test_old_snapshot(self):
+		self._warmstart.clock = lambda: 0
+		self._warmstart.save({'/Dc/Battery/Voltage': 12.3}, {})
+		self._warmstart.clock = lambda: warmstart.WARMSTART_MAXAGE + 1
+		self.assertEqual(self._warmstart.load(), None)
+
+	def test_invalid_snapshot(self):
+		with open(self._warmstart.filename, 'w') as f:
+			json.dump({'version': 1}, f)
+		self._restart()
+		self._check_values({'/WarmStart/Stale': 0})
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+import json
+import unittest
+from dbus.exceptions import DBusException
+
+# This adapts sys.path to include all relevant packages
+import context
+
+# our own packages
+from base import TestSystemCalcBase
+import writecollector
+from writecollector import WriteCollector, BlockingCallLogger
+
+# Monkey patching for unit tests
+import patches
+
+class MockConnection(object):
+	""" Records calls. Services in unsupported fail SetItems, the replies
+	    to services in slow are held until reply() or timeout() is
+	    called. Writes to the paths in refuse get the error given there. """
+	def __init__(self, unsupported=(), slow=(), refuse={},
+			error='org.freedesktop.DBus.Error.UnknownMethod'):
+		self.calls = []
+		self.unsupported = unsupported
+		self.error = error
+		self.slow = slow
+		self.refuse = refuse
+		self.waiting = []
+
+	def call_async(self, service, path, interface, method, signature, args,
+			reply_handler, error_handler, timeout=None):
+		arg = dict(args[0]) if method == 'SetItems' else args[0]
+		self.calls.append((service, path, method, arg))
+		if method == 'SetItems' and service in self.unsupported:
+			error_handler(DBusException('No SetItems', name=self.error))
+		elif service in self.slow:
+			self.waiting.append((reply_handler, error_handler))
+		elif method == 'SetItems':
+			reply_handler({p: self.refuse.get(p, 0) for p in arg})
+		else:
+			reply_handler(self.refuse.get(path, 0))
+
+	def reply(self):
+		waiting, self.waiting = self.waiting, []
+		for reply_handler, error_handler in waiting:
+			reply_handler({})
+
+	def timeout(self):
+		waiting, self.waiting = self.waiting, []
+		for reply_handler, error_handler in waiting:
+			error_handler(DBusException('Timeout',
+				name='org.freedesktop.DBus.Error.NoReply'))
+
+class TestWriteCollector(TestSystemCalcBase):
+	def __init__(self, methodName='runTest'):
+		TestSystemCalcBase.__init__(self, methodName)
+
+	def setUp(self):
+		TestSystemCalcBase.setUp(self)
+		self._add_device('com.victronenergy.vecan.can0', values={
+			'/Link/Soc': None,
+			'/Link/ExtraBatteryCurrent': None,
+			'/Link/NetworkMode': None})
+		self._add_device('com.victronenergy.solarcharger.ttyO1', values={
+			'/Link/NetworkMode': None,
+			'/Link/ChargeVoltage': None})
+		self._now = 0
+		self._clock = lambda: self._now
+
+	def test_writes_sent_on_flush(self):
+		writer = WriteCollector(self._monitor)
+		writer.set_value_async('com.victronenergy.vecan.can0', '/Link/Soc', 50)
+		writer.set_value_async('com.victronenergy.vecan.can0', '/Link/Soc', 51)
+		writer.set_value_async('com.victronenergy.vecan.can0', '/Link/NetworkMode', 5)
+		self._check_external_values({
+			'com.victronenergy.vecan.can0': {
+				'/Link/Soc': None,
+				'/Link/NetworkMode': None}})
+
+		writer.flush()
+		self._check_external_values({
+			'com.victronenergy.vecan.can0': {
+				'/Link/Soc': 51,
+				'/Link/NetworkMode': 5}})
+		self.assertEqual(writer.stats()['com.victronenergy.vecan.can0']['coalesced'], 1)
+
+	def test_writes_grouped_by_service(self):
+		conn = MockConnection(unsupported=('com.victronenergy.vecan.can0',))
+		writer = WriteCollector(self._monitor, conn, self._clock)
+
+		for _ in range(2):
+			writer.set_value_async('com.victronenergy.solarcharger.ttyO1', '/Link/NetworkMode', 5)
+			writer.set_value_async('com.victronenergy.solarcharger.ttyO1', '/Link/ChargeVoltage', 55.2)
+			writer.set_value_async('com.victronenergy.vecan.can0', '/Link/Soc', 50)
+			writer.set_value_async('com.victronenergy.vecan.can0', '/Link/NetworkMode', 5)
+			writer.flush()
+
+		# The VE.Can service does not support SetItems, which is only
+		# tried once. The writes are sent again with the next flush.
+		self.assertEqual(conn.calls, [
+			('com.victronenergy.solarcharger.ttyO1', '/', 'SetItems',
+				{'/Link/NetworkMode': 5, '/Link/ChargeVoltage': 55.2}),
+			('com.victronenergy.vecan.can0', '/', 'SetItems',
+				{'/Link/Soc': 50, '/Link/NetworkMode': 5}),
+			('com.victronenergy.solarcharger.ttyO1', '/', 'SetItems',
+				{'/Link/NetworkMode': 5, '/Link/ChargeVoltage': 55.2}),
+			('com.victronenergy.vecan.can0', '/Link/Soc', 'SetValue', 50),
+			('com.victronenergy.vecan.can0', '/Link/NetworkMode', 'SetValue', 5)])
+
+	def test_no_root_object(self):
+		# Without an object at /, SetItems fails with another error. The
+		# writes are not lost, they are sent with SetValue.
+		service = 'com.victronenergy.vecan.can0'
+		conn = MockConnection(unsupported=(service,),
+			error='org.freedesktop.DBus.Error.UnknownObject')
+		writer = WriteCollector(self._monitor, conn, self._clock)
+		results = []
+		writer.set_value_async(service, '/Link/Soc', 50, callback=results.append)
+		writer.set_value_async(service, '/Link/NetworkMode', 5)
+		writer.flush()
+		self.assertEqual(results, [])
+		writer.flush()
+		self.assertEqual(conn.calls[1:], [
+			(service, '/Link/Soc', 'SetValue', 50),
+			(service, '/Link/NetworkMode', 'SetValue', 5)])
+		self.assertEqual(results, [None])
+
+		# Every write counts once, whichever way it is sent
+		self.assertEqual(writer.stats()[service]['sent'], 4)
+
+	def test_setvalue_inflight(self):
+		# Without SetItems, no more than MAX_INFLIGHT SetValue calls wait
+		# for a reply. The other paths wait for a later flush.
+		service = 'com.victronenergy.vecan.can0'
+		conn = MockConnection(unsupported=(service,), slow=(service,))
+		writer = WriteCollector(self._monitor, conn, self._clock)
+		writer.set_value_async(service, '/Link/Soc', 50)
+		writer.set_value_async(service, '/Link/NetworkMode', 5)
+		writer.set_value_async(service, '/Link/ExtraBatteryCurrent', 3)
+		writer.flush()
+		writer.flush()
+		self.assertEqual([c[2] for c in conn.calls], ['SetItems', 'SetValue', 'SetValue'])
+		self.assertEqual(writer.stats()[service]['pending'], 1)
+
+		conn.reply()
+		writer.flush()
+		self.assertEqual(conn.calls[-1],
+			(service, '/Link/ExtraBatteryCurrent', 'SetValue', 3))
+		self.assertEqual(writer.stats()[service]['pending'], 0)
+
+	def test_refused_items(self):
+		service = 'com.victronenergy.solarcharger.ttyO1'
+		conn = MockConnection(refuse={'/Link/ChargeVoltage': 2})
+		writer = WriteCollector(self._monitor, conn, self._clock)
+		results = {}
+		for path, value in (('/Link/NetworkMode', 5), ('/Link/ChargeVoltage', 55.2)):
+			writer.set_value_async(service, path, value,
+				callback=lambda e, path=path: results.setdefault(path, e))
+		writer.flush()
+		self.assertIsNone(results['/Link/NetworkMode'])
+		self.assertIsInstance(results['/Link/ChargeVoltage'], writecollector.WriteRefused)
+		self.assertEqual(writer.stats()[service]['errors'], 1)
+
+	def test_slow_service(self):
+		service = 'com.victronenergy.vecan.can0'
+		conn = MockConnection(slow=(service,))
+		writer = WriteCollector(self._monitor, conn, self._clock)
+
+		# No more than MAX_INFLIGHT calls are outstanding, later writes are
+		# held back and coalesced.
+		for soc in range(50, 55):
+			writer.set_value_async(service, '/Link/Soc', soc)
+			writer.flush()
+		self.assertEqual(len(conn.calls), writecollector.MAX_INFLIGHT)
+		stats = writer.stats()[service]
+		self.assertEqual(stats['pending'], 1)
+		self.assertEqual(stats['coalesced'], 2)
+
+		# When replies come in, the latest value is sent
+		self._now = 0.2
+		conn.reply()
+		writer.flush()
+		self.assertEqual(conn.calls[-1], (service, '/Link/Soc', 'SetValue', 54))
+		self.assertEqual(writer.stats()[service]['latency']['500'], 2)
+		conn.reply()
+
+		# Repeated timeouts quarantine the service
+		for soc in range(writecollector.QUARANTINE_AFTER):
+			writer.set_value_async(service, '/Link/Soc', soc)
+			writer.flush()
+			conn.timeout()
+		calls = len(conn.calls)
+		writer.set_value_async(service, '/Link/Soc', 60)
+		writer.flush()
+		self.assertEqual(len(conn.calls), calls)
+		stats = writer.stats()[service]
+		self.assertEqual(stats['quarantined'], writecollector.QUARANTINE_MIN)
+		self.assertEqual(stats['timeouts'], writecollector.QUARANTINE_AFTER)
+		self.assertTrue(writer.quarantined(service))
+		self.assertFalse(writer.quarantined('com.victronenergy.solarcharger.ttyO1'))
+
+		# After the quarantine, the pending write is sent
+		self._now += writecollector.QUARANTINE_MIN
+		self.assertFalse(writer.quarantined(service))
+		writer.flush()
+		self.assertEqual(conn.calls[-1], (service, '/Link/Soc', 'SetValue', 60))
+
+		# Timing out again quarantines it for longer, a reply ends it
+		conn.timeout()
+		self.assertEqual(writer.stats()[service]['quarantined'],
+			2 * writecollector.QUARANTINE_MIN)
+		self._now += 2 * writecollector.QUARANTINE_MIN
+		writer.set_value_async(service, '/Link/Soc', 61)
+		writer.flush()
+		conn.reply()
+		self.assertEqual(writer.stats()[service]['quarantined'], 0)
+
+		# Never held back for as long as chargers take to drop out of
+		# remote control
+		for soc in range(10):
+			self._now += writecollector.QUARANTINE_MAX
+			writer.set_value_async(service, '/Link/Soc', soc)
+			writer.flush()
+			conn.timeout()
+		self.assertEqual(writer.stats()[service]['quarantined'],
+			writecollector.QUARANTINE_MAX)
+		self.assertTrue(writecollector.QUARANTINE_MAX < 60)
+
+	def test_write_callbacks(self):
+		conn = MockConnection(slow=('com.victronenergy.vecan.can0',))
+		writer = WriteCollector(self._monitor, conn, self._clock)
+		results = []
+
+		# Coalesced writes all learn the outcome of the write that is sent
+		writer.set_value_async('com.victronenergy.vecan.can0', '/Link/Soc', 50,
+			callback=lambda e: results.append(('soc', e)))
+		writer.set_value_async('com.victronenergy.vecan.can0', '/Link/Soc', 51,
+			callback=lambda e: results.append(('soc', e)))
+		writer.set_value_async('com.victronenergy.solarcharger.ttyO1', '/Link/NetworkMode', 5,
+			callback=lambda e: results.append(('mode', e)))
+		writer.flush()
+		self.assertEqual(results, [('mode', None)])
+
+		conn.timeout()
+		self.assertEqual([k for k, e in results], ['mode', 'soc', 'soc'])
+		self.assertEqual(results[1][1].get_dbus_name(),
+			'org.freedesktop.DBus.Error.NoReply')
+
+	def test_blocking_call_logger(self):
+		class Connection(object):
+			def call_blocking(self, bus_name, object_path, dbus_interface, method, *args):
+				return 42
+
+		calls = BlockingCallLogger(Connection)
+		calls.enable()
+		self.assertTrue(calls.enabled)
+		self.assertEqual(Connection().call_blocking('com.victronenergy.settings',
+			'/Settings', 'com.victronenergy.BusItem', 'GetValue'), 42)
+		self.assertEqual(calls.calls, 1)
+		calls.disable()
+		Connection().call_blocking('com.victronenergy.settings',
+			'/Settings', 'com.victronenergy.BusItem', 'GetValue')
+		self.assertEqual(calls.calls, 1)
+
+		self._service.set_value('/Debug/LogBlockingCalls', 1)
+		self.assertTrue(self._system_calc._blocking_calls.enabled)
+		self._service.set_value('/Debug/LogBlockingCalls', 0)
+		self.assertFalse(self._system_calc._blocking_calls.enabled)
+
+	def test_debug_writes(self):
+		self._system_calc.writer.set_value_async('com.victronenergy.vecan.can0', '/Link/Soc', 50)
+		self._update_values()
+		stats = json.loads(self._service['/Debug/Writes'])
+		self.assertEqual(stats['com.victronenergy.vecan.can0']['sent'], 1)
+
+if __name__ == '__main__':
+	unittest.main()
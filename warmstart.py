@@ -0,0 +1,72 @@
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Snapshots are taken every this many ticks
+WARMSTART_INTERVAL = 60
+
+# Snapshots older than this many seconds are not restored
+WARMSTART_MAXAGE = 600
+
+# Restored outputs that live data has not replaced after this many ticks
+# are dropped
+WARMSTART_GRACE = 60
+
+# Paths that are not kept: debug data, and the paths that tell which
+# devices are present now
+WARMSTART_SKIP = ('/Debug/', '/WarmStart/', '/ServiceMapping/')
+
+class WarmStart(object):
+	""" Keeps a snapshot of our outputs and the internal state of the
+	    delegates in a small file, so that a restarted process can pick up
+	    where the previous one left off. The file is replaced atomically,
+	    a crash halfway through a save leaves the previous snapshot. Put it
+	    on a tmpfs: it should survive a restart of the process, but not a
+	    reboot. """
+	version = 1
+
+	def __init__(self, filename, clock=time.time):
+		self.filename = filename
+		self.clock = clock
+
+	def load(self):
+		""" Returns the snapshot as a dict with outputs and delegates, or
+		    None if there is no usable one. """
+		try:
+			with open(self.filename, 'r') as f:
+				snapshot = json.load(f)
+		except FileNotFoundError:
+			return None
+		except (OSError, ValueError) as e:
+			logger.warning('Cannot read warm start snapshot %s: %s', self.filename, e)
+			return None
+
+		try:
+			if snapshot['version'] != self.version:
+				return None
+			age = self.clock() - snapshot['time']
+			if not 0 <= age <= WARMSTART_MAXAGE:
+				logger.info('Warm start snapshot is %d seconds old, not using it', age)
+				return None
+			return {
+				'outputs': dict(snapshot['outputs']),
+				'delegates': dict(snapshot['delegates'])}
+		except (KeyError, TypeError, ValueError):
+			logger.warning('Invalid warm start snapshot %s', self.filename)
+			return None
+
+	def save(self, outputs, delegates):
+		tmp = self.filename + '.tmp'
+		try:
+			with open(tmp, 'w') as f:
+				json.dump({
+					'version': self.version,
+					'time': self.clock(),
+					'outputs': outputs,
+					'delegates': delegates}, f, separators=(',', ':'))
+			os.replace(tmp, self.filename)
+		except (OSError, TypeError, ValueError) as e:
+			logger.warning('Cannot write warm start snapshot %s: %s', self.filename, e)
@@ -0,0 +1,336 @@
+import logging
+import time
+import traceback
+from bisect import bisect_left
+from collections import OrderedDict
+import dbus
+import dbus.connection
+from dbus.exceptions import DBusException
+from gi.repository import GLib
+
+# Victron packages
+from ve_utils import wrap_dbus_value
+from sc_utils import exit_on_error
+
+logger = logging.getLogger(__name__)
+
+# At most this many calls to a service may be waiting for a reply. Further
+# writes are held back, and coalesced with later writes to the same path.
+MAX_INFLIGHT = 2
+
+# Calls that get no reply within this many seconds count as a timeout
+WRITE_TIMEOUT = 5.0
+
+# After this many timeouts in a row, writes to a service are held back for
+# QUARANTINE_MIN seconds. The time doubles with every further timeout, up to
+# QUARANTINE_MAX, until the service replies again. Chargers drop out of
+# remote control when /Link/* is not written for 60 seconds, so DVCC must
+# get a write through well within that.
+QUARANTINE_AFTER = 3
+QUARANTINE_MIN = 10
+QUARANTINE_MAX = 30
+
+# Upper bounds of the reply latency histogram, in milliseconds
+LATENCY_BUCKETS = (10, 50, 100, 500, 1000, 5000)
+
+class WriteRefused(Exception):
+	""" Passed to the callback of a write that the service replied to,
+	    but did not carry out. """
+	def __init__(self, service, path, result):
+		Exception.__init__(self, '{} refused {}: {}'.format(service, path, result))
+		self.result = result
+
+def _refused(method, path, reply):
+	""" Returns a dict of the paths that a reply to SetValue or SetItems
+	    reports as not set, and the result for each. """
+	if not reply:
+		return {}
+	result = reply[0]
+	if method == 'SetValue':
+		return {path: result} if isinstance(result, int) and result != 0 else {}
+	if isinstance(result, dict):
+		results = result.items()
+	else:
+		results = ((r.get('path'), r) for r in result)
+	refused = {}
+	for p, r in results:
+		error = r.get('error', 0) if isinstance(r, dict) else r
+		if error != 0:
+			refused[str(p)] = error
+	return refused
+
+class WriteTarget(object):
+	""" Pending writes and statistics for a single service. """
+	def __init__(self):
+		self.pending = OrderedDict() # path -> value
+		self.callbacks = {} # path -> [callback, ...]
+		self.inflight = 0
+		self.sent = 0
+		self.coalesced = 0
+		self.errors = 0
+		self.timeouts = 0
+		self.consecutive_timeouts = 0
+		self.backoff = 0
+		self.quarantined_until = None
+		self.setitems = True
+		self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+
+	def record_latency(self, seconds):
+		self.latency[bisect_left(LATENCY_BUCKETS, seconds * 1000)] += 1
+
+	def stats(self, now):
+		return {
+			'pending': len(self.pending),
+			'inflight': self.inflight,
+			'sent': self.sent,
+			'coalesced': self.coalesced,
+			'errors': self.errors,
+			'timeouts': self.timeouts,
+			'quarantined': 0 if self.quarantined_until is None else \
+				max(0, round(self.quarantined_until - now)),
+			'latency': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'],
+				self.latency))
+		}
+
+class WriteCollector(object):
+	""" Collects the writes made to other services during a tick, and sends
+	    all writes to the same service in a single SetItems call when the
+	    tick is done. Services where SetItems fails, other than by a
+	    timeout, get individual SetValue calls from then on. Only the last value written to a path is
+	    sent.
+
+	    Writes are sent when flush() is called, which the timers that make
+	    them do when they are done. As a safety net, a flush is also
+	    scheduled on the main loop when the first write is collected.
+
+	    Writes to a service that still has MAX_INFLIGHT calls waiting for a
+	    reply, or that is quarantined after repeated timeouts, stay pending
+	    until a later flush. Without SetItems, only as many SetValue calls
+	    are made as may wait for a reply, the other paths wait too.
+
+	    A callback passed with a write is called with None when it
+	    completed, or with the exception if it failed. A WriteRefused
+	    means the service replied, but did not set the path. When writes to a
+	    path are coalesced, all their callbacks get the outcome of the
+	    write that is sent.
+
+	    Without a bus (conn is None) all writes are passed to
+	    monitor.set_value_async, and are not tracked.
+
+	    Writes are also recorded on recorder, a FlightRecorder, if set. """
+	def __init__(self, monitor, conn=None, clock=time.monotonic):
+		self.monitor = monitor
+		self.conn = conn
+		self.clock = clock
+		self.recorder = None
+		self.changed = False
+		self._targets = {} # service -> WriteTarget
+		self._queued = OrderedDict() # services with pending writes
+		self._scheduled = False
+
+	def set_value_async(self, service, path, value, callback=None):
+		if self.recorder is not None:
+			self.recorder.record('write', service, path, value)
+		target = self._targets.get(service)
+		if target is None:
+			target = self._targets[service] = WriteTarget()
+		if path in target.pending:
+			target.coalesced += 1
+		target.pending[path] = value
+		if callback is not None:
+			target.callbacks.setdefault(path, []).append(callback)
+		self._queued[service] = target
+		self._schedule()
+
+	def _schedule(self):
+		if not self._scheduled:
+			self._scheduled = True
+			GLib.idle_add(exit_on_error, self._flush_idle)
+
+	def _flush_idle(self):
+		self.flush()
+		return False
+
+	def flush(self):
+		self._scheduled = False
+		now = self.clock()
+		for service, target in list(self._queued.items()):
+			if target.quarantined_until is not None:
+				if now < target.quarantined_until:
+					continue
+				target.quarantined_until = None
+			if target.inflight >= MAX_INFLIGHT:
+				continue
+			self._send(service, target)
+			if not target.pending:
+				del self._queued[service]
+			self.changed = True
+
+	def service_removed(self, service):
+		""" Forget what we know about a service, it might come back with
+		    different capabilities. """
+		self._queued.pop(service, None)
+		if self._targets.pop(service, None) is not None:
+			self.changed = True
+
+	def quarantined(self, service):
+		""" Returns True while writes to service are held back, after
+		    repeated timeouts. """
+		target = self._targets.get(service)
+		return target is not None and target.quarantined_until is not None \
+			and self.clock() < target.quarantined_until
+
+	def stats(self):
+		now = self.clock()
+		return {service: target.stats(now) for service, target in self._targets.items()}
+
+	@staticmethod
+	def _complete(callbacks, error):
+		for cbs in callbacks.values():
+			for cb in cbs:
+				cb(error)
+
+	@staticmethod
+	def _take(target, count=None):
+		""" Takes the first count pending writes, or all of them, and
+		    their callbacks. """
+		if count is None or count >= len(target.pending):
+			items, target.pending = target.pending, OrderedDict()
+			callbacks, target.callbacks = target.callbacks, {}
+			return items, callbacks
+		items = OrderedDict()
+		callbacks = {}
+		for path in list(target.pending)[:count]:
+			items[path] = target.pending.pop(path)
+			if path in target.callbacks:
+				callbacks[path] = target.callbacks.pop(path)
+		return items, callbacks
+
+	def _send(self, service, target):
+		if self.conn is None:
+			items, callbacks = self._take(target)
+			target.sent += len(items)
+			for path, value in items.items():
+				self.monitor.set_value_async(service, path, value)
+			self._complete(callbacks, None)
+		elif len(target.pending) > 1 and target.setitems:
+			items, callbacks = self._take(target)
+			self._call(service, target, '/', 'SetItems', 'a{sv}', dbus.Dictionary({
+				path: wrap_dbus_value(value) for path, value in items.items()},
+				signature='sv'), items, callbacks)
+		else:
+			# One call per path, the rest waits for a later flush
+			items, callbacks = self._take(target, MAX_INFLIGHT - target.inflight)
+			for path, value in items.items():
+				self._call(service, target, path, 'SetValue', 'v',
+					wrap_dbus_value(value), {path: value},
+					{path: callbacks[path]} if path in callbacks else {})
+
+	def _call(self, service, target, path, method, signature, arg, items, callbacks):
+		start = self.clock()
+
+		def done():
+			target.inflight -= 1
+			self.changed = True
+			if service in self._queued:
+				self._schedule()
+
+		def reply_handler(*args):
+			done()
+			target.record_latency(self.clock() - start)
+			target.consecutive_timeouts = 0
+			target.backoff = 0
+			refused = _refused(method, path, args)
+			for p, result in refused.items():
+				target.errors += 1
+				logger.debug('%s refused %s: %s', service, p, result)
+				for cb in callbacks.pop(p, ()):
+					cb(WriteRefused(service, p, result))
+			self._complete(callbacks, None)
+
+		def error_handler(e):
+			done()
+			name = e.get_dbus_name()
+			if method == 'SetItems' and name != 'org.freedesktop.DBus.Error.NoReply':
+				# No SetItems, or no object at / to call it on
+				logger.info('SetItems on %s failed (%s), using SetValue', service, name)
+				target.setitems = False
+				self._requeue(service, target, items, callbacks)
+				return
+			if name == 'org.freedesktop.DBus.Error.NoReply':
+				target.timeouts += 1
+				target.consecutive_timeouts += 1
+				if target.consecutive_timeouts >= QUARANTINE_AFTER:
+					self._quarantine(service, target)
+			else:
+				target.errors += 1
+				logger.debug('%s on %s%s failed: %s', method, service, path, e)
+			self._complete(callbacks, e)
+
+		target.inflight += 1
+		target.sent += len(items)
+		try:
+			self.conn.call_async(service, path, 'com.victronenergy.BusItem',
+				method, signature, [arg], reply_handler, error_handler,
+				timeout=WRITE_TIMEOUT)
+		except DBusException as e:
+			# In case service goes down while we write, ignore
+			target.inflight -= 1
+			target.errors += 1
+			self._complete(callbacks, e)
+
+	def _requeue(self, service, target, items, callbacks):
+		""" Puts writes back in front of the pending ones, unless a later
+		    write to the same path is pending. """
+		pending = OrderedDict((p, v) for p, v in items.items() if p not in target.pending)
+		pending.update(target.pending)
+		target.pending = pending
+		for path, cbs in callbacks.items():
+			target.callbacks[path] = cbs + target.callbacks.get(path, [])
+		self._queued[service] = target
+		self._schedule()
+
+	def _quarantine(self, service, target):
+		target.backoff = min(QUARANTINE_MAX, max(QUARANTINE_MIN, target.backoff * 2))
+		target.quarantined_until = self.clock() + target.backoff
+		# One more timeout after this quarantines it again, for longer
+		target.consecutive_timeouts = QUARANTINE_AFTER - 1
+		logger.warning('Writes to %s timed out, holding them back for %d seconds',
+			service, target.backoff)
+
+class BlockingCallLogger(object):
+	""" Debug aid that logs every blocking D-Bus call made through cls,
+	    with its duration and the call site. Such calls stall the main
+	    loop until the other side replies. """
+	def __init__(self, cls=dbus.connection.Connection, clock=time.monotonic):
+		self.cls = cls
+		self.clock = clock
+		self.calls = 0
+		self._original = None
+
+	@property
+	def enabled(self):
+		return self._original is not None
+
+	def enable(self):
+		if self._original is not None:
+			return
+		original = self._original = self.cls.call_blocking
+
+		def call_blocking(conn, bus_name, object_path, dbus_interface, method, *args, **kwargs):
+			start = self.clock()
+			try:
+				return original(conn, bus_name, object_path, dbus_interface,
+					method, *args, **kwargs)
+			finally:
+				self.calls += 1
+				logger.warning('Blocking call %s.%s on %s%s took %.1f ms, from\n%s',
+					dbus_interface, method, bus_name, object_path,
+					(self.clock() - start) * 1000,
+					''.join(traceback.format_stack()[:-1]))
+		self.cls.call_blocking = call_blocking
+
+	def disable(self):
+		if self._original is not None:
+			self.cls.call_blocking = self._original
+			self._original = None